@@ -0,0 +1,244 @@
+"""Compare cc2logger parser throughput on a large synthetic log"""
+import json
+import resource
+import subprocess
+import sys
+import time
+import tempfile
+import tracemalloc
+from argparse import ArgumentParser
+from pathlib import Path
+from cc2logger.parser import CC2GameParser, CC2GameFollower
+from cc2logger.messages import MessageFactory
+from cc2logger.checkpoint import CheckpointedParser
+from cc2logger.synthetic import generate_log, generate_folder
+
+TOP = Path(__file__).parent.absolute()
+SUITE = ["read", "read_path", "follower"]
+# every suite result is compared as a ratio to this run of the original line reader on the same
+# machine, so the stored baseline holds across machines
+REFERENCE = "line"
+
+parser = ArgumentParser(description=__doc__)
+parser.add_argument("--records", type=int, help="Number of records to generate, default 2M or 400k for --suite")
+parser.add_argument("--messages", action="store_true", help="Only measure message construction time and memory")
+parser.add_argument("--snapshot", action="store_true", help="Compare checkpoint/snapshot loading with a full reparse")
+parser.add_argument("--players", type=int, default=16, help="Number of distinct players in the generated log")
+parser.add_argument("--suite", action="store_true",
+                    help="Run the read/read_path/follower suite and compare with the stored baseline, "
+                         "relative to the line reader on this machine")
+parser.add_argument("--files", type=int, default=4, help="Number of logs generated for the suite")
+parser.add_argument("--baseline", type=Path, default=TOP / "bench_baseline.json", help="Suite baseline file")
+parser.add_argument("--save-baseline", action="store_true", help="Store the suite results as the new baseline")
+parser.add_argument("--tolerance", type=float, default=0.25,
+                    help="Allowed fractional slowdown or memory growth against the baseline")
+parser.add_argument("--run-one", nargs=2, metavar=("NAME", "FOLDER"), help="Run one suite benchmark in this process, used by --suite")
+
+
+def report(name: str, size: int, records: int, elapsed: float) -> None:
+    print(f"{name:16} {elapsed:8.2f} s {size / elapsed / 1e6:8.1f} MB/s {records / elapsed:10.0f} records/s")
+
+
+def bench_engine(logfile: Path, engine: str) -> None:
+    size = logfile.stat().st_size
+    p = CC2GameParser()
+    p.engine = engine
+    p.open(logfile)
+    records = 0
+    started = time.perf_counter()
+    while p.read_record() is not None:
+        records += 1
+    report(f"{engine} records", size, records, time.perf_counter() - started)
+    p.close()
+
+    p = CC2GameParser()
+    p.engine = engine
+    started = time.perf_counter()
+    p.read(logfile)
+    report(f"{engine} parse", size, records, time.perf_counter() - started)
+
+
+def read_messages(logfile: Path, factory: MessageFactory) -> list:
+    p = CC2GameParser()
+    p.open(logfile)
+    messages = []
+    while True:
+        data = p.read_record()
+        if data is None:
+            break
+        messages.append(factory.parse(data))
+    p.close()
+    return messages
+
+
+def bench_messages(logfile: Path) -> None:
+    factory = MessageFactory()
+    p = CC2GameParser()
+    p.open(logfile)
+    records = []
+    while True:
+        data = p.read_record()
+        if data is None:
+            break
+        records.append(data)
+    p.close()
+
+    parse = factory.parse
+    started = time.perf_counter()
+    for data in records:
+        parse(data)
+    elapsed = time.perf_counter() - started
+    print(f"construct        {elapsed:8.2f} s {len(records) / elapsed:10.0f} messages/s")
+    del records
+
+    # everything the messages keep alive, including any source dicts
+    tracemalloc.start()
+    messages = read_messages(logfile, factory)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"memory           {current / 1e6:8.1f} MB {current / len(messages):10.1f} bytes/message")
+
+
+def bench_snapshot(folder: Path) -> None:
+    started = time.perf_counter()
+    full = CC2GameParser()
+    full.read_path(folder)
+    print(f"full reparse     {time.perf_counter() - started:8.3f} s")
+
+    for name in ["checkpoint.json", "checkpoint.snap"]:
+        checkpoint = folder / name
+        CheckpointedParser(checkpoint).refresh(folder)
+        started = time.perf_counter()
+        warm = CheckpointedParser(checkpoint)
+        warm.refresh(folder)
+        elapsed = time.perf_counter() - started
+        print(f"{name:16} {elapsed:8.3f} s {checkpoint.stat().st_size:10} bytes")
+
+
+class CountingParser(CC2GameParser):
+    def __init__(self):
+        super().__init__()
+        self.records = 0
+
+    def on_message(self, data: dict):
+        self.records += 1
+        return super().on_message(data)
+
+
+class CountingFollower(CC2GameFollower):
+    def __init__(self):
+        super().__init__()
+        self.records = 0
+
+    def on_message(self, data: dict):
+        self.records += 1
+        return super().on_message(data)
+
+
+def run_one(name: str, folder: Path) -> dict:
+    """Run one benchmark, meant to be in a fresh process so peak RSS is its own"""
+    logs = sorted(folder.glob("game_log_*.jsonl"))
+    started = time.perf_counter()
+    if name in ("read", REFERENCE):
+        p = CountingParser()
+        if name == REFERENCE:
+            p.engine = "line"
+        p.read(logs[0])
+        size = logs[0].stat().st_size
+    elif name == "read_path":
+        p = CountingParser()
+        p.read_path(folder)
+        size = sum(x.stat().st_size for x in logs)
+    elif name == "follower":
+        p = CountingFollower()
+        p.use_inotify = False
+        p.callbacks.append(lambda msg: False)
+        p.open_latest(folder)
+        while p.read_one():
+            pass
+        p.close()
+        size = logs[-1].stat().st_size
+    else:
+        raise KeyError(name)
+    elapsed = time.perf_counter() - started
+    return {
+        "records_per_sec": p.records / elapsed,
+        "mb_per_sec": size / elapsed / 1e6,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def run_suite(opts) -> int:
+    with tempfile.TemporaryDirectory() as tmpdir:
+        folder = Path(tmpdir)
+        generate_folder(folder, opts.records, files=opts.files, players=opts.players)
+        print(f"{sum(x.stat().st_size for x in folder.iterdir()) / 1e6:.1f} MB, {opts.records} records "
+              f"in {opts.files} logs")
+        results = {}
+        for name in [REFERENCE, *SUITE]:
+            output = subprocess.check_output([sys.executable, __file__, "--run-one", name, tmpdir], cwd=TOP)
+            results[name] = json.loads(output)
+    reference = results.pop(REFERENCE)
+    for result in results.values():
+        result["speed_ratio"] = result["records_per_sec"] / reference["records_per_sec"]
+        result["memory_ratio"] = result["peak_rss_mb"] / reference["peak_rss_mb"]
+
+    key = f"{opts.records}x{opts.files}"
+    baselines = {}
+    if opts.baseline.exists():
+        baselines = json.loads(opts.baseline.read_text(encoding="utf-8"))
+    # baselines saved before the ratios were added hold machine specific numbers, ignore them
+    baseline = {name: x for name, x in baselines.get(key, {}).items() if "speed_ratio" in x}
+
+    failed = 0
+    for name, result in results.items():
+        line = (f"{name:12} {result['records_per_sec']:10.0f} records/s {result['mb_per_sec']:8.1f} MB/s "
+                f"{result['peak_rss_mb']:8.1f} MB peak RSS {result['speed_ratio']:5.2f}x {REFERENCE} speed")
+        if name in baseline:
+            old = baseline[name]
+            speed = result["speed_ratio"] / old["speed_ratio"]
+            memory = result["memory_ratio"] / old["memory_ratio"]
+            line += f"   {speed:5.2f}x speed {memory:5.2f}x memory"
+            if speed < 1 - opts.tolerance or memory > 1 + opts.tolerance:
+                line += "  REGRESSION"
+                failed += 1
+        print(line)
+
+    if opts.save_baseline:
+        # only the ratios mean anything on another machine
+        baselines[key] = {name: {"speed_ratio": x["speed_ratio"], "memory_ratio": x["memory_ratio"]}
+                          for name, x in results.items()}
+        opts.baseline.write_text(json.dumps(baselines, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+        print(f"saved baseline {key} in {opts.baseline}")
+    elif not baseline:
+        print(f"no baseline for {key}, use --save-baseline to store one")
+    return 1 if failed else 0
+
+
+def main():
+    opts = parser.parse_args()
+    if opts.run_one:
+        name, folder = opts.run_one
+        print(json.dumps(run_one(name, Path(folder))))
+        return
+    if opts.suite:
+        opts.records = opts.records or 400000
+        sys.exit(run_suite(opts))
+    opts.records = opts.records or 2000000
+    with tempfile.TemporaryDirectory() as tmpdir:
+        logfile = Path(tmpdir) / "game_log_bench.jsonl"
+        with logfile.open("w", encoding="utf-8") as fd:
+            generate_log(fd, opts.records, players=opts.players)
+        print(f"{logfile.stat().st_size / 1e6:.1f} MB, {opts.records} records")
+        if opts.messages:
+            bench_messages(logfile)
+            return
+        if opts.snapshot:
+            bench_snapshot(Path(tmpdir))
+            return
+        for engine in ["line", "block", "mmap"]:
+            bench_engine(logfile, engine)
+
+
+if __name__ == "__main__":
+    main()
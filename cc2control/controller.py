@@ -6,28 +6,36 @@ This usually runs under wine or on windows and listens on a local TCP socket.
 """
 import os
 import platform
+import queue
 import sys
 import time
 import yaml
 import subprocess
-from threading import Thread
+from threading import Lock, Thread
 from datetime import datetime
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Optional
 from argparse import ArgumentParser
 from .types import ControllerProtocol, ControllerConfig
 from .serverstats import Stats
 from .service.server import start_server
 
-from cc2logger.parser import CC2GameFollower, CC2GameParser, generate_lua_stats_page, Player
-from cc2logger.messages import PlayerChat, MessageBase
+from cc2logger.parser import CC2GameFollower, write_lua_stats_page, Player, AGGREGATED_TYPES
+from cc2logger.checkpoint import CheckpointedParser
+from cc2logger.fanout import FanOut, OverflowPolicy
+from cc2logger.multitail import MultiTailer
+from cc2logger.messages import PlayerChat, MessageBase, DestroyedVehicle, CapturedIsland
+from cc2logger.timing import profiler
 from .servercfgfile import ServerConfigXml
 
 
 parser = ArgumentParser(description=__doc__)
-parser.add_argument("--game-dir", type=Path, default=Path("Carrier Command 2"), help="Directory to the cc2 installation")
+parser.add_argument("--game-dir", type=Path, action="append",
+                    help="Directory to the cc2 installation, default 'Carrier Command 2'. Give it more than once to "
+                         "control several servers from one process, their logs are then read by one shared thread")
 parser.add_argument("--config", type=str, help="Switch config file")
 parser.add_argument("--debug", default=False, action="store_true")
+parser.add_argument("--profile", default=False, action="store_true", help="Time each stage of log parsing")
 
 
 def read_server_config(server_config: Path) -> ServerConfigXml:
@@ -38,19 +46,29 @@ def read_server_config(server_config: Path) -> ServerConfigXml:
 
 def main():
     opts = parser.parse_args()
-    os.chdir(opts.game_dir)
+    game_dirs = opts.game_dir or [Path("Carrier Command 2")]
     if opts.debug:
         os.environ["DEBUG"] = "1"
-    controller = ServerController(Path.cwd())
-
-    if opts.config:
-        controller.apply_config(opts.config)
-
-    controller.run()
-    print(f"Listening for control on port {controller.listen_port}")
-
-    while not controller.quit:
-        time.sleep(2)
+    if opts.profile:
+        profiler.enable()
+    if len(game_dirs) == 1:
+        os.chdir(game_dirs[0])
+        controllers = [ServerController(Path.cwd())]
+    else:
+        tailer = MultiTailer()
+        tailer.start()
+        controllers = [ServerController(x.absolute(), tailer) for x in game_dirs]
+
+    for controller in controllers:
+        if opts.config:
+            controller.apply_config(opts.config)
+        controller.run()
+        print(f"Listening for control of {controller.game_folder} on port {controller.listen_port}")
+
+    while not all(x.quit for x in controllers):
+        for controller in controllers:
+            controller.run_requests(2 / len(controllers))
+            controller.idle()
 
 
 def is_linux() -> bool:
@@ -66,19 +84,22 @@ def debug(msg):
         print(msg)
 
 
-def gather_player_stats(game_dir: Path):
+def gather_player_stats(game_dir: Path, data_dir: Path):
     print("generating server stats ..")
-    cp = CC2GameParser()
     logs_dir = game_dir / "logs"
-    cp.read_path(logs_dir)
+    # the checkpoint is ours, not the game's, so it is kept out of the logs folder
+    data_dir.mkdir(parents=True, exist_ok=True)
+    cp = CheckpointedParser(data_dir / "player_stats.snap")
+    cp.debug_enabled = "DEBUG" in os.environ
+    cp.refresh(logs_dir)
 
     rev_mod = game_dir / "mods" / "rev" / "content" / "scripts"
 
     if rev_mod.exists():
-        server_stats_lua = generate_lua_stats_page(cp)
-        if server_stats_lua:
-            debug(f"stats ({len(server_stats_lua)} bytes)")
-            (rev_mod / "library_custom_9.lua").write_bytes(server_stats_lua.encode("utf-8"))
+        if write_lua_stats_page(cp, rev_mod / "library_custom_9.lua"):
+            debug("stats page updated")
+        else:
+            debug("stats page unchanged")
 
 
 
@@ -96,12 +117,13 @@ def load_controller_config(cfg_file: Optional[Path] = None) -> ControllerConfig:
     cert = data.get("cert", None)
     ca = data.get("ca", None)
 
+    # relative to the game folder, which is not the working directory when running several servers
     if key:
-        key = Path(key)
+        key = cfg_file.parent / key
     if cert:
-        cert = Path(cert)
+        cert = cfg_file.parent / cert
     if ca:
-        ca = Path(ca)
+        ca = cfg_file.parent / ca
 
     return ControllerConfig(
         port=port,
@@ -116,14 +138,18 @@ class ServerController(ControllerProtocol):
 
     DEFAULT_PORT = 43432
 
-    def __init__(self, game_folder: Path):
+    def __init__(self, game_folder: Path, tailer: Optional[MultiTailer] = None):
         self.game_folder: Path = game_folder
+        # one tailer can read the logs of every server in this process, else ServerLoop polls our own
+        self.tailer = tailer
         self.server_process: Optional[subprocess.Popen] = None
         self.server_output: Path = self.game_folder / "server.log"
         self.server_xml: Path = self.game_folder / "server_config.xml"
         self.controller_yml: Path = self.game_folder / "controller.yml"
         self._controller_cfg = load_controller_config(self.controller_yml)
         self.server_configs: Path = game_folder / "configs"
+        # files the controller keeps for itself, such as the player stats checkpoint
+        self.data_dir: Path = game_folder / "controller_data"
         self.follower: Optional[CC2GameFollower] = None
         self.server_cfg = read_server_config(self.server_xml)
         self.message_loop: Optional[ServerLoop] = None
@@ -133,21 +159,39 @@ class ServerController(ControllerProtocol):
         self.listen_addr = self.controller_cfg.addr
         self.server_ctx = None
         self.stats = [Stats()]
+        # work asked for from other threads, run by the main thread
+        self.requests: queue.Queue[Callable[[], None]] = queue.Queue()
 
     @property
     def controller_cfg(self) -> ControllerConfig:
         return self._controller_cfg
 
     @property
-    def game_stats(self) -> dict[str, int]:
+    def game_stats(self) -> dict[str, float]:
         current = self.stats[-1]
         data = {
-            "units_destroyed": len(current.destroyed_vehicles),
-            "islands_captured": len(current.captured_islands),
+            "units_destroyed": current.units_destroyed,
+            "islands_captured": current.islands_captured,
         }
+        data.update(current.rates())
+        if self.tailer and self.follower:
+            lag = self.tailer.lag().get(str(self.game_folder))
+            if lag:
+                data["log_behind_bytes"] = lag["behind_bytes"]
+                data["log_delay"] = lag["delay"]
+        if self.follower and self.follower.fanout:
+            for name, sub_stats in self.follower.fanout.stats().items():
+                data[f"{name}_queue_depth"] = sub_stats["queue_depth"]
+                data[f"{name}_dropped"] = sub_stats["dropped"]
 
         return data
 
+    @property
+    def parser_profile(self) -> dict:
+        if profiler.enabled:
+            return profiler.report()
+        return {}
+
     @property
     def server_name(self) -> str:
         return self.server_cfg.server_name
@@ -238,6 +282,30 @@ class ServerController(ControllerProtocol):
         self.stop()
         self.start()
 
+    def request(self, func: Callable[[], None]) -> None:
+        """Have the main thread call func, for threads that stop() would wait on such as the subscribers"""
+        self.requests.put(func)
+
+    def run_requests(self, timeout: float) -> None:
+        """Call the funcs passed to request(), waiting up to timeout seconds for the first one"""
+        try:
+            func = self.requests.get(timeout=timeout)
+            while True:
+                try:
+                    func()
+                except Exception as err:
+                    print(f"controller request failed: {type(err)} {err}")
+                func = self.requests.get_nowait()
+        except queue.Empty:
+            pass
+
+    def idle(self) -> None:
+        """Called by the main loop between requests"""
+        if self.tailer and self.message_loop:
+            # the stats page is otherwise only refreshed when an event arrives, so the last events
+            # before a quiet spell would never show
+            self.message_loop.refresh_player_stats()
+
     def status(self) -> str:
         if self.server_process and self.server_process.poll() is None:
             return "Running"
@@ -263,7 +331,7 @@ class ServerController(ControllerProtocol):
     def get_pid(self) -> int:
         if not is_linux():
             return self.server_process.pid
-        # look in /proc for a process called "dedicated_server.exe" that has the same cwd as we do
+        # look in /proc for a process called "dedicated_server.exe" running in our game folder
         for item in os.listdir("/proc"):
             try:
                 pid = int(item, 10)
@@ -275,7 +343,7 @@ class ServerController(ControllerProtocol):
                 text = cmdline.read_text(encoding="utf-8").strip()
                 if text.startswith("dedicated_server.exe"):
                     cwd = Path(os.readlink(procdir / "cwd"))
-                    if cwd == Path.cwd():
+                    if cwd == self.game_folder.resolve():
                         return pid
 
         raise EnvironmentError("cannot find server process")
@@ -303,6 +371,10 @@ class ServerController(ControllerProtocol):
     def stop(self) -> None:
         if self.message_loop:
             self.message_loop.quit = True
+        if self.tailer and self.follower:
+            self.tailer.remove(str(self.game_folder))
+            if self.follower.fanout:
+                self.follower.fanout.close(timeout=5)
 
         if self.server_process:
             print("Stopping server..")
@@ -369,19 +441,31 @@ class ServerController(ControllerProtocol):
             print(f"Admin: {admin}")
 
         self.follower = CC2GameFollower()
-        self.follower.callbacks.append(self.handle_stats_event)
+        self.follower.fanout = FanOut()
+        # counting is cheap, so wait for room rather than lose kills, captures or chat from the rates
+        self.follower.fanout.subscribe(self.handle_stats_event, policy=OverflowPolicy.block, name="stats",
+                                       types=[DestroyedVehicle, CapturedIsland, PlayerChat])
         self.follower.debug_enabled = "DEBUG" in os.environ
-        self.follower.open_latest(self.game_folder / "logs")
+        if self.tailer:
+            self.tailer.add(self.game_folder / "logs", name=str(self.game_folder), follower=self.follower)
+        else:
+            self.follower.open_latest(self.game_folder / "logs")
         self.message_loop = ServerLoop(self)
-        self.follower.callbacks.append(self.message_loop.handle_chat_message)
-        self.message_loop.start()
+        self.follower.fanout.subscribe(self.message_loop.handle_chat_message, name="chat", types=[PlayerChat])
+        if self.tailer:
+            # nothing to poll, refresh the stats page as events arrive instead
+            self.follower.fanout.subscribe(self.message_loop.refresh_player_stats,
+                                           policy=OverflowPolicy.drop_oldest, name="player_stats",
+                                           types=AGGREGATED_TYPES)
+        else:
+            self.message_loop.start()
 
     def run_game(self) -> None:
         try:
             while not self.quit:
                 self.start()
                 self.wait_stopped()
-            if self.message_loop:
+            if self.message_loop and self.message_loop.is_alive():
                 self.message_loop.join()
                 self.message_loop = None
         except KeyboardInterrupt:
@@ -396,7 +480,12 @@ class ServerLoop(Thread):
     def __init__(self, controller: ServerController):
         super().__init__(daemon=True)
         self.controller = controller
+        self.follower = controller.follower
         self.quit = False
+        self.last_stats = 0
+        self.stats_interval = 600
+        # held while the stats are gathered, by the main loop or the player_stats subscriber
+        self._refreshing = Lock()
 
     def handle_chat_message(self, msg: MessageBase) -> bool:
         if isinstance(msg, PlayerChat):
@@ -413,14 +502,15 @@ class ServerLoop(Thread):
         return False
 
     def handle_admin_chat_message(self, message: str) -> None:
+        # this runs on the chat subscriber's thread, which stopping the server closes and joins,
+        # so the commands are handed to the main thread
         command = message.lstrip("/")
         words = command.split()
 
         if words[0] == "restart":
-            self.stop()
+            self.controller.request(self.stop)
         if words[0] == "shutdown":
-            self.controller.quit = True
-            self.stop()
+            self.controller.request(self.shutdown)
         if words[0] == "config":
             cfg_name = words[1]
             if "/" in cfg_name:
@@ -429,30 +519,47 @@ class ServerLoop(Thread):
                 return
             if ":" in cfg_name:
                 return
-            self.stop()
-            self.controller.apply_config(cfg_name)
+
+            def apply_config():
+                self.stop()
+                self.controller.apply_config(cfg_name)
+            self.controller.request(apply_config)
+
+    def refresh_player_stats(self, msg: Optional[MessageBase] = None) -> bool:
+        if not self._refreshing.acquire(blocking=False):
+            # already being gathered on another thread
+            return False
+        try:
+            elapsed = time.monotonic() - self.last_stats
+            if elapsed > self.stats_interval:
+                self.last_stats = time.monotonic()
+                gather_player_stats(self.controller.game_folder, self.controller.data_dir)
+        finally:
+            self._refreshing.release()
+        return False
 
     def run(self):
-        last_stats = 0
-        stats_interval = 600
         print("--")
         while not self.quit:
-
-            elapsed = time.monotonic() - last_stats
-            if elapsed > stats_interval:
-                last_stats = time.monotonic()
-                gather_player_stats(self.controller.game_folder)
+            self.refresh_player_stats()
             try:
-                msg = self.controller.follower.read_one()
+                msg = self.follower.read_one()
                 if not msg:
-                    time.sleep(2)
+                    self.follower.wait(2)
                     continue
                 debug(f"{type(msg)}, {str(msg)}")
 
             except Exception as err:
                 print(f"server loop got {err}, quitting")
                 self.quit = True
+        self.follower.stop_watching()
+        if self.follower.fanout:
+            self.follower.fanout.close(timeout=5)
 
     def stop(self):
         self.quit = True
-        self.controller.stop()
\ No newline at end of file
+        self.controller.stop()
+
+    def shutdown(self):
+        self.stop()
+        self.controller.quit = True
\ No newline at end of file
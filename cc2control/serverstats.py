@@ -1,12 +1,21 @@
 """Record basic short term runtime stats"""
 import time
 from datetime import datetime
-from cc2logger.messages import DestroyedVehicle, CapturedIsland, MessageBase
+from typing import Optional
+from cc2logger.messages import DestroyedVehicle, CapturedIsland, PlayerChat, MessageBase
+from cc2logger.rolling import RollingCounter
+
+# rolling windows reported, in minutes
+KILL_WINDOWS = [1, 5, 60]
+
 
 class Stats:
     def __init__(self):
-        self.destroyed_vehicles = []
-        self.captured_islands = []
+        self.units_destroyed = 0
+        self.islands_captured = 0
+        self.kills = RollingCounter(window=3600, bucket=10)
+        self.chat = RollingCounter(window=3600, bucket=10)
+        self.captures = RollingCounter(window=3600, bucket=60)
         self.started = time.monotonic()
 
     @property
@@ -15,10 +24,35 @@ class Stats:
 
     def record_event(self, event: MessageBase) -> bool:
         if isinstance(event, DestroyedVehicle):
-            self.destroyed_vehicles.append(event)
+            self.units_destroyed += 1
+            self.kills.add((event.team, event.vehicle_type_name), event.epoch)
         elif isinstance(event, CapturedIsland):
-            self.captured_islands.append(event)
+            self.islands_captured += 1
+            self.captures.add(event.team, event.epoch)
+        elif isinstance(event, PlayerChat):
+            self.chat.add(None, event.epoch)
+            return True
         else:
             return False
         print(f"{datetime.now().isoformat()} {event}")
-        return True
\ No newline at end of file
+        return True
+
+    def rates(self, now: Optional[float] = None) -> dict[str, float]:
+        """Kills per minute in total, per team and per vehicle type, chat per minute and captures per hour"""
+        data = {}
+        for minutes in KILL_WINDOWS:
+            counts = self.kills.counts(minutes * 60, now)
+            data[f"kills_per_min_{minutes}m"] = sum(counts.values()) / minutes
+            teams = {}
+            vehicles = {}
+            for (team, vehicle), count in counts.items():
+                teams[team] = teams.get(team, 0) + count
+                vehicles[vehicle] = vehicles.get(vehicle, 0) + count
+            for team, count in sorted(teams.items()):
+                data[f"team{team}_kills_per_min_{minutes}m"] = count / minutes
+            for vehicle, count in sorted(vehicles.items()):
+                data[f"{vehicle}_kills_per_min_{minutes}m"] = count / minutes
+        data["chat_per_min_5m"] = self.chat.rate(5 * 60, now=now)
+        data["chat_per_min_60m"] = self.chat.rate(60 * 60, now=now)
+        data["captures_per_hour"] = float(self.captures.count(60 * 60, now))
+        return data
@@ -101,7 +101,8 @@ class ServerCtx:
             "status": self.controller.status(),
             "players": self.controller.get_teams(),
             "settings": settings,
-            "game_stats": dict(self.controller.game_stats)
+            "game_stats": dict(self.controller.game_stats),
+            "parser_profile": self.controller.parser_profile,
         }
 
         return status
@@ -125,9 +125,14 @@ class ControllerProtocol(Protocol):
 
     @property
     @abstractmethod
-    def game_stats(self) -> dict[str, int]:
+    def game_stats(self) -> dict[str, float]:
         """Get the game stats"""
 
+    @property
+    @abstractmethod
+    def parser_profile(self) -> dict:
+        """Get the log parser stage timings, empty unless profiling is enabled"""
+
 
 class Blueprints(Enum):
     default = 0
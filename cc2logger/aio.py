@@ -0,0 +1,41 @@
+"""Follow several game log folders from one asyncio event loop"""
+import asyncio
+from collections.abc import AsyncIterator
+from .messages import MessageBase
+from .parser import CC2GameFollower
+
+
+async def follow_many(followers: list[CC2GameFollower],
+                      poll_interval: float = 2,
+                      queue_size: int = 1000) -> AsyncIterator[tuple[CC2GameFollower, MessageBase]]:
+    """Yield (follower, message) from all followers as messages arrive.
+
+    Each follower must already have called open_latest(). Stops once every follower has been stopped,
+    cancelling the consumer cancels all the followers.
+    """
+    queue: asyncio.Queue = asyncio.Queue(queue_size)
+
+    async def pump(follower: CC2GameFollower) -> None:
+        try:
+            async for message in follower.stream(poll_interval=poll_interval):
+                await queue.put((follower, message))
+        except Exception as err:
+            # re-raised by the consumer
+            await queue.put(err)
+        await queue.put(None)
+
+    tasks = [asyncio.create_task(pump(x)) for x in followers]
+    running = len(tasks)
+    try:
+        while running:
+            item = await queue.get()
+            if item is None:
+                running -= 1
+                continue
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,202 @@
+"""Compressed game log archives with a block index for random access.
+
+A finished log is compressed as a series of independent gzip/xz/bz2 members, each starting on a
+record boundary, so the whole file can still be read by the standard library tools. A sidecar
+.idx file lists the uncompressed and compressed offset of each member, which lets a reader start
+decompressing at the member holding any offset.
+"""
+import bisect
+import bz2
+import gzip
+import hashlib
+import io
+import json
+import lzma
+from pathlib import Path
+from typing import BinaryIO, Optional
+from .reader import BlockReader
+
+CHUNK_SIZE = 4 * 1024 * 1024
+INDEX_VERSION = 1
+FINGERPRINT_SIZE = 4096
+
+COMPRESSORS = {
+    ".gz": lambda data: gzip.compress(data, mtime=0),
+    ".xz": lzma.compress,
+    ".bz2": bz2.compress,
+}
+
+DECOMPRESSORS = {
+    ".gz": lambda fd: gzip.GzipFile(fileobj=fd, mode="rb"),
+    ".xz": lzma.LZMAFile,
+    ".bz2": bz2.BZ2File,
+}
+
+LOG_PATTERNS = ["game_log_*.jsonl"] + [f"game_log_*.jsonl{x}" for x in COMPRESSORS]
+
+
+def is_compressed(filepath: Path) -> bool:
+    return filepath.suffix in COMPRESSORS
+
+
+def log_name(filepath: Path) -> str:
+    """The name of the log without any compression suffix"""
+    if is_compressed(filepath):
+        return filepath.stem
+    return filepath.name
+
+
+def index_path(filepath: Path) -> Path:
+    return filepath.with_name(filepath.name + ".idx")
+
+
+def find_logs(folder: Path) -> list[Path]:
+    """Get all game logs in folder in time order, an uncompressed log wins over an archived copy"""
+    found: dict[str, Path] = {}
+    for pattern in LOG_PATTERNS:
+        for item in folder.glob(pattern):
+            name = log_name(item)
+            if name not in found or not is_compressed(item):
+                found[name] = item
+    return [found[x] for x in sorted(found)]
+
+
+def read_index(filepath: Path) -> Optional[dict]:
+    try:
+        index = json.loads(index_path(filepath).read_text(encoding="utf-8"))
+        if index.get("version") == INDEX_VERSION:
+            return index
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def log_size(filepath: Path) -> int:
+    """Uncompressed size of a log"""
+    if is_compressed(filepath):
+        index = read_index(filepath)
+        if index:
+            return index["size"]
+        with open_log(filepath) as fd:
+            return sum(len(x) for x in iter(lambda: fd.read(CHUNK_SIZE), b""))
+    return filepath.stat().st_size
+
+
+class CompressedLog(io.RawIOBase):
+    """Read a compressed log, tell() gives the offset in the uncompressed data"""
+    def __init__(self, raw: BinaryIO, stream: BinaryIO, position: int):
+        super().__init__()
+        self._raw = raw
+        self._stream = stream
+        self._position = position
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buf) -> int:
+        # fill buf unless at the end, decompressors may return short reads
+        view = memoryview(buf)
+        done = 0
+        while done < len(view):
+            data = self._stream.read(len(view) - done)
+            if not data:
+                break
+            view[done:done + len(data)] = data
+            done += len(data)
+        self._position += done
+        return done
+
+    def tell(self) -> int:
+        return self._position
+
+    def close(self) -> None:
+        if not self.closed:
+            self._stream.close()
+            self._raw.close()
+        super().close()
+
+
+def open_log(filepath: Path, offset: int = 0) -> BinaryIO:
+    """Open a plain or compressed log for binary reading at the uncompressed offset"""
+    if not is_compressed(filepath):
+        fd = filepath.open("rb")
+        fd.seek(offset)
+        return fd
+
+    start = 0
+    compressed_start = 0
+    index = read_index(filepath)
+    if index and offset:
+        chunks = index["chunks"]
+        pos = bisect.bisect_right([x[0] for x in chunks], offset) - 1
+        if pos >= 0:
+            start, compressed_start = chunks[pos]
+
+    raw = filepath.open("rb")
+    raw.seek(compressed_start)
+    fd = CompressedLog(raw, DECOMPRESSORS[filepath.suffix](raw), start)
+    skip = offset - start
+    while skip > 0:
+        data = fd.read(min(skip, CHUNK_SIZE))
+        if not data:
+            break
+        skip -= len(data)
+    return fd
+
+
+def file_fingerprint(filepath: Path, offset: int) -> str:
+    """Hash the start of a log and the bytes just before offset, uncompressed"""
+    digest = hashlib.sha1()
+    with open_log(filepath) as fd:
+        digest.update(fd.read(min(offset, FINGERPRINT_SIZE)))
+    start = max(0, offset - FINGERPRINT_SIZE)
+    with open_log(filepath, start) as fd:
+        digest.update(fd.read(offset - start))
+    return digest.hexdigest()
+
+
+def archive_log(filepath: Path, method: str = ".gz", chunk_size: int = CHUNK_SIZE, remove: bool = True) -> Path:
+    """Compress a finished log into chunks starting on record boundaries, and write its index"""
+    compress = COMPRESSORS[method]
+    target = filepath.with_name(filepath.name + method)
+    tmp = target.with_name(target.name + ".tmp")
+    chunks = []
+    compressed_offset = 0
+    with filepath.open("rb") as src, tmp.open("wb") as dst:
+        # chunks must start on a record boundary, so walk the records
+        reader = BlockReader(src)
+        start = 0
+        boundaries = []
+        while reader.next_record() is not None:
+            if reader.offset - start >= chunk_size:
+                boundaries.append(reader.offset)
+                start = reader.offset
+        size = src.seek(0, io.SEEK_END)
+        if not boundaries or boundaries[-1] != size:
+            boundaries.append(size)
+
+        start = 0
+        for end in boundaries:
+            src.seek(start)
+            member = compress(src.read(end - start))
+            dst.write(member)
+            chunks.append([start, compressed_offset])
+            compressed_offset += len(member)
+            start = end
+
+    index = {"version": INDEX_VERSION, "size": size, "chunks": chunks}
+    index_path(target).write_text(json.dumps(index), encoding="utf-8")
+    tmp.replace(target)
+    if remove:
+        filepath.unlink()
+    return target
+
+
+def archive_folder(folder: Path, method: str = ".gz", chunk_size: int = CHUNK_SIZE) -> list[Path]:
+    """Archive every uncompressed log in folder except the newest, which may still be written to"""
+    logs = find_logs(folder)
+    done = []
+    for item in logs[:-1]:
+        if not is_compressed(item):
+            done.append(archive_log(item, method, chunk_size))
+    return done
@@ -0,0 +1,171 @@
+"""Incremental re-parsing of a game log folder from a saved checkpoint"""
+import json
+import os
+from pathlib import Path
+from typing import Optional
+from .parser import CC2GameParser
+from .archive import open_log, find_logs, log_name, log_size, file_fingerprint
+from .reader import BlockReader, MAX_RECORD_SIZE
+from . import snapshot
+
+CHECKPOINT_VERSION = 4
+
+
+class LogFileEntry:
+    def __init__(self, name: str, offset: int, size: int, mtime: float, fingerprint: str):
+        self.name = name
+        self.offset = offset
+        self.size = size
+        self.mtime = mtime
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def from_file(cls, filepath: Path, offset: int, st: Optional[os.stat_result] = None) -> "LogFileEntry":
+        """Entry for filepath read up to offset, st should be taken before reading so it never covers unread data"""
+        if st is None:
+            st = filepath.stat()
+        return cls(log_name(filepath), offset, st.st_size, st.st_mtime, file_fingerprint(filepath, offset))
+
+    def unchanged(self, filepath: Path) -> bool:
+        st = filepath.stat()
+        return st.st_size == self.size and st.st_mtime == self.mtime
+
+    def valid(self, filepath: Path) -> bool:
+        """True if the bytes up to offset are the same as when the entry was recorded"""
+        if self.unchanged(filepath):
+            return True
+        if log_size(filepath) < self.offset:
+            return False
+        return file_fingerprint(filepath, self.offset) == self.fingerprint
+
+    def to_dict(self) -> dict:
+        return dict(self.__dict__)
+
+
+def no_records_after(filepath: Path, offset: int) -> bool:
+    """True if a finished log holds no complete record after offset, eg it ends in one cut short"""
+    if log_size(filepath) - offset > MAX_RECORD_SIZE:
+        return False
+    with open_log(filepath, offset) as fd:
+        return BlockReader(fd).next_record() is None
+
+
+class CheckpointedParser(CC2GameParser):
+    """A CC2GameParser that saves its state after reading a folder and only reads new data next time.
+
+    Checkpoint files ending in .snap are saved as binary snapshots, anything else as json.
+    """
+    def __init__(self, checkpoint_file: Path):
+        super().__init__()
+        self.checkpoint_file = checkpoint_file
+        self.entries: list[LogFileEntry] = []
+        # entries load_checkpoint() brought up to date, to be saved
+        self.entries_updated = False
+
+    @property
+    def binary(self) -> bool:
+        return self.checkpoint_file.suffix == ".snap"
+
+    def load_checkpoint(self, files: list[Path]) -> bool:
+        if not self.checkpoint_file.exists():
+            return False
+        try:
+            if self.binary:
+                data = snapshot.read_snapshot(self.checkpoint_file)
+            else:
+                data = json.loads(self.checkpoint_file.read_text(encoding="utf-8"))
+            if data.get("version") != CHECKPOINT_VERSION:
+                return False
+            entries = [LogFileEntry(**x) for x in data["files"]]
+        except (ValueError, KeyError, TypeError) as err:
+            self.debug(f"ignoring bad checkpoint {self.checkpoint_file}: {err}")
+            return False
+
+        # files already read must still be there, in the same order, and only the last may have grown
+        if [x.name for x in entries] != [log_name(x) for x in files[:len(entries)]]:
+            self.debug("log files changed, discarding checkpoint")
+            return False
+        updated = False
+        for entry, filepath in zip(entries, files):
+            if entry is not entries[-1] and log_size(filepath) != entry.offset:
+                if not no_records_after(filepath, entry.offset):
+                    return False
+            if entry.unchanged(filepath):
+                continue
+            if not entry.valid(filepath):
+                self.debug(f"{filepath} changed, discarding checkpoint")
+                return False
+            if entry is not entries[-1]:
+                # the same data in a new file, eg archived, so it is not fingerprinted again next time
+                st = filepath.stat()
+                entry.size = st.st_size
+                entry.mtime = st.st_mtime
+                updated = True
+
+        self.set_state(data["state"])
+        self.entries = entries
+        self.entries_updated = updated
+        return True
+
+    def save_checkpoint(self) -> None:
+        data = {
+            "version": CHECKPOINT_VERSION,
+            "files": [x.to_dict() for x in self.entries],
+            "state": self.get_state(),
+        }
+        if self.binary:
+            snapshot.write_snapshot(self.checkpoint_file, data)
+        else:
+            tmp = self.checkpoint_file.with_suffix(".tmp")
+            tmp.write_text(json.dumps(data), encoding="utf-8")
+            tmp.replace(self.checkpoint_file)
+
+    def refresh(self, folder: Path) -> None:
+        """Read everything added to folder since the last checkpoint, then save a new checkpoint"""
+        files = find_logs(folder)
+        changed = False
+        if not self.load_checkpoint(files):
+            self.entries = []
+            changed = True
+        elif self.entries_updated:
+            changed = True
+
+        resume: Optional[LogFileEntry] = None
+        if self.entries:
+            resume = self.entries.pop()
+
+        for filepath in files[len(self.entries):]:
+            offset = 0
+            if resume:
+                offset = resume.offset
+            is_last = filepath == files[-1]
+            if resume and is_last and resume.unchanged(filepath):
+                self.debug(f"{filepath} unchanged")
+                self.entries.append(resume)
+            else:
+                self.debug(f"reading {filepath} from {offset}")
+                changed = True
+                st = filepath.stat()
+                # keep an unterminated final record in the newest log for next time
+                self.tailing = is_last
+                try:
+                    self.open(filepath, offset)
+                    while True:
+                        data = self.read_record()
+                        if data is None:
+                            break
+                        self.on_message(data)
+                    offset = self.offset
+                finally:
+                    self.close()
+                    self.tailing = False
+                self.entries.append(LogFileEntry.from_file(filepath, offset, st))
+            resume = None
+            if not is_last:
+                self.finish()
+
+        # save before finishing the newest log, it may still be growing
+        if changed:
+            self.save_checkpoint()
+        if self.last_epoch is not None:
+            self.finish()
@@ -0,0 +1,181 @@
+"""Compact column based store for parsed game events"""
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+from typing import Iterator, Optional, Union
+from .messages import (MessageBase, MESSAGE_TYPES, TeamMessageBase, PlayerMessageBase, PlayerChat,
+                       DestroyedVehicle, CapturedIsland)
+
+TYPE_CODES: dict[str, int] = {name: code for code, name in enumerate(MESSAGE_TYPES)}
+TYPE_NAMES: dict[int, str] = {code: name for name, code in TYPE_CODES.items()}
+
+TimeValue = Union[datetime, int, float]
+
+# wider types to move a column to when a value does not fit, then a plain list
+_WIDER = {"b": ("h", "i", "q"), "h": ("i", "q"), "i": ("q",), "q": ()}
+
+
+def epoch(value: TimeValue) -> int:
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    return int(value)
+
+
+class StringTable:
+    """Store each distinct string once, referenced by index"""
+    def __init__(self):
+        self.values: list[str] = []
+        self._index: dict[str, int] = {}
+
+    def intern(self, value: str) -> int:
+        index = self._index.get(value)
+        if index is None:
+            index = len(self.values)
+            self.values.append(value)
+            self._index[value] = index
+        return index
+
+    def __getitem__(self, index: int) -> str:
+        return self.values[index]
+
+    def __len__(self):
+        return len(self.values)
+
+
+class EventStore:
+    """Keep game events in parallel typed arrays instead of message objects.
+
+    Set CC2GameParser.store to an EventStore to fill it as logs are parsed. Unused fields are -1. Columns
+    are sized for the values the game writes, a column is widened when a value does not fit.
+    """
+    COLUMNS = ("timestamp", "type_code", "team", "player", "vehicle_type", "island", "name", "text")
+
+    def __init__(self):
+        self.timestamp = array("q")
+        self.type_code = array("b")
+        self.team = array("h")
+        self.player = array("i")
+        self.vehicle_type = array("h")
+        self.island = array("h")
+        self.name = array("i")
+        self.text = array("i")
+        self.player_ids = array("q")
+        self._player_index: dict[int, int] = {}
+        self.names = StringTable()
+        self.texts = StringTable()
+        self.ordered = True
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the column arrays in bytes"""
+        columns = [getattr(self, x) for x in self.COLUMNS] + [self.player_ids]
+        return sum(getattr(x, "itemsize", 8) * len(x) for x in columns)
+
+    def _append(self, name: str, value: int) -> None:
+        column = getattr(self, name)
+        try:
+            column.append(value)
+        except OverflowError:
+            # too big for the column's type, widen the column rather than drop the event
+            wider = list(column)
+            wider.append(value)
+            for code in _WIDER[column.typecode]:
+                try:
+                    wider = array(code, wider)
+                    break
+                except OverflowError:
+                    continue
+            setattr(self, name, wider)
+
+    def player_index(self, player_id: int) -> int:
+        index = self._player_index.get(player_id)
+        if index is None:
+            index = len(self.player_ids)
+            self._append("player_ids", player_id)
+            self._player_index[player_id] = index
+        return index
+
+    def add(self, message: MessageBase) -> None:
+        stamp = message.epoch
+        if self.timestamp and stamp < self.timestamp[-1]:
+            self.ordered = False
+        code = TYPE_CODES.get(message.type, -1)
+        team = message.team if isinstance(message, TeamMessageBase) else -1
+        if isinstance(message, PlayerMessageBase):
+            player = self.player_index(message.player_id)
+            name = self.names.intern(message.player_name)
+        else:
+            player = -1
+            name = -1
+        vehicle_type = message.vehicle_type if isinstance(message, DestroyedVehicle) else -1
+        island = message.island_id if isinstance(message, CapturedIsland) else -1
+        text = self.texts.intern(message.message) if isinstance(message, PlayerChat) else -1
+        row = len(self.timestamp)
+        try:
+            self.timestamp.append(stamp)
+            self.type_code.append(code)
+            self.team.append(team)
+            self.player.append(player)
+            self.name.append(name)
+            self.vehicle_type.append(vehicle_type)
+            self.island.append(island)
+            self.text.append(text)
+        except OverflowError:
+            values = {"timestamp": stamp, "type_code": code, "team": team, "player": player, "name": name,
+                      "vehicle_type": vehicle_type, "island": island, "text": text}
+            for column in self.COLUMNS:
+                del getattr(self, column)[row:]
+                self._append(column, values[column])
+
+    def _span(self, start: Optional[TimeValue], end: Optional[TimeValue]) -> range:
+        if not self.ordered:
+            return range(len(self))
+        first = 0 if start is None else bisect_left(self.timestamp, epoch(start))
+        last = len(self) if end is None else bisect_right(self.timestamp, epoch(end))
+        return range(first, last)
+
+    def select(self, types: Optional[list[str]] = None,
+               start: Optional[TimeValue] = None, end: Optional[TimeValue] = None) -> Iterator[int]:
+        """Yield the row numbers of events of the given types between start and end (inclusive)"""
+        codes = None
+        if types is not None:
+            codes = {TYPE_CODES[x] for x in types}
+        low = None if start is None else epoch(start)
+        high = None if end is None else epoch(end)
+        timestamp = self.timestamp
+        type_code = self.type_code
+        for row in self._span(start, end):
+            if codes is not None and type_code[row] not in codes:
+                continue
+            if not self.ordered:
+                if low is not None and timestamp[row] < low:
+                    continue
+                if high is not None and timestamp[row] > high:
+                    continue
+            yield row
+
+    def count(self, types: Optional[list[str]] = None,
+              start: Optional[TimeValue] = None, end: Optional[TimeValue] = None) -> int:
+        return sum(1 for _ in self.select(types, start, end))
+
+    def get(self, row: int) -> dict:
+        """Rebuild the fields of one event as a dict"""
+        data = {
+            "timestamp": datetime.fromtimestamp(self.timestamp[row], tz=timezone.utc),
+            "type": TYPE_NAMES.get(self.type_code[row], "unknown"),
+        }
+        if self.team[row] >= 0:
+            data["team"] = self.team[row]
+        if self.player[row] >= 0:
+            data["player_id"] = self.player_ids[self.player[row]]
+            data["player_name"] = self.names[self.name[row]]
+        if self.vehicle_type[row] >= 0:
+            data["vehicle_type"] = self.vehicle_type[row]
+        if self.island[row] >= 0:
+            data["island_id"] = self.island[row]
+        if self.text[row] >= 0:
+            data["message"] = self.texts[self.text[row]]
+        return data
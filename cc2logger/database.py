@@ -0,0 +1,195 @@
+"""Incremental ingestion of game log events into a SQLite database for ad-hoc queries.
+
+Each log is read from the offset recorded for it last time. Rows are inserted in batches and the
+file offset is updated in the same transaction as each batch, so an interrupted or repeated ingest
+never stores an event twice. A log rewritten since it was ingested has its rows replaced.
+"""
+import sqlite3
+from pathlib import Path
+from typing import Optional
+from .archive import open_log, find_logs, log_name
+from .checkpoint import LogFileEntry, file_fingerprint
+from .messages import MessageFactory, PlayerJoined, PlayerLeft, PlayerChat, DestroyedVehicle, CapturedIsland
+from .reader import BlockReader
+
+SCHEMA_VERSION = 1
+BATCH_SIZE = 5000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    offset INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    fingerprint TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS presence (
+    file TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    player_id INTEGER NOT NULL,
+    player_name TEXT NOT NULL,
+    team INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chat (
+    file TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    player_id INTEGER NOT NULL,
+    player_name TEXT NOT NULL,
+    message TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS destroyed_vehicles (
+    file TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    vehicle_id INTEGER NOT NULL,
+    vehicle_type INTEGER NOT NULL,
+    team INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS island_captures (
+    file TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    island_id INTEGER NOT NULL,
+    team INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS presence_timestamp ON presence (timestamp);
+CREATE INDEX IF NOT EXISTS presence_player ON presence (player_id, timestamp);
+CREATE INDEX IF NOT EXISTS presence_type ON presence (type, timestamp);
+CREATE INDEX IF NOT EXISTS chat_timestamp ON chat (timestamp);
+CREATE INDEX IF NOT EXISTS chat_player ON chat (player_id, timestamp);
+CREATE INDEX IF NOT EXISTS destroyed_timestamp ON destroyed_vehicles (timestamp);
+CREATE INDEX IF NOT EXISTS destroyed_type ON destroyed_vehicles (vehicle_type, timestamp);
+CREATE INDEX IF NOT EXISTS captures_timestamp ON island_captures (timestamp);
+"""
+
+EVENT_TABLES = ["presence", "chat", "destroyed_vehicles", "island_captures"]
+
+INSERTS = {
+    "presence": "INSERT INTO presence VALUES (?, ?, ?, ?, ?, ?)",
+    "chat": "INSERT INTO chat VALUES (?, ?, ?, ?, ?)",
+    "destroyed_vehicles": "INSERT INTO destroyed_vehicles VALUES (?, ?, ?, ?, ?)",
+    "island_captures": "INSERT INTO island_captures VALUES (?, ?, ?, ?)",
+}
+
+
+def file_key(filepath: Path) -> str:
+    """Name a log the same way before and after it is archived"""
+    return str(filepath.parent.absolute() / log_name(filepath))
+
+
+class EventDatabase:
+    def __init__(self, path: Path, batch_size: int = BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self.factory = MessageFactory()
+        self.debug_enabled = False
+        self.db = sqlite3.connect(str(path))
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        if version not in (0, SCHEMA_VERSION):
+            raise ValueError(f"{path} has unsupported schema version {version}")
+        with self.db:
+            self.db.executescript(SCHEMA)
+            self.db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def debug(self, msg):
+        if self.debug_enabled:
+            print(f"debug> {msg}")
+
+    def close(self) -> None:
+        self.db.close()
+
+    def __enter__(self) -> "EventDatabase":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def get_entry(self, key: str) -> Optional[LogFileEntry]:
+        row = self.db.execute("SELECT offset, size, mtime, fingerprint FROM files WHERE path = ?", (key,)).fetchone()
+        if row:
+            return LogFileEntry(key, *row)
+        return None
+
+    def row(self, key: str, message) -> Optional[tuple[str, tuple]]:
+        if isinstance(message, (PlayerJoined, PlayerLeft)):
+            return "presence", (key, message.epoch, message.type, message.player_id, message.player_name, message.team)
+        if isinstance(message, PlayerChat):
+            return "chat", (key, message.epoch, message.player_id, message.player_name, message.message)
+        if isinstance(message, DestroyedVehicle):
+            return "destroyed_vehicles", (key, message.epoch, message.vehicle_id, message.vehicle_type, message.team)
+        if isinstance(message, CapturedIsland):
+            return "island_captures", (key, message.epoch, message.island_id, message.team)
+        return None
+
+    def _commit(self, entry: LogFileEntry, key: str, rows: dict[str, list[tuple]]) -> None:
+        with self.db:
+            for table, items in rows.items():
+                if items:
+                    self.db.executemany(INSERTS[table], items)
+            self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                            (key, entry.offset, entry.size, entry.mtime, entry.fingerprint))
+        for items in rows.values():
+            items.clear()
+
+    def ingest_file(self, filepath: Path) -> int:
+        """Add the events written to a log since it was last ingested, returns the number of new rows"""
+        key = file_key(filepath)
+        # stat before reading, anything written after this is picked up next time
+        st = filepath.stat()
+        offset = 0
+        entry = self.get_entry(key)
+        if entry:
+            if entry.offset == entry.size and entry.unchanged(filepath):
+                return 0
+            if entry.valid(filepath):
+                offset = entry.offset
+            else:
+                self.debug(f"{filepath} was rewritten, replacing its events")
+                with self.db:
+                    for table in EVENT_TABLES:
+                        self.db.execute(f"DELETE FROM {table} WHERE file = ?", (key,))
+        start = offset
+
+        rows: dict[str, list[tuple]] = {x: [] for x in EVENT_TABLES}
+        added = 0
+        pending = 0
+        # until the end of the file is reached there is no fingerprint for the offset, so only an
+        # unchanged file resumes from a batch part way through, a changed one is ingested again
+        progress = LogFileEntry(key, offset, st.st_size, st.st_mtime, "")
+        with open_log(filepath, offset) as fd:
+            reader = BlockReader(fd)
+            # a half written last record is picked up next time
+            reader.tailing = True
+            while True:
+                data = reader.next_record()
+                if data is None:
+                    break
+                message = self.factory.parse(data)
+                found = self.row(key, message) if message else None
+                if found:
+                    rows[found[0]].append(found[1])
+                    pending += 1
+                if pending >= self.batch_size:
+                    progress.offset = reader.offset
+                    self._commit(progress, key, rows)
+                    added += pending
+                    pending = 0
+            offset = reader.offset
+        if entry and offset == start and not (added or pending) and (entry.size, entry.mtime) == (st.st_size, st.st_mtime):
+            # nothing new, eg a finished log ending in a partial record
+            return 0
+        progress.offset = offset
+        progress.fingerprint = file_fingerprint(filepath, offset)
+        self._commit(progress, key, rows)
+        return added + pending
+
+    def ingest(self, folder: Path) -> int:
+        """Ingest every log in folder, returns the number of new rows"""
+        added = 0
+        for filepath in find_logs(folder):
+            added += self.ingest_file(filepath)
+        return added
+
+    def count(self, table: str) -> int:
+        if table not in EVENT_TABLES:
+            raise KeyError(table)
+        return self.db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
@@ -0,0 +1,171 @@
+"""Deliver messages to subscribers on their own threads through bounded queues"""
+import threading
+from collections import deque
+from collections.abc import Callable, Hashable, Iterable
+from enum import Enum
+from typing import Optional
+from .messages import MessageBase, type_names
+
+Callback = Callable[[MessageBase], bool]
+KeyFunc = Callable[[MessageBase], Hashable]
+
+
+class OverflowPolicy(Enum):
+    block = "block"
+    drop_oldest = "drop-oldest"
+    coalesce = "coalesce"
+
+
+def message_type_key(message: MessageBase) -> Hashable:
+    return type(message)
+
+
+def chain(funcs: list[Callback]) -> Callback:
+    """Call funcs in order until one returns True, the same way CC2GameFollower.dispatch() does"""
+    def handle(message: MessageBase) -> bool:
+        for func in funcs:
+            if func(message):
+                return True
+        return False
+    return handle
+
+
+class Subscriber(threading.Thread):
+    """Run func for each message on a worker thread, queueing at most maxsize messages.
+
+    When the queue is full the policy decides what happens to a new message:
+        block        - wait for the worker to make room
+        drop-oldest  - discard the oldest queued message
+        coalesce     - replace the newest queued message with the same key, else discard the oldest
+    """
+    def __init__(self, func: Callback, maxsize: int = 1000, policy: OverflowPolicy = OverflowPolicy.block,
+                 key: KeyFunc = message_type_key, name: str = "", types: Optional[frozenset[str]] = None):
+        super().__init__(daemon=True, name=name or getattr(func, "__name__", "subscriber"))
+        self.func = func
+        # record types delivered, None for all
+        self.types = types
+        self.maxsize = maxsize
+        self.policy = policy
+        self.key = key
+        self.delivered = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.errors = 0
+        self._queue: deque[MessageBase] = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+
+    @property
+    def depth(self) -> int:
+        return len(self._queue)
+
+    def put(self, message: MessageBase) -> None:
+        with self._cond:
+            if self._closed:
+                return
+            if len(self._queue) >= self.maxsize:
+                if self.policy == OverflowPolicy.block:
+                    while len(self._queue) >= self.maxsize and not self._closed:
+                        self._cond.wait()
+                    if self._closed:
+                        # closed while waiting for room
+                        return
+                elif self.policy == OverflowPolicy.coalesce and self._replace(message):
+                    return
+                else:
+                    self._queue.popleft()
+                    self.dropped += 1
+            self._queue.append(message)
+            self._cond.notify_all()
+
+    def _replace(self, message: MessageBase) -> bool:
+        key = self.key(message)
+        for index in range(len(self._queue) - 1, -1, -1):
+            if self.key(self._queue[index]) == key:
+                self._queue[index] = message
+                self.coalesced += 1
+                return True
+        return False
+
+    def run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                message = self._queue.popleft()
+                self._cond.notify_all()
+            try:
+                self.func(message)
+                self.delivered += 1
+            except Exception as err:
+                self.errors += 1
+                print(f"subscriber {self.name} raised {type(err)}: {err}")
+
+    def close(self) -> None:
+        """Stop once the queued messages have been handled"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "queue_depth": self.depth,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+        }
+
+
+class FanOut:
+    """Publish each message to its subscribers without waiting for them to handle it.
+
+    A subscriber may ask for only some message types, the subscribers for each type are kept in
+    a routing table so publishing does not look at the others.
+    """
+    def __init__(self):
+        self.subscribers: list[Subscriber] = []
+        self.version = 0
+        self._all: list[Subscriber] = []
+        self._routes: dict[str, list[Subscriber]] = {}
+
+    def subscribe(self, func: Callback, maxsize: int = 1000, policy: OverflowPolicy = OverflowPolicy.block,
+                  key: KeyFunc = message_type_key, name: str = "",
+                  types: Optional[Iterable[str | type]] = None) -> Subscriber:
+        """Deliver messages to func on its own thread, only those of the given types
+        (record type names or message classes) if types is set"""
+        names = None if types is None else type_names(types)
+        sub = Subscriber(func, maxsize=maxsize, policy=policy, key=key, name=name, types=names)
+        self.subscribers.append(sub)
+        if names is None:
+            self._all.append(sub)
+        else:
+            for type_name in names:
+                self._routes.setdefault(type_name, []).append(sub)
+        self.version += 1
+        sub.start()
+        return sub
+
+    def publish(self, message: MessageBase) -> None:
+        for sub in self._all:
+            sub.put(message)
+        for sub in self._routes.get(message.type, ()):
+            sub.put(message)
+
+    def wanted_types(self) -> Optional[set[str]]:
+        """Message types some subscriber wants, None if any takes every type"""
+        if self._all:
+            return None
+        return set(self._routes)
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        for sub in self.subscribers:
+            sub.close()
+        for sub in self.subscribers:
+            if sub is not threading.current_thread():
+                sub.join(timeout)
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        return {sub.name: sub.stats() for sub in self.subscribers}
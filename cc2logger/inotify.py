@@ -0,0 +1,107 @@
+"""Minimal Linux inotify wrapper using ctypes, for waking up when game logs change"""
+import ctypes
+import ctypes.util
+import os
+import selectors
+import struct
+import sys
+from pathlib import Path
+from typing import Optional
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_EVENT = struct.Struct("iIII")
+_libc = None
+
+
+def _load_libc():
+    global _libc
+    if _libc is None:
+        if not sys.platform.startswith("linux"):
+            _libc = False
+            return _libc
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+            libc.inotify_init1.argtypes = [ctypes.c_int]
+            libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+            libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+            _libc = libc
+        except (OSError, AttributeError, TypeError):
+            _libc = False
+    return _libc
+
+
+def inotify_available() -> bool:
+    return bool(_load_libc())
+
+
+class InotifyEvent:
+    def __init__(self, wd: int, mask: int, cookie: int, name: str):
+        self.wd = wd
+        self.mask = mask
+        self.cookie = cookie
+        self.name = name
+
+    def __str__(self):
+        return f"inotify {self.name} mask={self.mask:#x}"
+
+
+class Inotify:
+    """Watch folders for changes, wait() blocks until something happens or the timeout passes"""
+    def __init__(self):
+        libc = _load_libc()
+        if not libc:
+            raise OSError("inotify is not available")
+        self._libc = libc
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches: dict[int, Path] = {}
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self.fd, selectors.EVENT_READ)
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def add_watch(self, path: Path, mask: int = IN_MODIFY | IN_CLOSE_WRITE | IN_CREATE | IN_MOVED_TO) -> int:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+        self.watches[wd] = path
+        return wd
+
+    def rm_watch(self, wd: int) -> None:
+        if self.watches.pop(wd, None) is not None:
+            self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self) -> list[InotifyEvent]:
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        pos = 0
+        while pos + _EVENT.size <= len(buf):
+            wd, mask, cookie, length = _EVENT.unpack_from(buf, pos)
+            pos += _EVENT.size
+            name = buf[pos:pos + length].rstrip(b"\0").decode("utf-8", "replace")
+            pos += length
+            events.append(InotifyEvent(wd, mask, cookie, name))
+        return events
+
+    def wait(self, timeout: Optional[float]) -> list[InotifyEvent]:
+        """Wait up to timeout seconds for events"""
+        if self._selector.select(timeout):
+            return self.read_events()
+        return []
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            self._selector.close()
+            os.close(self.fd)
+            self.fd = -1
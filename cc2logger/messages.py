@@ -1,35 +1,80 @@
+import sys
+from collections.abc import Iterable
 from typing import Optional, cast
 from abc import ABC
-from datetime import datetime
+from datetime import datetime, timezone
 from .resolver import Vehicle
 
+# the last timestamp converted, as one tuple so threads never see a stamp with another's epoch
+_last: tuple[str, int] = ("", 0)
+
+
+def parse_epoch(stamp: str) -> int:
+    """Convert an iso timestamp to integer epoch seconds, naive timestamps are taken as UTC"""
+    global _last
+    last = _last
+    if stamp == last[0]:
+        return last[1]
+    value = datetime.fromisoformat(stamp)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    result = int(value.timestamp())
+    _last = (stamp, result)
+    return result
+
+
 class MessageBase:
+    __slots__ = ("epoch", "_timestamp", "type", "_data")
+
     def __init__(self):
-        self.timestamp: Optional[datetime] = None
+        self.epoch: Optional[int] = None
+        self._timestamp: Optional[datetime] = None
         self.type: str = "unknown"
-        self._data: dict = {}
+        self._data: Optional[dict] = None
 
     def parse(self, data: dict):
-        self._data = data
-        self.timestamp = datetime.fromisoformat(data.get("timestamp"))
+        self.type = data.get("type", "unknown")
+        self.epoch = parse_epoch(data.get("timestamp"))
+        self._timestamp = None
+        self._data = None
+
+    @property
+    def timestamp(self) -> Optional[datetime]:
+        if self._timestamp is None and self.epoch is not None:
+            self._timestamp = datetime.fromtimestamp(self.epoch, tz=timezone.utc)
+        return self._timestamp
+
+    @timestamp.setter
+    def timestamp(self, value: datetime) -> None:
+        self._timestamp = None
+        self.epoch = int(value.timestamp())
+
+    @property
+    def data(self) -> Optional[dict]:
+        """The source record, only kept if the MessageFactory was created with keep_data=True"""
+        return self._data
 
     def __str__(self):
         return f"{type(self).__name__}"
 
 
 class TeamMessageBase(MessageBase, ABC):
+    __slots__ = ("team",)
+
     def __init__(self):
         super().__init__()
         self.team: int = 0
 
     def parse(self, data: dict):
         super().parse(data)
-        self.team = int(data.get("team", data.get("team_id", self.team)))
+        self.team = int(data.get("team", data.get("team_id", 0)))
 
     def __str__(self):
         return super().__str__() + f" team {self.team}"
 
 class PlayerMessageBase(TeamMessageBase, ABC):
+    __slots__ = ("player_name", "player_id")
+
     def __init__(self):
         super().__init__()
         self.player_name: str = ""
@@ -40,27 +85,34 @@ class PlayerMessageBase(TeamMessageBase, ABC):
 
     def parse(self, data: dict):
         super().parse(data)
-        self.player_name = data.get("player_name", self.player_name)
-        self.player_id = int(data.get("player_id", self.player_id))
+        name = data.get("player_name", "")
+        self.player_name = sys.intern(name) if isinstance(name, str) else name
+        self.player_id = int(data.get("player_id", 0))
 
 class PlayerJoined(PlayerMessageBase):
     """Player joined the game"""
+    __slots__ = ()
 
 class PlayerLeft(PlayerMessageBase):
     """Player left the game"""
+    __slots__ = ()
 
 class PlayerChat(PlayerMessageBase):
     """Player sent a chat message"""
+    __slots__ = ("message",)
+
     def __init__(self):
         super().__init__()
         self.message: str = ""
 
     def parse(self, data: dict):
         super().parse(data)
-        self.message = data.get("message", self.message)
+        self.message = data.get("message", "")
 
 class DestroyedVehicle(TeamMessageBase):
     """A vehicle was destroyed"""
+    __slots__ = ("vehicle_id", "vehicle_type")
+
     def __init__(self):
         super().__init__()
         self.vehicle_id: int = 0
@@ -68,8 +120,8 @@ class DestroyedVehicle(TeamMessageBase):
 
     def parse(self, data: dict):
         super().parse(data)
-        self.vehicle_id = int(data.get("vehicle_id", self.vehicle_id))
-        self.vehicle_type = int(data.get("vehicle_type", self.vehicle_type))
+        self.vehicle_id = int(data.get("vehicle_id", 0))
+        self.vehicle_type = int(data.get("vehicle_type", 0))
 
     @property
     def vehicle_type_name(self) -> str:
@@ -80,34 +132,77 @@ class DestroyedVehicle(TeamMessageBase):
 
 
 class CapturedIsland(TeamMessageBase):
+    __slots__ = ("island_id",)
+
     def __init__(self):
         super().__init__()
         self.island_id: int = 0
 
     def parse(self, data: dict):
         super().parse(data)
-        self.island_id = int(data.get("island_id", self.island_id))
+        self.island_id = int(data.get("island_id", 0))
         # yes, could lookup island name here
 
     def __str__(self):
         return super().__str__() + f" captured island {self.island_id}"
 
 
+MESSAGE_TYPES: dict[str, type] = {
+    "player_joined": PlayerJoined,
+    "player_left": PlayerLeft,
+    "chat": PlayerChat,
+    "destroy_vehicle": DestroyedVehicle,
+    "island_captured": CapturedIsland,
+}
+
+
+def type_names(types: Iterable[str | type]) -> frozenset[str]:
+    """The record type names for a mix of names and message classes"""
+    names = set()
+    for item in types:
+        if isinstance(item, str):
+            names.add(item)
+        else:
+            names.update(name for name, cls in MESSAGE_TYPES.items() if issubclass(cls, item))
+    return frozenset(names)
+
+
 class MessageFactory:
-    def __init__(self):
-        self.dispatch = {
-            "player_joined": PlayerJoined,
-            "player_left": PlayerLeft,
-            "chat": PlayerChat,
-            "destroy_vehicle": DestroyedVehicle,
-            "island_captured": CapturedIsland,
-        }
+    def __init__(self, keep_data: bool = False):
+        self.keep_data = keep_data
+        self.dispatch = dict(MESSAGE_TYPES)
+        # known types left out by only()
+        self.skipped: frozenset[str] = frozenset()
+        self._player_ids: dict[int, int] = {}
+
+    def intern_player_id(self, player_id: int) -> int:
+        """Share one int object for each player id this factory has seen"""
+        shared = self._player_ids.get(player_id)
+        if shared is None:
+            shared = player_id
+            if len(self._player_ids) < 100000:
+                self._player_ids[player_id] = player_id
+        return shared
+
+    def only(self, types: Optional[Iterable[str]]) -> None:
+        """Build messages of these types alone, or every type if None, parse() returns None for the rest
+        without looking past the record type"""
+        if types is None:
+            self.dispatch = dict(MESSAGE_TYPES)
+        else:
+            self.dispatch = {name: cls for name, cls in MESSAGE_TYPES.items() if name in types}
+        self.skipped = frozenset(MESSAGE_TYPES).difference(self.dispatch)
 
     def parse(self, data: dict) -> Optional[MessageBase]:
         data_type = data.get("type", "")
         cls: type = self.dispatch.get(data_type, None)
         if cls:
-            msg = cast(MessageBase, cls())
+            # parse() sets every field, so skip the __init__ chain
+            msg = cast(MessageBase, cls.__new__(cls))
             msg.parse(data)
+            if isinstance(msg, PlayerMessageBase):
+                msg.player_id = self.intern_player_id(msg.player_id)
+            if self.keep_data:
+                msg._data = data
             return msg
         return None
@@ -0,0 +1,192 @@
+"""Follow the logs folders of many game servers from one thread.
+
+Every folder is watched by one shared inotify instance, so an idle host wakes up only when a log
+changes, however many servers it runs. Without inotify all the followers are polled on one timer.
+Each follower dispatches its own messages, so they reach that server's callbacks and fanout.
+cc2control runs every server on one shared tailer when given more than one --game-dir.
+"""
+import selectors
+import socket
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+from .inotify import Inotify, inotify_available
+from .parser import CC2GameFollower
+
+# most messages read from one server before the others get a turn
+BATCH_SIZE = 1000
+
+
+class TailedServer:
+    def __init__(self, name: str, follower: CC2GameFollower):
+        self.name = name
+        self.follower = follower
+        self.wd = -1
+        # when a change was first seen that has not been read yet
+        self.changed: Optional[float] = None
+        self.delay = 0.0
+        self.messages = 0
+        self.errors = 0
+
+
+class MultiTailer(threading.Thread):
+    """Read new messages from several followers, waking only when one of their logs changes"""
+    def __init__(self, poll_interval: float = 2, batch_size: int = BATCH_SIZE, use_inotify: bool = True):
+        super().__init__(daemon=True, name="multitail")
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.servers: dict[str, TailedServer] = {}
+        self.wakeups = 0
+        self.quit = False
+        self.watcher: Optional[Inotify] = None
+        self._by_wd: dict[int, TailedServer] = {}
+        self._lock = threading.RLock()
+        self._selector = selectors.DefaultSelector()
+        # a socket pair rather than a pipe, select() on windows only takes sockets
+        self._wake_read, self._wake_write = socket.socketpair()
+        self._wake_read.setblocking(False)
+        self._wake_write.setblocking(False)
+        self._selector.register(self._wake_read, selectors.EVENT_READ)
+        if use_inotify and inotify_available():
+            try:
+                self.watcher = Inotify()
+                self._selector.register(self.watcher.fileno(), selectors.EVENT_READ)
+            except OSError as err:
+                print(f"cannot use inotify, polling logs instead: {err}")
+                self.watcher = None
+
+    def add(self, folder: Path, name: Optional[str] = None,
+            follower: Optional[CC2GameFollower] = None) -> CC2GameFollower:
+        """Follow the newest log in folder, returns the follower so callbacks or a fanout can be attached"""
+        if follower is None:
+            follower = CC2GameFollower()
+        follower.use_inotify = False
+        follower.stop_watching()
+        follower.open_latest(folder)
+        server = TailedServer(name or str(folder), follower)
+        # read whatever is already in the log
+        server.changed = time.monotonic()
+        with self._lock:
+            if server.name in self.servers:
+                self.remove(server.name)
+            if self.watcher:
+                server.wd = self.watcher.add_watch(folder)
+                self._by_wd[server.wd] = server
+            self.servers[server.name] = server
+        self.wake()
+        return follower
+
+    def remove(self, name: str) -> None:
+        """Stop following a server and close its log"""
+        with self._lock:
+            server = self.servers.pop(name, None)
+            if server is None:
+                return
+            if server.wd >= 0 and self._by_wd.get(server.wd) is server:
+                del self._by_wd[server.wd]
+                if server.wd not in (x.wd for x in self.servers.values()):
+                    self.watcher.rm_watch(server.wd)
+            server.follower.close()
+
+    def wake(self) -> None:
+        try:
+            self._wake_write.send(b"\0")
+        except BlockingIOError:
+            # already woken
+            pass
+
+    def _read(self, server: TailedServer) -> int:
+        follower = server.follower
+        count = 0
+        while count < self.batch_size:
+            before = follower.offset
+            message = follower.read_one()
+            if message is None and follower.offset == before:
+                # caught up
+                server.delay = time.monotonic() - server.changed
+                server.changed = None
+                break
+            if message is not None:
+                count += 1
+        server.messages += count
+        return count
+
+    def poll_once(self, timeout: Optional[float]) -> int:
+        """Wait up to timeout seconds for a log to change, then read the servers that changed.
+        Returns the number of messages read."""
+        ready = self._selector.select(timeout)
+        self.wakeups += 1
+        now = time.monotonic()
+        count = 0
+        with self._lock:
+            for key, _ in ready:
+                if key.fileobj is self._wake_read:
+                    try:
+                        self._wake_read.recv(4096)
+                    except BlockingIOError:
+                        pass
+                elif self.watcher:
+                    for event in self.watcher.read_events():
+                        server = self._by_wd.get(event.wd)
+                        if server is None:
+                            continue
+                        server.follower.handle_watch_events([event])
+                        if server.changed is None:
+                            server.changed = now
+            for server in list(self.servers.values()):
+                if self.watcher is None and server.changed is None:
+                    server.changed = now
+                if server.changed is None:
+                    continue
+                try:
+                    count += self._read(server)
+                except Exception as err:
+                    server.errors += 1
+                    server.changed = None
+                    print(f"error reading {server.name} logs: {type(err)} {err}")
+        return count
+
+    def run(self) -> None:
+        while not self.quit:
+            with self._lock:
+                pending = any(x.changed is not None for x in self.servers.values())
+            if pending:
+                timeout = 0
+            elif self.watcher:
+                timeout = None
+            else:
+                timeout = self.poll_interval
+            self.poll_once(timeout)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self.quit = True
+        self.wake()
+        if self.is_alive() and self is not threading.current_thread():
+            self.join(timeout)
+
+    def close(self) -> None:
+        self.stop()
+        with self._lock:
+            for name in list(self.servers):
+                self.remove(name)
+            if self.watcher:
+                self.watcher.close()
+                self.watcher = None
+            self._selector.close()
+            self._wake_read.close()
+            self._wake_write.close()
+
+    def lag(self) -> dict[str, dict[str, float]]:
+        """For each server, bytes written to its log that have not been read yet, how long the
+        last change waited to be read, and the number of messages read"""
+        found = {}
+        with self._lock:
+            for name, server in self.servers.items():
+                follower = server.follower
+                try:
+                    behind = max(0, follower.latest_file.stat().st_size - follower.offset)
+                except OSError:
+                    behind = 0
+                found[name] = {"behind_bytes": behind, "delay": server.delay, "messages": server.messages}
+        return found
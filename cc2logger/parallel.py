@@ -0,0 +1,154 @@
+"""Parse many game logs in parallel worker processes"""
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Iterator, Optional
+from .messages import MessageBase, PlayerJoined, PlayerLeft
+from .parser import CC2GameParser, Player
+
+
+class PlayerPartial:
+    """What one log does to a player, to apply on top of what the logs before it did"""
+    def __init__(self, first_seen: int):
+        # the first join or leave in the log
+        self.first_seen = first_seen
+        # (team, left, time in team) for each leave, the time is None for a leave before the player
+        # joins in this log, as it counts from when they joined in an earlier one
+        self.spans: list[tuple[int, int, Optional[timedelta]]] = []
+        # the team after the last join or leave, -1 after a leave
+        self.team = -1
+        # the last join in the log
+        self.joined: Optional[int] = None
+
+
+class LogPartial:
+    """The result of parsing one log on its own, small enough to send back from a worker"""
+    def __init__(self, filepath: Path):
+        self.filepath = filepath
+        self.first: Optional[dict] = None
+        self.last: Optional[dict] = None
+        self.players: dict[int, PlayerPartial] = {}
+        # [player id, name when first joined, latest name] in the order players first joined
+        self.names: list[list] = []
+        # [team, player ids] in the order they first joined the team
+        self.teams: list[list] = []
+        # [player id, team, start, end] of each session in the log
+        self.sessions: list[list] = []
+        self.joined: list[PlayerJoined] = []
+        self.island_captures = 0
+        self.destroyed_stats: dict[str, int] = {}
+
+
+class PartialParser(CC2GameParser):
+    """Count events and sum up what each log does to the players, for the parent to merge in order"""
+    def __init__(self, filepath: Path):
+        super().__init__()
+        self.partial = LogPartial(filepath)
+
+    def player_partial(self, message: PlayerJoined | PlayerLeft) -> PlayerPartial:
+        player = self.partial.players.get(message.player_id)
+        if player is None:
+            player = PlayerPartial(message.epoch)
+            self.partial.players[message.player_id] = player
+        return player
+
+    def on_player_joined(self, message: PlayerJoined) -> None:
+        super().on_player_joined(message)
+        player = self.player_partial(message)
+        player.team = message.team
+        player.joined = message.epoch
+
+    def on_player_left(self, message: PlayerLeft) -> None:
+        super().on_player_left(message)
+        player = self.player_partial(message)
+        span = timedelta(seconds=message.epoch - player.joined) if player.joined is not None else None
+        player.spans.append((message.team, message.epoch, span))
+        player.team = -1
+
+    def on_message(self, data: dict) -> Optional[MessageBase]:
+        message = super().on_message(data)
+        if message:
+            if self.partial.first is None:
+                self.partial.first = data
+            self.partial.last = data
+        return message
+
+
+def parse_partial(filepath: Path) -> LogPartial:
+    p = PartialParser(filepath)
+    p.read(filepath)
+    p.partial.names = [[player_id, p.players[player_id].player_name, name] for player_id, name in p.names.items()]
+    p.partial.teams = [[team, list(players)] for team, players in p.teams.items()]
+    p.partial.sessions = [[x.player_id, x.team, x.start, x.end] for x in p.timeline.sessions]
+    p.partial.joined = p.joined
+    p.partial.island_captures = p.island_captures
+    p.partial.destroyed_stats = p.destroyed_stats
+    return p.partial
+
+
+def merge_partial(gp: CC2GameParser, partial: LogPartial) -> None:
+    """Add one log to gp, giving the same result as gp.read() on that log"""
+    if not gp.streaming:
+        for player_id, player in partial.players.items():
+            if player_id in gp.timeline.open:
+                # the session from an earlier log ends when the player next shows up
+                gp.timeline.leave(player_id, player.first_seen)
+        gp.timeline.add_sessions(partial.sessions)
+        gp.joined.extend(partial.joined)
+
+    known = {x for x in partial.players if x in gp.players}
+    for player_id, first_name, name in partial.names:
+        gp.names[player_id] = name
+        if player_id not in gp.players:
+            gp.players[player_id] = Player(player_id, first_name)
+    for player_id, summary in partial.players.items():
+        player = gp.players.get(player_id)
+        if player is None:
+            # left without joining in any log read so far
+            continue
+        for team, left, span in summary.spans:
+            if span is None and player_id not in known:
+                continue
+            left = datetime.fromtimestamp(left, tz=timezone.utc)
+            if span is not None:
+                player.joined = left - span
+            player.team = team
+            player.update_team_left(left)
+        player.team = summary.team
+        if summary.joined is not None:
+            player.joined = datetime.fromtimestamp(summary.joined, tz=timezone.utc)
+    for team, player_ids in partial.teams:
+        members = gp.teams.setdefault(team, {})
+        for player_id in player_ids:
+            members[player_id] = gp.players[player_id]
+
+    if partial.first is not None:
+        first = gp.factory.parse(partial.first)
+        last = gp.factory.parse(partial.last)
+        if gp.first_epoch is None:
+            gp.first_epoch = first.epoch
+        gp.last_epoch = last.epoch
+        if not gp.streaming:
+            if not gp.first_message:
+                gp.first_message = first
+            gp.last_message = last
+
+    gp.island_captures += partial.island_captures
+    for name, count in partial.destroyed_stats.items():
+        gp.destroyed_stats[name] = gp.destroyed_stats.get(name, 0) + count
+    gp.finish()
+
+
+def parse_partials(files: list[Path], jobs: int) -> Iterator[LogPartial]:
+    """Parse files in a pool of jobs processes, yielding results in the same order as files"""
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        yield from pool.map(parse_partial, files)
+
+
+def read_files(files: list[Path], jobs: int, gp: Optional[CC2GameParser] = None) -> CC2GameParser:
+    """Parse files using jobs processes, same as calling gp.read() on each file in turn"""
+    if gp is None:
+        gp = CC2GameParser()
+    for partial in parse_partials(files, jobs):
+        merge_partial(gp, partial)
+    return gp
@@ -1,42 +1,96 @@
+import asyncio
+import hashlib
+import io
 import json
-import os
-import subprocess
 import time
-from datetime import datetime, timedelta
+from fnmatch import fnmatch
+from datetime import datetime, timedelta, timezone
 from abc import abstractmethod, ABC
 from typing import Optional
-from collections.abc import Callable
+from collections.abc import Callable, AsyncIterator, Iterable, Iterator
 from pathlib import Path
-from textwrap import dedent
-from io import StringIO
 from .resolver import Vehicle
-from .messages import MessageBase, MessageFactory, PlayerJoined, PlayerLeft, CapturedIsland, DestroyedVehicle
+from .reader import BlockReader, MmapReader, MAX_RECORD_SIZE, MAX_RECORD_LINES, record_start, encoded_len
+from .archive import open_log, find_logs, is_compressed
+from .columns import EventStore, TimeValue, epoch
+from .fanout import FanOut
+from .inotify import Inotify, inotify_available, IN_CREATE, IN_MOVED_TO
+from .timeindex import TimeIndex, find_index, keep_index
+from .sessions import SessionTimeline
+from . import messages
+from .messages import (MessageBase, MessageFactory, PlayerJoined, PlayerLeft, CapturedIsland, DestroyedVehicle,
+                       type_names)
 
 
 Callback = Callable[[MessageBase], bool]
 
+# message types CC2GameParser builds its stats from
+AGGREGATED_TYPES = frozenset(["player_joined", "player_left", "island_captured", "destroy_vehicle"])
+
+# messages stream() yields before letting other tasks run, so a backlogged log cannot starve them
+STREAM_BATCH = 100
+
 
 class JsonlParserBase(ABC):
+    """Read records from a jsonl log with one of these engines:
+        block - read in large blocks, works for growing and compressed logs
+        mmap  - split records straight from a memory map, for finished uncompressed logs,
+                other logs are read with the block engine
+        line  - read a line at a time
+    """
     def __init__(self):
         self.filepath: Optional[Path] = None
         self._fd = None
         self._rx = ""
-
-    def open(self, filepath: Path):
+        self._reader: Optional[BlockReader | MmapReader] = None
+        self._rx_lines = 0
+        self._rx_start = 0
+        self._pending = ""
+        self.engine = "block"
+        self.tailing = False
+        self.bad_records = 0
+
+    def open(self, filepath: Path, offset: int = 0):
         self.filepath = filepath
-        self._fd = self.filepath.open("r", encoding="utf-8")
+        if self.engine == "line":
+            self._fd = io.TextIOWrapper(open_log(self.filepath, offset), encoding="utf-8")
+            self._reader = None
+            self._rx = ""
+            self._rx_lines = 0
+            self._pending = ""
+        elif self.engine == "mmap" and not self.tailing and not is_compressed(filepath):
+            self._fd = filepath.open("rb")
+            self._fd.seek(offset)
+            self._reader = MmapReader(self._fd)
+            self._reader.on_bad_record = self.bad_record
+        else:
+            self._fd = open_log(self.filepath, offset)
+            self._reader = BlockReader(self._fd)
+            self._reader.tailing = self.tailing
+            self._reader.on_bad_record = self.bad_record
 
     def close(self):
+        if isinstance(self._reader, MmapReader):
+            self._reader.close()
         if self._fd:
             self._fd.close()
 
-    def read(self, filepath: Path) -> None:
+    @property
+    def offset(self) -> int:
+        """Byte offset in the open file just after the last complete record"""
+        if self._reader:
+            return self._reader.offset
+        # less the unfinished record and line, newlines in _rx became spaces of the same size
+        return self._fd.tell() - encoded_len(self._rx) - encoded_len(self._pending)
+
+    def read(self, filepath: Path, offset: int = 0) -> None:
         try:
-            self.open(filepath)
+            self.open(filepath, offset)
             while True:
-                msg = self.read_one()
-                if not msg:
+                data = self.read_record()
+                if data is None:
                     break
+                self.on_message(data)
         finally:
             self.close()
 
@@ -45,8 +99,21 @@ class JsonlParserBase(ABC):
     def on_message(self, data: dict) -> Optional[MessageBase]:
         pass
 
+    def bad_record(self, offset: int) -> None:
+        """Called for each corrupt record skipped, with the byte offset it started at"""
+        self.bad_records += 1
+        if self.bad_records <= 10:
+            print(f"skipped a corrupt record in {self.filepath} at byte {offset}")
+
     def read_chunk(self):
         chunk = self._fd.readline()
+        if self.tailing and chunk and not chunk.endswith("\n"):
+            # the rest of this line has not been written yet, keep it until it has
+            self._pending += chunk
+            return None
+        if self._pending:
+            chunk = self._pending + chunk
+            self._pending = ""
         if chunk:
             self._rx += chunk.replace("\n", " ")
         else:
@@ -54,19 +121,51 @@ class JsonlParserBase(ABC):
 
         return self._rx
 
+    def read_record(self) -> Optional[dict]:
+        if self._reader:
+            return self._reader.next_record()
+        while True:
+            start = len(self._rx)
+            chunk = self.read_chunk()
+            if chunk is None:
+                if not self.tailing:
+                    if self._rx.strip():
+                        # file ended part way through a record
+                        self.bad_record(self._rx_start)
+                    self._rx = ""
+                    self._rx_lines = 0
+                return None
+            line = chunk[start:]
+            self._rx_lines += 1
+            if self._rx_lines > 1 and record_start(line):
+                # a new record starts, the one being joined was cut short
+                self.bad_record(self._rx_start)
+                self._rx = line
+                self._rx_lines = 1
+            try:
+                data = json.loads(self._rx)
+                self._rx = ""
+                self._rx_lines = 0
+                return data
+            except json.JSONDecodeError:
+                if self._rx_lines == 1:
+                    self._rx_start = self._fd.tell() - encoded_len(line)
+                if self._rx_lines >= MAX_RECORD_LINES or len(self._rx) > MAX_RECORD_SIZE or not self._rx.strip():
+                    if self._rx.strip():
+                        self.bad_record(self._rx_start)
+                    self._rx = ""
+                    self._rx_lines = 0
+
     def read_one(self) -> Optional[MessageBase]:
+        """The next message, records that are not made into one are passed over"""
         if self._fd:
             while True:
-                try:
-                    chunk = self.read_chunk()
-                    if chunk is None:
-                        self._rx = ""
-                        break
-                    data = json.loads(chunk)
-                    self._rx = ""
-                    return self.on_message(data)
-                except json.JSONDecodeError:
-                    pass
+                data = self.read_record()
+                if data is None:
+                    break
+                message = self.on_message(data)
+                if message is not None:
+                    return message
 
         return None
 
@@ -95,6 +194,29 @@ class Player:
             total += value.total_seconds()
         return total
 
+    def get_state(self) -> list:
+        """Get the player as a row of plain values, times as epoch seconds"""
+        return [
+            self.player_id,
+            self.player_name,
+            [[team, timespan.total_seconds()] for team, timespan in self.teams.items()],
+            self.team,
+            self.joined.timestamp() if self.joined else None,
+            self.left.timestamp() if self.left else None,
+        ]
+
+    @classmethod
+    def from_state(cls, state: list) -> "Player":
+        player_id, player_name, teams, team, joined, left = state
+        player = cls(player_id, player_name)
+        player.teams = {team: timedelta(seconds=seconds) for team, seconds in teams}
+        player.team = team
+        if joined is not None:
+            player.joined = datetime.fromtimestamp(joined, tz=timezone.utc)
+        if left is not None:
+            player.left = datetime.fromtimestamp(left, tz=timezone.utc)
+        return player
+
     def __repr__(self):
         return str(self)
 
@@ -103,17 +225,34 @@ class Player:
 
 
 class CC2GameParser(JsonlParserBase):
+    """Aggregate stats from game logs.
+
+    With streaming set only the aggregate state is kept, no message objects, joined messages or
+    player sessions are retained, so memory does not grow with the length of the history read.
+    """
 
     def __init__(self):
         super().__init__()
         self.factory = MessageFactory()
+        self.streaming = False
+        self.first_epoch: Optional[int] = None
+        self.last_epoch: Optional[int] = None
         self.first_message: Optional[MessageBase] = None
         self.last_message: Optional[MessageBase] = None
         self.joined: list[PlayerJoined] = []
+        self.names: dict[int, str] = {}
         self.players: dict[int, Player] = {}
         self.island_captures = 0
         self.destroyed_stats = {}
         self.debug_enabled = False
+        self.store: Optional[EventStore] = None
+        self._range_files: list[Path] = []
+        self._range_index: Optional[TimeIndex] = None
+        # time indexes of the logs read_range() has read, by log path
+        self.time_indexes: dict[Path, TimeIndex] = {}
+        # also keep them as .tidx files next to the logs
+        self.save_index = False
+        self.timeline = SessionTimeline()
         for item in Vehicle:
             self.destroyed_stats[item.name] = 0
         self.teams: dict[int, dict[int, Player]] = {}
@@ -124,76 +263,243 @@ class CC2GameParser(JsonlParserBase):
 
     def reset(self):
         self.debug("reset parser")
+        self.first_epoch = None
+        self.last_epoch = None
         self.first_message = None
         self.last_message = None
         self.joined.clear()
+        self.names.clear()
         self.players.clear()
         self.destroyed_stats.clear()
         self.teams.clear()
+        self.timeline.reset()
 
     @property
     def started(self) -> Optional[datetime]:
-        if self.first_message:
-            return self.first_message.timestamp
+        if self.first_epoch is not None:
+            return datetime.fromtimestamp(self.first_epoch, tz=timezone.utc)
         return None
 
     @property
     def duration(self) -> timedelta:
-        if self.first_message and self.last_message:
-            return self.last_message.timestamp - self.first_message.timestamp
+        if self.first_epoch is not None and self.last_epoch is not None:
+            return timedelta(seconds=self.last_epoch - self.first_epoch)
         return timedelta(seconds=0)
 
     @property
     def player_names(self) -> dict[int, str]:
-        found = {}
-        for msg in self.joined:
-            found[msg.player_id] = msg.player_name
-        return found
+        return dict(self.names)
+
+    def on_player_joined(self, message: PlayerJoined) -> None:
+        self.names[message.player_id] = message.player_name
+        if not self.streaming:
+            self.joined.append(message)
+            self.timeline.join(message.player_id, message.team, message.epoch)
+        player = self.players.get(message.player_id, Player(message.player_id, message.player_name))
+        player.team = message.team
+        player.joined = message.timestamp
+        self.players[player.player_id] = player
+
+        if player.team not in self.teams:
+            self.teams[player.team] = {}
+        self.teams[player.team][player.player_id] = player
+
+    def on_player_left(self, message: PlayerLeft) -> None:
+        if not self.streaming:
+            self.timeline.leave(message.player_id, message.epoch)
+        player = self.players.get(message.player_id)
+        if player is None:
+            # joined before the part of the log being read
+            return
+        player.team = message.team
+        player.update_team_left(message.timestamp)
+        player.team = -1
+
+    def on_captured_island(self, message: CapturedIsland) -> None:
+        self.island_captures += 1
+
+    def on_destroyed_vehicle(self, message: DestroyedVehicle) -> None:
+        if message.vehicle_type_name not in self.destroyed_stats:
+            self.destroyed_stats[message.vehicle_type_name] = 1
+        else:
+            self.destroyed_stats[message.vehicle_type_name] += 1
 
     def on_message(self, data: dict) -> Optional[MessageBase]:
         message = self.factory.parse(data)
         if message:
+            self.add_message(message)
+        elif self.factory.skipped and data.get("type") in self.factory.skipped:
+            # not built, but still part of the game's time span
+            self.last_epoch = messages.parse_epoch(data.get("timestamp"))
+            if self.first_epoch is None:
+                self.first_epoch = self.last_epoch
+        return message
+
+    def add_message(self, message: MessageBase) -> None:
+        """Add a message to the stats"""
+        self.last_epoch = message.epoch
+        if self.first_epoch is None:
+            self.first_epoch = message.epoch
+        if not self.streaming:
             self.last_message = message
             if not self.first_message:
                 self.first_message = message
-            if isinstance(message, PlayerJoined):
-                self.joined.append(message)
-                player = self.players.get(message.player_id, Player(message.player_id, message.player_name))
-                player.team = message.team
-                player.joined = message.timestamp
-                self.players[player.player_id] = player
-
-                if player.team not in self.teams:
-                    self.teams[player.team] = {}
-                self.teams[player.team][player.player_id] = player
-
-            elif isinstance(message, PlayerLeft):
-                player = self.players.get(message.player_id)
-                player.team = message.team
-                player.update_team_left(message.timestamp)
-                player.team = -1
-
-            elif isinstance(message, CapturedIsland):
-                self.island_captures += 1
-            elif isinstance(message, DestroyedVehicle):
-                if message.vehicle_type_name not in self.destroyed_stats:
-                    self.destroyed_stats[message.vehicle_type_name] = 1
-                else:
-                    self.destroyed_stats[message.vehicle_type_name] += 1
-        return message
-
-    def read(self, filepath: Path) -> None:
-        super().read(filepath)
+        if self.store is not None:
+            self.store.add(message)
+        if isinstance(message, PlayerJoined):
+            self.on_player_joined(message)
+        elif isinstance(message, PlayerLeft):
+            self.on_player_left(message)
+        elif isinstance(message, CapturedIsland):
+            self.on_captured_island(message)
+        elif isinstance(message, DestroyedVehicle):
+            self.on_destroyed_vehicle(message)
+
+    def consume(self, messages: Iterable[MessageBase]) -> "CC2GameParser":
+        """Add every message from an iterator, eg a pipeline from cc2logger.pipeline, then finish()"""
+        add_message = self.add_message
+        for message in messages:
+            add_message(message)
+        self.finish()
+        return self
+
+    def finish(self) -> None:
+        """Close off play time for players still in a team at the end of a log"""
+        if self.last_epoch is None:
+            return
+        ended = datetime.fromtimestamp(self.last_epoch, tz=timezone.utc)
         for player in self.players.values():
             if player.team > 0:
-                player.update_team_left(self.last_message.timestamp)
+                player.update_team_left(ended)
+        self.timeline.finish(self.last_epoch)
+
+    def read(self, filepath: Path, offset: int = 0) -> None:
+        super().read(filepath, offset)
+        self.finish()
+
+    def get_state(self) -> dict:
+        """Get the aggregate state as plain data types"""
+        return {
+            "first": self.first_epoch,
+            "last": self.last_epoch,
+            "names": [[player_id, name] for player_id, name in self.names.items()],
+            "players": [player.get_state() for player in self.players.values()],
+            "teams": [[team, list(players.keys())] for team, players in self.teams.items()],
+            "island_captures": self.island_captures,
+            "destroyed_stats": dict(self.destroyed_stats),
+            "sessions": self.timeline.get_state(),
+        }
+
+    def set_state(self, state: dict) -> None:
+        """Restore the aggregate state saved by get_state()"""
+        def message(stamp: Optional[int]) -> Optional[MessageBase]:
+            if stamp is not None:
+                msg = MessageBase()
+                msg.epoch = stamp
+                return msg
+            return None
+
+        self.first_epoch = state["first"]
+        self.last_epoch = state["last"]
+        if not self.streaming:
+            self.first_message = message(state["first"])
+            self.last_message = message(state["last"])
+        # joined messages are not saved, player names are
+        self.joined.clear()
+        self.names = dict((player_id, name) for player_id, name in state["names"])
+        self.players = {}
+        for item in state["players"]:
+            player = Player.from_state(item)
+            self.players[player.player_id] = player
+        self.teams = {}
+        for team, player_ids in state["teams"]:
+            self.teams[team] = {x: self.players[x] for x in player_ids}
+        self.island_captures = state["island_captures"]
+        self.destroyed_stats = dict(state["destroyed_stats"])
+        self.timeline.set_state(state["sessions"])
 
     def read_path(self, folder: Path) -> None:
-        files = sorted(list(folder.glob("game_log_*.jsonl")))
+        files = find_logs(folder)
         self.reset()
         for x in files:
             self.read(x)
 
+    def seek(self, timestamp: TimeValue, folder: Path) -> bool:
+        """Open the first log in folder with records at or after timestamp, near the first such record.
+        A log with no kept time index is opened at the start."""
+        wanted = epoch(timestamp)
+        files = find_logs(folder)
+        for pos, filepath in enumerate(files):
+            index = find_index(filepath, self.time_indexes, self.save_index)
+            if index is not None and (not index.offsets or index.max_epoch < wanted):
+                continue
+            self.open(filepath, index.offset_for(wanted) if index is not None else 0)
+            self._range_files = files[pos + 1:]
+            self._range_index = index
+            return True
+        self._range_files = []
+        return False
+
+    def _next_range_log(self, end: int) -> bool:
+        """Open the next log that may have records up to end"""
+        while self._range_files:
+            filepath = self._range_files.pop(0)
+            self._range_index = find_index(filepath, self.time_indexes, self.save_index)
+            if self._range_index is not None:
+                if not self._range_index.offsets:
+                    continue
+                if self._range_index.min_epoch > end:
+                    return False
+            self.open(filepath)
+            return True
+        return False
+
+    def read_range(self, folder: Path, start: TimeValue, end: TimeValue) -> Iterator[MessageBase]:
+        """Parse and yield the messages from start to end inclusive, using the time index to skip the rest.
+        Logs with no kept index are read once from the start and indexed on the way."""
+        start = epoch(start)
+        end = epoch(end)
+        if not self.seek(start, folder):
+            return
+        try:
+            while True:
+                building = TimeIndex(self.filepath) if self._range_index is None else None
+                after = self.offset
+                while True:
+                    data = self.read_record()
+                    if data is None:
+                        break
+                    try:
+                        stamp = messages.parse_epoch(data["timestamp"])
+                    except (KeyError, TypeError, ValueError):
+                        after = self.offset
+                        continue
+                    if building is not None:
+                        building.add(stamp, after)
+                        after = self.offset
+                    if stamp < start:
+                        continue
+                    if stamp <= end:
+                        message = self.on_message(data)
+                        if message:
+                            yield message
+                        continue
+                    # a record written out of order may still be in range
+                    if building is None and self._range_index.all_after(self.offset, end):
+                        # nothing left in this log is in range
+                        break
+                if building is not None:
+                    building.finish(after)
+                    keep_index(building, self.time_indexes, self.save_index)
+                self.close()
+                if not self._next_range_log(end):
+                    break
+        finally:
+            self.close()
+            self._range_files = []
+            self._range_index = None
+        self.finish()
+
 
 class CC2GameFollower(CC2GameParser):
     def __init__(self):
@@ -205,14 +511,112 @@ class CC2GameFollower(CC2GameParser):
         self.check_latest_interval = 30
         self.files = []
         self.callbacks: list[Callback] = []
+        # subscribers for one message type, by record type name
+        self.topics: dict[str, list[Callback]] = {}
+        self.tailing = True
+        self.use_inotify = True
+        self.watcher: Optional[Inotify] = None
+        self._new_log = False
+        self._draining = False
+        self._wake: Optional[asyncio.Event] = None
+        self.fanout: Optional[FanOut] = None
+        self._wanted_key = None
+        self._topics_version = 0
 
     def get_files(self) -> list[Path]:
         files = sorted(list(self.folder.glob("game_log_*.jsonl")))
         self.debug(f"{len(files)} game logs in {self.folder}")
         return files
 
+    def start_watching(self) -> None:
+        """Use inotify to wait for log changes if we can, otherwise poll"""
+        if self.use_inotify and self.watcher is None and inotify_available():
+            try:
+                self.watcher = Inotify()
+                self.watcher.add_watch(self.folder)
+                self.debug(f"watching {self.folder} with inotify")
+            except OSError as err:
+                self.debug(f"cannot use inotify: {err}")
+                self.stop_watching()
+
+    def stop_watching(self) -> None:
+        if self.watcher:
+            self.watcher.close()
+            self.watcher = None
+
+    def wait(self, timeout: float) -> bool:
+        """Wait for the logs to change, returns True if woken early by a change"""
+        if self.watcher:
+            events = self.watcher.wait(timeout)
+            self.handle_watch_events(events)
+            return len(events) > 0
+        time.sleep(timeout)
+        return False
+
+    def handle_watch_events(self, events: list) -> None:
+        for event in events:
+            if event.mask & (IN_CREATE | IN_MOVED_TO) and fnmatch(event.name, "game_log_*.jsonl"):
+                self._new_log = True
+
+    def request_stop(self) -> None:
+        """Stop following, wakes up stream() if it is waiting"""
+        self.stop = True
+        if self._wake:
+            self._wake.set()
+
+    async def stream(self, poll_interval: float = 2, idle_timeout: Optional[float] = None) -> AsyncIterator[MessageBase]:
+        """Yield messages as they are written to the log, call open_latest() first.
+
+        Raises TimeoutError if idle_timeout is set and no message arrives for that many seconds.
+        Ends when request_stop() is called.
+        """
+        loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        fileno = -1
+        if self.watcher:
+            fileno = self.watcher.fileno()
+            loop.add_reader(fileno, self._wake.set)
+        try:
+            last_message = loop.time()
+            batch = 0
+            while not self.stop:
+                message = self.read_one()
+                if message:
+                    last_message = loop.time()
+                    yield message
+                    batch += 1
+                    if batch >= STREAM_BATCH:
+                        batch = 0
+                        await asyncio.sleep(0)
+                    continue
+                batch = 0
+                if self.stop:
+                    break
+
+                wait = poll_interval
+                if idle_timeout is not None:
+                    remaining = last_message + idle_timeout - loop.time()
+                    if remaining <= 0:
+                        raise TimeoutError(f"no messages for {idle_timeout} seconds")
+                    wait = min(wait, remaining)
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                if self.watcher:
+                    self.handle_watch_events(self.watcher.read_events())
+        finally:
+            if fileno >= 0:
+                loop.remove_reader(fileno)
+            self._wake = None
+
     def open_latest(self, folder):
+        if folder != self.folder:
+            self.stop_watching()
         self.folder = folder
+        self.start_watching()
+        self._new_log = False
         self.files = self.get_files()
         last = self.files[-1]
         self.latest_file = last
@@ -228,31 +632,89 @@ class CC2GameFollower(CC2GameParser):
         self.debug(f"got {resp}")
         return resp
 
+    def read_record(self) -> Optional[dict]:
+        if self.stop:
+            raise StopIteration()
+        return super().read_record()
+
+    def subscribe(self, func: Callback, types: Iterable[str | type]) -> None:
+        """Call func with messages of these types only, given as record type names or message classes.
+        Callbacks are called before subscribers, and each in turn until one returns True."""
+        for type_name in type_names(types):
+            self.topics.setdefault(type_name, []).append(func)
+        self._topics_version += 1
+
+    def unsubscribe(self, func: Callback) -> None:
+        for funcs in self.topics.values():
+            while func in funcs:
+                funcs.remove(func)
+        self._topics_version += 1
+
+    def wanted_types(self) -> Optional[set[str]]:
+        """Message types something needs built, None if every type is needed"""
+        if self.callbacks or self.store is not None:
+            return None
+        wanted = set(AGGREGATED_TYPES)
+        wanted.update(x for x, funcs in self.topics.items() if funcs)
+        if self.fanout:
+            published = self.fanout.wanted_types()
+            if published is None:
+                return None
+            wanted.update(published)
+        return wanted
+
+    def update_factory(self) -> None:
+        """Skip building the messages no callback, subscriber or stat needs"""
+        key = (bool(self.callbacks), self._topics_version, self.store is None,
+               self.fanout, self.fanout.version if self.fanout else 0)
+        if key != self._wanted_key:
+            self._wanted_key = key
+            self.factory.only(self.wanted_types())
+
     def dispatch(self, message: MessageBase) -> None:
-        for func in self.callbacks:
-            try:
-                handled = func(message)
-                if handled:
-                    return
-            except Exception as err:
-                print(f"subscriber function raised {type(err)}")
-                self.debug(str(err))
+        if self.fanout:
+            self.fanout.publish(message)
+        for funcs in (self.callbacks, self.topics.get(message.type, ())):
+            for func in funcs:
+                try:
+                    handled = func(message)
+                    if handled:
+                        return
+                except Exception as err:
+                    print(f"subscriber function raised {type(err)}")
+                    self.debug(str(err))
 
     def read_one(self) -> Optional[MessageBase]:
         self.debug(f"read_one() {self._fd.tell()}")
         now = time.monotonic()
         elapsed = now - self.checked_latest
-        if elapsed > self.check_latest_interval:
+        if self.watcher:
+            check = self._new_log
+        else:
+            # _new_log may be set by a watcher shared with other followers, see MultiTailer
+            check = self._new_log or elapsed > self.check_latest_interval
+        if check and not self._draining:
             self.debug("checking for new logs")
             self.checked_latest = now
+            self._new_log = False
             if self.files != self.get_files():
                 print("new game log found, following..")
-                # new file, perhaps game ended and restarted
-                self.close()
-                self.open_latest(self.folder)
+                # new file, perhaps game ended and restarted, finish reading the old one first
+                self._draining = True
+                self.tailing = False
+                if self._reader:
+                    self._reader.tailing = False
 
+        self.update_factory()
         try:
+            before = self.offset if self._draining else 0
             data = super().read_one()
+            if data is None and self._draining and self.offset == before:
+                self._draining = False
+                self.tailing = True
+                self.close()
+                self.open_latest(self.folder)
+                data = super().read_one()
             self.debug(f"got: {data}")
             if data:
                 self.dispatch(data)
@@ -261,47 +723,80 @@ class CC2GameFollower(CC2GameParser):
             self.reset()
 
 
-def generate_lua_stats_page(p: CC2GameParser) -> str:
+LUA_PAGE_HEADER = """
+if g_man_pages == nil then
+    g_man_pages = {}
+end
+table.insert(g_man_pages, {
+title = "Server Stats",
+content = {
+"""
+
+_LUA_ESCAPES = {"\\": "\\\\", '"': '\\"', "\n": "\\n", "\r": "\\r", "\t": "\\t"}
+_written_pages: dict[Path, str] = {}
+
+
+def lua_string(value: str) -> str:
+    """Quote value as a Lua string literal, escaping anything that could end or break it"""
+    out = []
+    for char in value:
+        code = ord(char)
+        if char in _LUA_ESCAPES:
+            out.append(_LUA_ESCAPES[char])
+        elif code < 32 or code == 127:
+            out.append(f"\\{code:03d}")
+        elif 0xD800 <= code <= 0xDFFF:
+            # not encodable as utf-8
+            out.append("\ufffd")
+        else:
+            out.append(char)
+    return '"' + "".join(out) + '"'
+
 
-    buf = StringIO()
-    print(dedent("""
-        if g_man_pages == nil then
-            g_man_pages = {}
-        end
-        table.insert(g_man_pages, {
-        """), file=buf)
-
-    print(dedent("""
-    title = "Server Stats",
-    content = {
-    """), file=buf)
-    print(""" { "h", "First Started" }, """, file=buf)
-    print(f""" "{p.first_message.timestamp}", """, file=buf)
-    print(""" { "h", "Runtime" }, """, file=buf)
-    print(f""" "{int(p.duration.total_seconds() / 60):-5} mins", """, file=buf)
-    print(""" { "h", "Past Players" }, """, file=buf)
+def stats_page_rows(p: CC2GameParser) -> list[tuple[bool, str]]:
+    """The stats page as (heading, text) rows"""
+    rows = [(True, "First Started"), (False, str(p.started)),
+            (True, "Runtime"), (False, f"{int(p.duration.total_seconds() / 60):-5} mins"),
+            (True, "Past Players")]
     for steamid, player in sorted(p.players.items(), reverse=True, key=lambda x: x[1].total_playtime):
-        print(f"""" {player.player_name}", """, file=buf)
-    print(""" { "h", "Islands Captured" }, """, file=buf)
-    print(f""" "{p.island_captures}", """, file=buf)
-    print(""" { "h", "Units Destroyed" }, """, file=buf)
-    print(f""" "total - {sum(p.destroyed_stats.values()):-4}", """, file=buf)
+        rows.append((False, f" {player.player_name}"))
+    rows.append((True, "Islands Captured"))
+    rows.append((False, str(p.island_captures)))
+    rows.append((True, "Units Destroyed"))
+    rows.append((False, f"total - {sum(p.destroyed_stats.values()):-4}"))
     for name in sorted(p.destroyed_stats.keys()):
         count = p.destroyed_stats.get(name, 0)
         if count:
-            print(f""" " {name:16}: {count:-4}", """, file=buf)
+            rows.append((False, f" {name:16}: {count:-4}"))
+    return rows
+
+
+def generate_lua_stats_page(p: CC2GameParser) -> str:
+    """Render the stats page as a Lua man page, every value is an escaped string literal so it is always valid"""
+    lines = [LUA_PAGE_HEADER]
+    for heading, text in stats_page_rows(p):
+        if heading:
+            lines.append(f' {{ "h", {lua_string(text)} }},\n')
+        else:
+            lines.append(f" {lua_string(text)},\n")
+    lines.append("}})\n")
+    return "".join(lines)
 
-    print("}})", file=buf)
-    lua = buf.getvalue()
+
+def write_lua_stats_page(p: CC2GameParser, filepath: Path) -> bool:
+    """Write the stats page to filepath unless the same page is already there, returns True if written"""
+    data = generate_lua_stats_page(p).encode("utf-8")
+    digest = hashlib.sha1(data).hexdigest()
+    if _written_pages.get(filepath) == digest and filepath.exists():
+        return False
     try:
-        proc = subprocess.Popen("lua5.3", stdin=subprocess.PIPE, stderr=subprocess.STDOUT, stdout=subprocess.PIPE,
-                                encoding="utf-8")
-        result = proc.communicate(lua)
-        if result[0] == "":
-            return lua
-        return ""
-    except FileNotFoundError as err:
-        if "BAD_LUA" not in os.environ:
-            print(f"cannot run lua5.3, {err}")
-            os.environ["BAD_LUA"] = "1"
-        return lua
+        if hashlib.sha1(filepath.read_bytes()).hexdigest() == digest:
+            _written_pages[filepath] = digest
+            return False
+    except OSError:
+        pass
+    tmp = filepath.with_name(filepath.name + ".tmp")
+    tmp.write_bytes(data)
+    tmp.replace(filepath)
+    _written_pages[filepath] = digest
+    return True
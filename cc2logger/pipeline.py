@@ -0,0 +1,160 @@
+"""Lazy, composable pipelines over game events.
+
+iter_events() yields messages from log files, folders of logs or a live CC2GameFollower, and the
+stages below each take and return an iterator, so events are read only as they are consumed and
+nothing is collected into lists except the one window being built by window(). Stages can be
+nested as functions or chained from an Events:
+
+    events = iter_events([Path("logs")]).filter_type("destroy_vehicle").by_player("Bredroll")
+    kills = events.aggregate("vehicle")
+
+CC2GameParser.consume() turns any pipeline into the usual stats summary.
+"""
+from collections import Counter
+from collections.abc import Callable, Hashable, Iterable, Iterator
+from pathlib import Path
+from typing import Optional
+from .columns import TimeValue, epoch
+from .messages import MessageBase, MessageFactory, MESSAGE_TYPES, type_names
+from .parser import CC2GameParser, CC2GameFollower
+from .query import Query, iter_records, select, build, count_key
+
+Source = Path | Iterable[Path] | CC2GameFollower
+KeyFunc = Callable[[MessageBase], Optional[Hashable]]
+
+
+def follow(follower: CC2GameFollower, poll_interval: float = 2,
+           types: Optional[Iterable[str | type]] = None, end: Optional[TimeValue] = None) -> Iterator[MessageBase]:
+    """Yield messages as they are written to the log the follower has open, until request_stop() or the
+    first message after end"""
+    end = None if end is None else epoch(end)
+    names = type_names(types) if types is not None else frozenset(MESSAGE_TYPES)
+
+    def wanted(message: MessageBase) -> bool:
+        # subscribed only so the follower builds these types
+        return False
+
+    follower.subscribe(wanted, names)
+    try:
+        while not follower.stop:
+            message = follower.read_one()
+            if message is not None:
+                if end is not None and message.epoch > end:
+                    return
+                if message.type in names:
+                    yield message
+                continue
+            if not follower.stop:
+                follower.wait(poll_interval)
+    finally:
+        follower.unsubscribe(wanted)
+
+
+def filter_type(events: Iterable[MessageBase], *types: str | type) -> Iterator[MessageBase]:
+    """Messages of these types, given as record type names or message classes"""
+    names = type_names(types)
+    for message in events:
+        if message.type in names:
+            yield message
+
+
+def between(events: Iterable[MessageBase], start: Optional[TimeValue] = None,
+            end: Optional[TimeValue] = None) -> Iterator[MessageBase]:
+    """Messages from start to end inclusive. A message can be written out of time order, so later ones are
+    still looked at after one past end, iter_events() uses the time index to stop reading logs early"""
+    start = None if start is None else epoch(start)
+    end = None if end is None else epoch(end)
+    for message in events:
+        if (start is None or message.epoch >= start) and (end is None or message.epoch <= end):
+            yield message
+
+
+def by_player(events: Iterable[MessageBase], player: int | str) -> Iterator[MessageBase]:
+    """Messages about one player, by steam id or name"""
+    if isinstance(player, str) and player.isdigit():
+        player = int(player)
+    field = "player_id" if isinstance(player, int) else "player_name"
+    for message in events:
+        if getattr(message, field, None) == player:
+            yield message
+
+
+def window(events: Iterable[MessageBase], seconds: int) -> Iterator[tuple[int, list[MessageBase]]]:
+    """Group messages into consecutive windows of seconds, yields (start epoch, messages) for each window
+    with any messages in it. A window is yielded once the first message after it arrives, or the events end."""
+    start = None
+    batch: list[MessageBase] = []
+    for message in events:
+        bucket = message.epoch - message.epoch % seconds
+        if bucket != start:
+            if batch:
+                yield start, batch
+            start = bucket
+            batch = []
+        batch.append(message)
+    if batch:
+        yield start, batch
+
+
+def aggregate(events: Iterable[MessageBase], key: str | KeyFunc) -> Counter:
+    """Count messages by one of query.COUNT_KEYS or by the result of a function, None is not counted"""
+    if isinstance(key, str):
+        name = key
+        key = lambda message: count_key(message, name)
+    counts = Counter()
+    for message in events:
+        value = key(message)
+        if value is not None:
+            counts[value] += 1
+    return counts
+
+
+class Events:
+    """An iterator of messages with the pipeline stages as methods, nothing is read until it is iterated"""
+    def __init__(self, messages: Iterable[MessageBase]):
+        self._messages = messages
+
+    def __iter__(self) -> Iterator[MessageBase]:
+        return iter(self._messages)
+
+    def filter_type(self, *types: str | type) -> "Events":
+        return Events(filter_type(self._messages, *types))
+
+    def between(self, start: Optional[TimeValue] = None, end: Optional[TimeValue] = None) -> "Events":
+        return Events(between(self._messages, start, end))
+
+    def by_player(self, player: int | str) -> "Events":
+        return Events(by_player(self._messages, player))
+
+    def window(self, seconds: int) -> Iterator[tuple[int, list[MessageBase]]]:
+        return window(self._messages, seconds)
+
+    def aggregate(self, key: str | KeyFunc) -> Counter:
+        return aggregate(self._messages, key)
+
+    def summary(self, parser: Optional[CC2GameParser] = None) -> CC2GameParser:
+        """Player, team and vehicle stats for the events, added to parser if given"""
+        return (parser or CC2GameParser()).consume(self._messages)
+
+
+def iter_events(source: Source, start: Optional[TimeValue] = None, end: Optional[TimeValue] = None,
+                types: Optional[Iterable[str | type]] = None, poll_interval: float = 2,
+                factory: Optional[MessageFactory] = None) -> Events:
+    """Messages from a log, a folder of logs, a list of either, or a follower's live log.
+
+    start, end and types are applied to the raw records before messages are built, and for logs on
+    disk start and end use the time index to skip straight to the first record needed.
+    """
+    if isinstance(source, CC2GameFollower):
+        # a live log is not indexed, it ends at the first message after end
+        events = follow(source, poll_interval, types, end)
+        if start is not None or end is not None:
+            events = between(events, start, end)
+        return Events(events)
+    paths = [source] if isinstance(source, Path) else list(source)
+    query = Query()
+    if types is not None:
+        query.types.update(type_names(types))
+    start = None if start is None else epoch(start)
+    end = None if end is None else epoch(end)
+    return Events(build(select(iter_records(paths, start, end), query), factory))
@@ -0,0 +1,245 @@
+"""Streaming queries over game logs.
+
+Filters are checked against the raw json records before any message objects are built, and time
+windows use the time index to skip to the first relevant record, so memory use does not grow with
+the amount of history being searched.
+"""
+import argparse
+import json
+from collections import Counter
+from datetime import datetime, timezone
+from collections.abc import Callable, Iterable, Iterator
+from pathlib import Path
+from typing import Optional, TextIO
+from .archive import find_logs, open_log
+from . import messages
+from .messages import MessageBase, MessageFactory, DestroyedVehicle
+from .reader import BlockReader
+from .resolver import Vehicle
+from .timeindex import TimeIndex, find_index, keep_index
+
+RecordCheck = Callable[[dict], bool]
+
+COUNT_KEYS = ["type", "player", "team", "vehicle"]
+
+
+def _int(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def vehicle_type(value: str) -> int:
+    """Vehicle type number from a name or number"""
+    if value.isdigit():
+        return int(value)
+    try:
+        return Vehicle.reverse_lookup(value).value
+    except KeyError:
+        names = ", ".join(item.name for item in Vehicle)
+        raise argparse.ArgumentTypeError(f"unknown vehicle type {value!r}, expected a number or one of: {names}") from None
+
+
+class Query:
+    """Which events to select, an empty filter matches everything"""
+    def __init__(self):
+        self.types: set[str] = set()
+        self.player_ids: set[int] = set()
+        self.player_names: set[str] = set()
+        self.teams: set[int] = set()
+        self.vehicle_types: set[int] = set()
+        self.start: Optional[int] = None
+        self.end: Optional[int] = None
+
+    def add_player(self, value: str) -> None:
+        if value.isdigit():
+            self.player_ids.add(int(value))
+        else:
+            self.player_names.add(value)
+
+    def checks(self) -> list[RecordCheck]:
+        """Cheap tests on a raw record, ordered so the most selective ones come first"""
+        checks = []
+        if self.types:
+            types = self.types
+            checks.append(lambda data: data.get("type") in types)
+        if self.vehicle_types:
+            vehicles = self.vehicle_types
+            checks.append(lambda data: _int(data.get("vehicle_type")) in vehicles)
+        if self.player_ids or self.player_names:
+            ids = self.player_ids
+            names = self.player_names
+            checks.append(lambda data: data.get("player_name") in names or _int(data.get("player_id")) in ids)
+        if self.teams:
+            teams = self.teams
+            checks.append(lambda data: _int(data.get("team", data.get("team_id"))) in teams)
+        return checks
+
+
+def iter_records(paths: Iterable[Path], start: Optional[int] = None, end: Optional[int] = None,
+                 save_index: bool = False, indexes: Optional[dict[Path, TimeIndex]] = None) -> Iterator[dict]:
+    """Yield raw records from logs or folders of logs, from start to end.
+
+    A log with a kept time index, a .tidx sidecar or one in indexes, is only read from near start
+    until the index shows the rest is past end. Other logs are read once from the start and indexed
+    on the way, the index is kept in indexes if given, and next to the log if save_index is set.
+    """
+    files = []
+    for path in paths:
+        if path.is_dir():
+            files.extend(find_logs(path))
+        else:
+            files.append(path)
+
+    for filepath in files:
+        if start is None and end is None:
+            with open_log(filepath) as fd:
+                reader = BlockReader(fd)
+                while True:
+                    data = reader.next_record()
+                    if data is None:
+                        break
+                    yield data
+            continue
+
+        index = find_index(filepath, indexes, save_index)
+        if index is None:
+            yield from _scan(filepath, start, end, indexes, save_index)
+            continue
+        if not index.offsets or (start is not None and index.max_epoch < start):
+            continue
+        if end is not None and index.min_epoch > end:
+            break
+        offset = index.offset_for(start) if start is not None else 0
+        with open_log(filepath, offset) as fd:
+            reader = BlockReader(fd)
+            while True:
+                data = reader.next_record()
+                if data is None:
+                    break
+                try:
+                    stamp = messages.parse_epoch(data["timestamp"])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if start is not None and stamp < start:
+                    continue
+                if end is not None and stamp > end:
+                    # a record written out of order may still be in range
+                    if index.all_after(reader.offset, end):
+                        break
+                    continue
+                yield data
+
+
+def _game_stamp(value: int) -> str:
+    return datetime.fromtimestamp(value, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _scan(filepath: Path, start: Optional[int], end: Optional[int],
+          indexes: Optional[dict[Path, TimeIndex]], save_index: bool) -> Iterator[dict]:
+    """Yield the records from start to end in a log with no kept index, reading it once, and indexing it
+    on the way if the index is to be kept"""
+    index = TimeIndex(filepath) if indexes is not None or save_index else None
+    # stamps in the game's own format sort as text, so most need no converting
+    low = _game_stamp(start) if start is not None else ""
+    high = _game_stamp(end) if end is not None else "~"
+    with open_log(filepath) as fd:
+        reader = BlockReader(fd)
+        after = reader.offset
+        while True:
+            data = reader.next_record()
+            if data is None:
+                break
+            if index is None:
+                stamp = data.get("timestamp")
+                if type(stamp) is str and len(stamp) == 20 and stamp[19] == "Z" and stamp[10] == "T":
+                    if low <= stamp <= high:
+                        yield data
+                    continue
+            try:
+                stamp = messages.parse_epoch(data["timestamp"])
+            except (KeyError, TypeError, ValueError):
+                after = reader.offset
+                continue
+            if index is not None:
+                index.add(stamp, after)
+                after = reader.offset
+            if (start is None or stamp >= start) and (end is None or stamp <= end):
+                yield data
+    if index is not None:
+        index.finish(after)
+        keep_index(index, indexes, save_index)
+
+
+def select(records: Iterable[dict], query: Query) -> Iterator[dict]:
+    checks = query.checks()
+    if not checks:
+        yield from records
+        return
+    for data in records:
+        for check in checks:
+            if not check(data):
+                break
+        else:
+            yield data
+
+
+def build(records: Iterable[dict], factory: Optional[MessageFactory] = None) -> Iterator[MessageBase]:
+    factory = factory or MessageFactory()
+    for data in records:
+        message = factory.parse(data)
+        if message:
+            yield message
+
+
+def run_query(paths: Iterable[Path], query: Query, save_index: bool = False) -> Iterator[MessageBase]:
+    return build(select(iter_records(paths, query.start, query.end, save_index), query))
+
+
+def message_fields(message: MessageBase) -> dict:
+    """The public fields of a message as plain data"""
+    fields = {"timestamp": message.timestamp.isoformat(), "type": message.type}
+    for cls in reversed(type(message).__mro__):
+        for name in getattr(cls, "__slots__", ()):
+            if not name.startswith("_") and name not in fields and name != "epoch":
+                fields[name] = getattr(message, name)
+    if isinstance(message, DestroyedVehicle):
+        fields["vehicle_type_name"] = message.vehicle_type_name
+    return fields
+
+
+def count_key(message: MessageBase, key: str):
+    if key == "type":
+        return message.type
+    if key == "player":
+        return getattr(message, "player_name", None)
+    if key == "team":
+        return getattr(message, "team", None)
+    if key == "vehicle":
+        if isinstance(message, DestroyedVehicle):
+            return message.vehicle_type_name
+        return None
+    raise KeyError(key)
+
+
+def aggregate(messages: Iterable[MessageBase], key: str) -> Counter:
+    counts = Counter()
+    for message in messages:
+        value = count_key(message, key)
+        if value is not None:
+            counts[value] += 1
+    return counts
+
+
+def write_json(messages: Iterable[MessageBase], fd: TextIO) -> None:
+    for message in messages:
+        print(json.dumps(message_fields(message)), file=fd)
+
+
+def write_table(messages: Iterable[MessageBase], fd: TextIO) -> None:
+    print(f"{'timestamp':25} {'type':16} {'team':>4}  detail", file=fd)
+    for message in messages:
+        fields = message_fields(message)
+        detail = " ".join(f"{k}={v}" for k, v in fields.items() if k not in ("timestamp", "type", "team"))
+        print(f"{fields['timestamp']:25} {fields['type']:16} {fields.get('team', ''):>4}  {detail}", file=fd)
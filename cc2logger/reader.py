@@ -0,0 +1,313 @@
+"""Block buffered and memory mapped jsonl record readers"""
+import json
+import mmap
+import os
+import re
+from collections.abc import Callable
+from typing import BinaryIO, Optional
+
+BLOCK_SIZE = 1024 * 1024
+# a record longer than this, or spread over more lines, is taken to be corrupt
+MAX_RECORD_SIZE = 64 * 1024
+MAX_RECORD_LINES = 16
+
+_SCAN = re.compile(r'\\.|["{}\[\]]', re.DOTALL)
+_raw_decode = json.JSONDecoder().raw_decode
+
+
+def scan_record(data: str, in_string: bool = False, depth: int = 0) -> tuple[bool, int]:
+    """Track json string and nesting state across part of a record"""
+    for match in _SCAN.finditer(data):
+        token = match.group()
+        if token == '"':
+            in_string = not in_string
+        elif in_string:
+            continue
+        elif token in "{[":
+            depth += 1
+        elif token in "}]":
+            depth -= 1
+    return in_string, depth
+
+
+def decode_record(line: str) -> dict:
+    """Decode one json record, skipping the whitespace checks json.loads does for the common case"""
+    if line.startswith("{"):
+        data, end = _raw_decode(line)
+        if end == len(line) or line[end:].isspace():
+            return data
+        raise ValueError(f"extra data at column {end}")
+    return json.loads(line)
+
+
+def record_start(line: str) -> bool:
+    return line.startswith('{"')
+
+
+def encoded_len(line: str) -> int:
+    if line.isascii():
+        return len(line)
+    return len(line.encode("utf-8", "surrogateescape"))
+
+
+class BlockReader:
+    """Split a binary jsonl stream into records, reading it in large blocks.
+
+    Most records are a single line and are decoded straight away. A line that fails to decode and
+    ends inside a string or object (eg, chat with a newline in it) is joined with the following lines
+    until the record is complete, then decoded once.
+
+    A record that cannot be decoded, or grows past MAX_RECORD_SIZE or MAX_RECORD_LINES, is counted
+    in bad_records and passed to on_bad_record with its byte offset. Reading resumes at the next line
+    that starts a record.
+    """
+    def __init__(self, fd: BinaryIO, block_size: int = BLOCK_SIZE):
+        self.fd = fd
+        self.block_size = block_size
+        self.tailing = False
+        self.offset = fd.tell()
+        self.bad_records = 0
+        self.on_bad_record: Optional[Callable[[int], None]] = None
+        self._consumed = self.offset
+        self._lines: list[str] = []
+        self._index = 0
+        self._tail = b""
+        self._ascii = True
+        self._partial: list[str] = []
+        self._partial_start = 0
+        self._partial_size = 0
+        self._in_string = False
+        self._depth = 0
+        self._skipping = False
+
+    def _bad(self, offset: int) -> None:
+        self.bad_records += 1
+        self._skipping = True
+        if self.on_bad_record:
+            self.on_bad_record(offset)
+
+    def _fill(self) -> bool:
+        block = self.fd.read(self.block_size)
+        if block:
+            data = self._tail + block
+            cut = data.rfind(b"\n") + 1
+            self._tail = data[cut:]
+            text = data[:cut].decode("utf-8", "surrogateescape")
+            self._ascii = text.isascii()
+            lines = text.split("\n")
+            lines.pop()
+        elif self._tail and not self.tailing:
+            # last record has no trailing newline
+            lines = [self._tail.decode("utf-8", "surrogateescape")]
+            self._ascii = lines[0].isascii()
+            self._tail = b""
+            self._consumed -= 1
+        else:
+            if self._partial and not self.tailing:
+                # file ended part way through a record
+                self._partial = []
+                self._bad(self._partial_start)
+            return False
+        self._lines = lines
+        self._index = 0
+        return True
+
+    def _start_partial(self, line: str, start: int) -> bool:
+        """Begin joining lines if line is the start of a record split over several lines"""
+        self._in_string, self._depth = scan_record(line)
+        if self._in_string or self._depth > 0:
+            self._partial = [line]
+            self._partial_start = start
+            self._partial_size = len(line)
+            return True
+        return False
+
+    def next_record(self) -> Optional[dict]:
+        while True:
+            if self._index >= len(self._lines):
+                if not self._fill():
+                    return None
+                continue
+            line = self._lines[self._index]
+            self._index += 1
+            start = self._consumed
+            self._consumed += (len(line) if self._ascii else encoded_len(line)) + 1
+
+            if self._partial:
+                if record_start(line):
+                    # the record being joined may have been cut short by this one
+                    try:
+                        data = decode_record(line)
+                        self._partial = []
+                        self._bad(self._partial_start)
+                        self._skipping = False
+                        self.offset = self._consumed
+                        return data
+                    except ValueError:
+                        pass
+                    cut_short = self._partial_start
+                    if self._start_partial(line, start):
+                        self._bad(cut_short)
+                        self._skipping = False
+                        continue
+                self._partial.append(line)
+                self._partial_size += len(line)
+                if len(self._partial) > MAX_RECORD_LINES or self._partial_size > MAX_RECORD_SIZE:
+                    self._partial = []
+                    self.offset = self._consumed
+                    self._bad(self._partial_start)
+                    continue
+                self._in_string, self._depth = scan_record(line, self._in_string, self._depth)
+                if self._in_string or self._depth > 0:
+                    continue
+                line = " ".join(self._partial)
+                start = self._partial_start
+                self._partial = []
+            elif not line or line.isspace():
+                self.offset = self._consumed
+                continue
+            else:
+                if self._skipping:
+                    if not record_start(line):
+                        self.offset = self._consumed
+                        continue
+                    self._skipping = False
+                try:
+                    if line[0] == "{":
+                        # inlined decode_record() for the common case
+                        data, end = _raw_decode(line)
+                        if end != len(line) and not line[end:].isspace():
+                            raise ValueError(f"extra data at column {end}")
+                    else:
+                        data = json.loads(line)
+                    self.offset = self._consumed
+                    return data
+                except ValueError:
+                    if len(line) <= MAX_RECORD_SIZE and self._start_partial(line, start):
+                        continue
+                    self.offset = self._consumed
+                    self._bad(start)
+                    continue
+
+            self.offset = self._consumed
+            try:
+                return decode_record(line)
+            except ValueError:
+                self._bad(start)
+
+
+class MmapReader:
+    """Split a finished, uncompressed jsonl file into records straight from a memory map.
+
+    Lines are found with mmap.find() and each one is sliced from the map and decoded for the json
+    decoder, nothing else is buffered. Records split over several lines and corrupt records are
+    handled the same way BlockReader does it. The file must not change while it is mapped.
+    """
+    def __init__(self, fd: BinaryIO):
+        self.fd = fd
+        self.tailing = False
+        self.offset = fd.tell()
+        self.bad_records = 0
+        self.on_bad_record: Optional[Callable[[int], None]] = None
+        self.size = os.fstat(fd.fileno()).st_size
+        self._skipping = False
+        self._map: Optional[mmap.mmap] = None
+        if self.size:
+            self._map = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def _bad(self, offset: int) -> None:
+        self.bad_records += 1
+        self._skipping = True
+        if self.on_bad_record:
+            self.on_bad_record(offset)
+
+    def _line(self, pos: int) -> tuple[str, int]:
+        """The line starting at pos and the offset just after it"""
+        end = self._map.find(b"\n", pos)
+        if end < 0:
+            end = self.size
+        return self._map[pos:end].decode("utf-8", "surrogateescape"), min(end + 1, self.size)
+
+    def _join(self, line: str, start: int, after: int) -> Optional[dict]:
+        """Decode a record split over several lines starting with line, self.offset is left after it"""
+        in_string, depth = scan_record(line)
+        parts = [line]
+        joined = len(line)
+        while (in_string or depth > 0) and after < self.size:
+            pos = after
+            line, after = self._line(pos)
+            if record_start(line):
+                # the record being joined may have been cut short by this one
+                try:
+                    data = decode_record(line)
+                    self._bad(start)
+                    self._skipping = False
+                    self.offset = after
+                    return data
+                except ValueError:
+                    fresh_string, fresh_depth = scan_record(line)
+                    if fresh_string or fresh_depth > 0:
+                        self._bad(start)
+                        start, parts, joined = pos, [], 0
+                        in_string, depth = False, 0
+            parts.append(line)
+            joined += len(line)
+            if len(parts) > MAX_RECORD_LINES or joined > MAX_RECORD_SIZE:
+                self.offset = after
+                self._bad(start)
+                return None
+            in_string, depth = scan_record(line, in_string, depth)
+        self.offset = after
+        if in_string or depth > 0:
+            # file ended part way through a record
+            self._bad(start)
+            return None
+        try:
+            data = decode_record(" ".join(parts))
+            self._skipping = False
+            return data
+        except ValueError:
+            self._bad(start)
+            return None
+
+    def next_record(self) -> Optional[dict]:
+        if self._map is None:
+            return None
+        mm = self._map
+        size = self.size
+        while self.offset < size:
+            pos = self.offset
+            # inlined _line() for the common case
+            end = mm.find(b"\n", pos)
+            if end < 0:
+                end = size
+            line = mm[pos:end].decode("utf-8", "surrogateescape")
+            after = end + 1 if end < size else size
+            if not line or line.isspace() or (self._skipping and not record_start(line)):
+                self.offset = after
+                continue
+            self._skipping = False
+            try:
+                if line[0] == "{":
+                    data, end = _raw_decode(line)
+                    if end != len(line) and not line[end:].isspace():
+                        raise ValueError(f"extra data at column {end}")
+                else:
+                    data = json.loads(line)
+                self.offset = after
+                return data
+            except ValueError:
+                pass
+            if len(line) > MAX_RECORD_SIZE:
+                self.offset = after
+                self._bad(pos)
+                continue
+            data = self._join(line, pos, after)
+            if data is not None:
+                return data
+        return None
@@ -21,10 +21,10 @@ class Vehicle(Enum):
 
     @classmethod
     def lookup(cls, value):
-        for item in cls:
-            if item.value == value:
-                return item
-        raise KeyError(value)
+        try:
+            return cls(value)
+        except ValueError:
+            raise KeyError(value) from None
 
     @classmethod
     def reverse_lookup(cls, name):
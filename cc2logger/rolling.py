@@ -0,0 +1,55 @@
+"""Fixed memory event counts over rolling time windows"""
+import threading
+import time
+from collections import Counter, deque
+from collections.abc import Hashable
+from typing import Optional
+
+
+class RollingCounter:
+    """Count events by key in time buckets, keeping only the buckets inside the longest window.
+
+    Memory depends on the window, bucket size and number of distinct keys, not on how many
+    events have been added. Safe to add from one thread while another reads.
+    """
+    def __init__(self, window: int = 3600, bucket: int = 10):
+        self.window = window
+        self.bucket = bucket
+        self.total = 0
+        self._buckets: deque[tuple[int, Counter]] = deque(maxlen=-(-window // bucket))
+        self._lock = threading.Lock()
+
+    def add(self, key: Hashable = None, epoch: Optional[float] = None, count: int = 1) -> None:
+        index = int((time.time() if epoch is None else epoch) // self.bucket)
+        with self._lock:
+            self.total += count
+            if self._buckets and self._buckets[-1][0] == index:
+                self._buckets[-1][1][key] += count
+            elif not self._buckets or self._buckets[-1][0] < index:
+                self._buckets.append((index, Counter({key: count})))
+            else:
+                # a late event, find its bucket if it is still kept
+                for bucket_index, counts in self._buckets:
+                    if bucket_index == index:
+                        counts[key] += count
+                        break
+
+    def counts(self, seconds: int, now: Optional[float] = None) -> Counter:
+        """Events by key in the last seconds, to bucket resolution"""
+        newest = int((time.time() if now is None else now) // self.bucket)
+        oldest = newest - -(-seconds // self.bucket)
+        found = Counter()
+        with self._lock:
+            for index, counts in reversed(self._buckets):
+                if index <= oldest:
+                    break
+                if index <= newest:
+                    found.update(counts)
+        return found
+
+    def count(self, seconds: int, now: Optional[float] = None) -> int:
+        return sum(self.counts(seconds, now).values())
+
+    def rate(self, seconds: int, per: int = 60, now: Optional[float] = None) -> float:
+        """Average events per `per` seconds over the last seconds"""
+        return self.count(seconds, now) * per / seconds
@@ -0,0 +1,175 @@
+"""Player sessions as time intervals, for presence and concurrency queries.
+
+Closed sessions are kept as parallel arrays sorted by start and by end, so the number of players
+online at any time is two binary searches, and concurrency over a long history is one sweep.
+
+Checkpoints keep the open sessions and the closed ones from the last STATE_KEEP seconds, so a
+checkpoint stays the same size however long a server has been logging. A timeline restored from one
+records where the dropped sessions end as its horizon, and queries from before it raise HorizonError.
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Optional
+
+# closed sessions ending this long before the latest one are not saved in checkpoints
+STATE_KEEP = 7 * 24 * 3600
+
+
+class HorizonError(ValueError):
+    pass
+
+
+class Session:
+    __slots__ = ("player_id", "team", "start", "end")
+
+    def __init__(self, player_id: int, team: int, start: int, end: Optional[int] = None):
+        self.player_id = player_id
+        self.team = team
+        self.start = start
+        self.end = end
+
+    @property
+    def duration(self) -> int:
+        return self.end - self.start
+
+    def __repr__(self):
+        return f"Session({self.player_id}, team {self.team}, {self.start}-{self.end})"
+
+
+class SessionTimeline:
+    """Sessions from player joined/left events, times are epoch seconds and a session covers [start, end)"""
+    def __init__(self, state_keep: Optional[int] = STATE_KEEP):
+        # seconds of closed sessions get_state() saves, None saves all of them
+        self.state_keep = state_keep
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget every session"""
+        self.sessions: list[Session] = []
+        self.open: dict[int, Session] = {}
+        self._by_start: list[Session] = []
+        self._starts = array("q")
+        self._ends = array("q")
+        self._longest = 0
+        self._dirty = False
+        # sessions ending at or before this were dropped from a checkpoint, None if none were
+        self.horizon: Optional[int] = None
+
+    def _check(self, epoch: int) -> None:
+        if self.horizon is not None and epoch < self.horizon:
+            raise HorizonError(f"sessions before {self.horizon} were not kept, cannot answer for {epoch}")
+
+    def join(self, player_id: int, team: int, epoch: int) -> None:
+        if player_id in self.open:
+            # joined again without a leave, the old session ends here
+            self.leave(player_id, epoch)
+        self.open[player_id] = Session(player_id, team, epoch)
+
+    def leave(self, player_id: int, epoch: int) -> None:
+        session = self.open.pop(player_id, None)
+        if session is None:
+            return
+        session.end = max(epoch, session.start)
+        self.sessions.append(session)
+        self._dirty = True
+
+    def add_sessions(self, rows: list) -> None:
+        """Add closed sessions given as [player id, team, start, end] rows"""
+        for player_id, team, start, end in rows:
+            self.sessions.append(Session(player_id, team, start, end))
+        self._dirty = True
+
+    def finish(self, epoch: int) -> None:
+        """End every open session at epoch, the same way CC2GameParser.finish() closes play time"""
+        for player_id in list(self.open):
+            self.leave(player_id, epoch)
+
+    def _build(self) -> None:
+        if not self._dirty:
+            return
+        self._by_start = sorted(self.sessions, key=lambda x: x.start)
+        self._starts = array("q", (x.start for x in self._by_start))
+        self._ends = array("q", sorted(x.end for x in self.sessions))
+        self._longest = max((x.duration for x in self.sessions), default=0)
+        self._dirty = False
+
+    def online_count(self, epoch: int) -> int:
+        """Number of players online at epoch"""
+        self._check(epoch)
+        self._build()
+        count = bisect_right(self._starts, epoch) - bisect_right(self._ends, epoch)
+        return count + sum(1 for x in self.open.values() if x.start <= epoch)
+
+    def online_at(self, epoch: int) -> list[Session]:
+        """Sessions covering epoch"""
+        self._check(epoch)
+        self._build()
+        # only sessions starting within the longest session length of epoch can cover it
+        first = bisect_left(self._starts, epoch - self._longest)
+        last = bisect_right(self._starts, epoch)
+        found = [x for x in self._by_start[first:last] if x.end > epoch]
+        found.extend(x for x in self.open.values() if x.start <= epoch)
+        return found
+
+    def peak_concurrency(self, start: int, end: int, step: int) -> list[int]:
+        """Highest number of players online in each step long bucket from start to end"""
+        self._check(start)
+        self._build()
+        starts = self._starts
+        ends = self._ends
+        if self.open:
+            # open sessions run past the end of the range
+            starts = array("q", sorted([*starts, *(x.start for x in self.open.values())]))
+            ends = array("q", sorted([*ends, *([end + step] * len(self.open))]))
+        si = bisect_right(starts, start)
+        ei = bisect_right(ends, start)
+        online = si - ei
+        peaks = []
+        bucket_end = start + step
+        while len(peaks) * step < end - start:
+            peak = online
+            # sweep events in time order, ends before starts at the same second
+            while True:
+                next_start = starts[si] if si < len(starts) else None
+                next_end = ends[ei] if ei < len(ends) else None
+                if next_end is not None and next_end < bucket_end and (next_start is None or next_end <= next_start):
+                    online -= 1
+                    ei += 1
+                elif next_start is not None and next_start < bucket_end:
+                    online += 1
+                    si += 1
+                    peak = max(peak, online)
+                else:
+                    break
+            peaks.append(peak)
+            bucket_end += step
+        return peaks
+
+    def get_state(self) -> dict:
+        """Open sessions and the closed ones ending within state_keep seconds of the latest time seen,
+        with the horizon the dropped ones leave"""
+        sessions = self.sessions
+        horizon = self.horizon
+        if self.state_keep is not None and sessions:
+            latest = max(max(x.end for x in sessions), max((x.start for x in self.open.values()), default=0))
+            kept = [x for x in sessions if x.end > latest - self.state_keep]
+            if len(kept) < len(sessions):
+                horizon = max(latest - self.state_keep, horizon or latest - self.state_keep)
+                sessions = kept
+        return {
+            "horizon": horizon,
+            "sessions": [[x.player_id, x.team, x.start, x.end] for x in [*sessions, *self.open.values()]],
+        }
+
+    def set_state(self, state: dict | list) -> None:
+        self.reset()
+        if isinstance(state, dict):
+            self.horizon = state["horizon"]
+            state = state["sessions"]
+        for player_id, team, start, end in state:
+            session = Session(player_id, team, start, end)
+            if end is None:
+                self.open[player_id] = session
+            else:
+                self.sessions.append(session)
+        self._dirty = True
@@ -0,0 +1,51 @@
+"""Compact versioned binary snapshots of parser state.
+
+A snapshot is a fixed header followed by a marshal payload. Only plain data types (dict, list, str,
+int, float, None) are stored, so loading never creates arbitrary objects like pickle can.
+"""
+import marshal
+import struct
+import zlib
+from pathlib import Path
+
+MAGIC = b"CC2S"
+SNAPSHOT_VERSION = 1
+MARSHAL_VERSION = 4
+
+_HEADER = struct.Struct("<4sHHII")
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def dumps(data: dict) -> bytes:
+    payload = marshal.dumps(data, MARSHAL_VERSION)
+    return _HEADER.pack(MAGIC, SNAPSHOT_VERSION, MARSHAL_VERSION, len(payload), zlib.crc32(payload)) + payload
+
+
+def loads(buf: bytes) -> dict:
+    if len(buf) < _HEADER.size:
+        raise SnapshotError("snapshot too short")
+    magic, version, marshal_version, length, crc = _HEADER.unpack_from(buf)
+    if magic != MAGIC:
+        raise SnapshotError("not a snapshot")
+    if version != SNAPSHOT_VERSION or marshal_version != MARSHAL_VERSION:
+        raise SnapshotError(f"unsupported snapshot version {version}.{marshal_version}")
+    payload = buf[_HEADER.size:]
+    if len(payload) != length or zlib.crc32(payload) != crc:
+        raise SnapshotError("snapshot is corrupt")
+    data = marshal.loads(payload)
+    if not isinstance(data, dict):
+        raise SnapshotError("snapshot is corrupt")
+    return data
+
+
+def write_snapshot(path: Path, data: dict) -> None:
+    tmp = path.with_suffix(".tmp")
+    tmp.write_bytes(dumps(data))
+    tmp.replace(path)
+
+
+def read_snapshot(path: Path) -> dict:
+    return loads(path.read_bytes())
@@ -0,0 +1,92 @@
+"""Generate synthetic CC2 game logs for tests and benchmarks"""
+import json
+import random
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import TextIO
+
+VEHICLE_TYPES = [0, 2, 4, 6, 8, 10, 12, 14, 16, 57, 58, 59, 64, 77, 79, 88, 97]
+
+# share of each record type in real server logs
+RECORD_MIX = {
+    "destroy_vehicle": 0.68,
+    "chat": 0.16,
+    "player_joined": 0.06,
+    "player_left": 0.06,
+    "island_captured": 0.04,
+}
+
+CHAT = ["hi", "gg", "anyone want to fly?", "we are here", "dont turn on weapons until we get there",
+        "need a barge at the carrier", "no last time i crashed", "o7", "who has the needlefish", "lol"]
+
+
+def generate_log(fd: TextIO, records: int, seed: int = 0,
+                 started: datetime = datetime(2025, 1, 1, tzinfo=timezone.utc),
+                 players: int = 16, newlines: float = 0.02) -> datetime:
+    """Write records to fd with the same mix of record types as real logs, returns the time of the last one.
+
+    Like the game, a chat message containing a newline is written with the newline unescaped, so
+    the record spans two lines. newlines is the share of chat messages that have one.
+    """
+    rnd = random.Random(seed)
+    now = started
+    online: dict[int, int] = {}
+    kinds = list(RECORD_MIX)
+    weights = list(RECORD_MIX.values())
+    for i in range(records):
+        now += timedelta(seconds=rnd.randint(0, 5))
+        stamp = now.strftime("%Y-%m-%dT%H:%M:%SZ")
+        player = rnd.randrange(players)
+        player_id = str(76561198000000000 + player)
+        player_name = f"player{player}"
+        kind = rnd.choices(kinds, weights)[0]
+        if kind == "player_left" and not online:
+            kind = "player_joined"
+        if kind == "player_joined" and player in online:
+            kind = "player_left"
+        if kind == "chat" and not online:
+            kind = "player_joined"
+        if kind in ("player_left", "chat") and player not in online:
+            player = rnd.choice(list(online))
+            player_id = str(76561198000000000 + player)
+            player_name = f"player{player}"
+
+        if kind == "player_joined":
+            online[player] = rnd.randint(1, 4)
+            record = {"timestamp": stamp, "type": "player_joined", "player_name": player_name,
+                      "player_id": player_id, "team_id": str(online[player])}
+        elif kind == "player_left":
+            record = {"timestamp": stamp, "type": "player_left", "player_name": player_name,
+                      "player_id": player_id, "team_id": str(online.pop(player))}
+        elif kind == "chat":
+            message = rnd.choice(CHAT)
+            if rnd.random() < newlines:
+                message = message + "\n" + rnd.choice(CHAT)
+            record = {"timestamp": stamp, "type": "chat", "player_name": player_name,
+                      "player_id": player_id, "message": message}
+        elif kind == "island_captured":
+            record = {"timestamp": stamp, "type": "island_captured", "island_id": str(rnd.randint(0, 30)),
+                      "team": str(rnd.randint(1, 4))}
+        else:
+            record = {"timestamp": stamp, "type": "destroy_vehicle", "vehicle_id": str(i % 500),
+                      "vehicle_type": str(rnd.choice(VEHICLE_TYPES)), "team": str(rnd.randint(0, 4))}
+        line = json.dumps(record)
+        if kind == "chat" and "\n" in record["message"]:
+            line = line.replace("\\n", "\n")
+        print(line, file=fd)
+    return now
+
+
+def generate_folder(folder: Path, records: int, files: int = 4, seed: int = 0,
+                    started: datetime = datetime(2025, 1, 1, tzinfo=timezone.utc),
+                    players: int = 16, newlines: float = 0.02) -> list[Path]:
+    """Write records split over several game logs named like the game does, one game after another"""
+    logs = []
+    for n in range(files):
+        count = records // files + (1 if n < records % files else 0)
+        logfile = folder / f"game_log_{started.strftime('%Y-%m-%d_%H-%M-%S')}.jsonl"
+        with logfile.open("w", encoding="utf-8") as fd:
+            ended = generate_log(fd, count, seed=seed + n, started=started, players=players, newlines=newlines)
+        logs.append(logfile)
+        started = ended + timedelta(hours=1)
+    return logs
@@ -0,0 +1,238 @@
+"""Sparse timestamp to byte offset index for game logs.
+
+Each log can have a sidecar .tidx file holding one entry every N records. An entry is the byte offset
+where a record starts, the latest timestamp of all the records before it and the earliest timestamp
+of the records from it to the next entry. A reader looking for time T can skip straight to the last
+entry whose latest timestamp is before T, and a reader past T can tell when no later record is
+before T, however out of order the timestamps are. The index is updated incrementally, only records
+added since the last update are read, and a fingerprint of the log catches a log that was replaced.
+
+Building an index means reading the whole log, which only pays off if the index is kept. Readers
+use find_index() to get a kept one, from a sidecar or from a dict of indexes held in memory, and
+read logs without one once from the start, indexing them on the way with add() and keeping the
+result with keep_index(). Sidecars are only written when asked for, so reading logs never writes
+into their folder by default.
+"""
+import struct
+from bisect import bisect_left, bisect_right
+from pathlib import Path
+from typing import Optional
+from .archive import open_log, log_name, log_size, file_fingerprint
+from . import messages
+from .reader import BlockReader
+
+INDEX_EVERY = 256
+TIDX_VERSION = 2
+NO_TIME = -(2 ** 62)
+
+_HEADER = struct.Struct("<4sHHqqqqI20s")
+_ENTRY = struct.Struct("<qqq")
+_MAGIC = b"CC2T"
+
+
+def tidx_path(filepath: Path) -> Path:
+    return filepath.with_name(log_name(filepath) + ".tidx")
+
+
+class TimeIndex:
+    def __init__(self, filepath: Path, every: int = INDEX_EVERY):
+        self.filepath = filepath
+        self.every = every
+        self.reset()
+
+    def load(self) -> bool:
+        path = tidx_path(self.filepath)
+        try:
+            buf = path.read_bytes()
+            (magic, version, every, self.indexed_offset, self.first_epoch, self.last_epoch, self.max_epoch,
+             self.since_entry, fingerprint) = _HEADER.unpack_from(buf)
+        except (OSError, struct.error):
+            return False
+        if magic != _MAGIC or version != TIDX_VERSION or every != self.every:
+            return False
+        try:
+            if fingerprint != bytes.fromhex(file_fingerprint(self.filepath, self.indexed_offset)):
+                # a different log with the same name
+                return False
+        except OSError:
+            return False
+        count = (len(buf) - _HEADER.size) // _ENTRY.size
+        self.times = []
+        self.offsets = []
+        self.mins = []
+        for epoch, offset, least in _ENTRY.iter_unpack(buf[_HEADER.size:_HEADER.size + count * _ENTRY.size]):
+            self.times.append(epoch)
+            self.offsets.append(offset)
+            self.mins.append(least)
+        self._suffix_min = None
+        self.fingerprint = fingerprint.hex()
+        self._saved_offset = self.indexed_offset
+        self._saved_entries = count
+        return True
+
+    def _header(self) -> bytes:
+        return _HEADER.pack(_MAGIC, TIDX_VERSION, self.every, self.indexed_offset, self.first_epoch,
+                            self.last_epoch, self.max_epoch, self.since_entry, bytes.fromhex(self.fingerprint))
+
+    def reset(self) -> None:
+        self.indexed_offset = 0
+        self.first_epoch = NO_TIME
+        self.last_epoch = NO_TIME
+        self.max_epoch = NO_TIME
+        self.since_entry = 0
+        self.times: list[int] = []
+        self.offsets: list[int] = []
+        # earliest timestamp from each entry to the next
+        self.mins: list[int] = []
+        self._suffix_min = None
+        # of the log up to indexed_offset
+        self.fingerprint = ""
+        # what the sidecar holds, -1 if nothing was written
+        self._saved_offset = -1
+        self._saved_entries = 0
+
+    def current(self, size: int) -> bool:
+        """True if the log of this size is still the one indexed, maybe with records added"""
+        return (bool(self.fingerprint) and size >= self.indexed_offset
+                and file_fingerprint(self.filepath, self.indexed_offset) == self.fingerprint)
+
+    def add(self, epoch: int, start: int) -> None:
+        """Index the record starting at byte offset start, records must be added in file order"""
+        if not self.offsets or self.since_entry >= self.every:
+            self.times.append(self.max_epoch)
+            self.offsets.append(start)
+            self.mins.append(epoch)
+            self.since_entry = 0
+        self.since_entry += 1
+        if epoch < self.mins[-1]:
+            self.mins[-1] = epoch
+        if self.first_epoch == NO_TIME:
+            self.first_epoch = epoch
+        self.last_epoch = epoch
+        self.max_epoch = max(self.max_epoch, epoch)
+
+    def finish(self, offset: int) -> None:
+        """Every record before offset has been added"""
+        self.indexed_offset = offset
+        self._suffix_min = None
+        self.fingerprint = file_fingerprint(self.filepath, offset)
+
+    def update(self, save: bool = False) -> None:
+        """Index any records added to the log since the last update, and write the sidecar if save is set"""
+        size = log_size(self.filepath)
+        if not self.current(size) and (not self.load() or size < self.indexed_offset):
+            self.reset()
+        if size == self.indexed_offset:
+            if save and self._saved_offset != self.indexed_offset:
+                self.finish(self.indexed_offset)
+                self.save()
+            return
+
+        with open_log(self.filepath, self.indexed_offset) as fd:
+            reader = BlockReader(fd)
+            # leave a half written record for next time
+            reader.tailing = True
+            start = reader.offset
+            while True:
+                data = reader.next_record()
+                if data is None:
+                    break
+                try:
+                    epoch = messages.parse_epoch(data["timestamp"])
+                except (KeyError, TypeError, ValueError):
+                    start = reader.offset
+                    continue
+                self.add(epoch, start)
+                start = reader.offset
+            self.finish(reader.offset)
+        if save:
+            self.save()
+
+    def save(self) -> bool:
+        """Write the index to the sidecar, only appending the new entries to one written before. The
+        index still works if this fails, eg on a read-only archive, it is just not kept."""
+        path = tidx_path(self.filepath)
+        entries = list(zip(self.times, self.offsets, self.mins))
+        try:
+            if self._saved_offset >= 0 and path.exists():
+                # the last entry's earliest time can change, so it is written again
+                first = max(0, self._saved_entries - 1)
+                with path.open("r+b") as fd:
+                    fd.write(self._header())
+                    fd.seek(_HEADER.size + first * _ENTRY.size)
+                    fd.write(b"".join(_ENTRY.pack(*x) for x in entries[first:]))
+                    fd.truncate()
+            else:
+                tmp = path.with_name(path.name + ".tmp")
+                tmp.write_bytes(self._header() + b"".join(_ENTRY.pack(*x) for x in entries))
+                tmp.replace(path)
+        except OSError:
+            return False
+        self._saved_offset = self.indexed_offset
+        self._saved_entries = len(entries)
+        return True
+
+    @property
+    def min_epoch(self) -> int:
+        """Earliest timestamp in the log"""
+        return self.earliest_from(0)
+
+    def earliest_from(self, offset: int) -> int:
+        """Earliest timestamp of the records from the entry holding offset to the end of the log"""
+        if self._suffix_min is None:
+            least = []
+            current = -NO_TIME
+            for value in reversed(self.mins):
+                current = min(current, value)
+                least.append(current)
+            least.reverse()
+            self._suffix_min = least
+        if not self._suffix_min:
+            return -NO_TIME
+        pos = max(0, bisect_right(self.offsets, offset) - 1)
+        return self._suffix_min[pos]
+
+    def all_after(self, offset: int, epoch: int) -> bool:
+        """True if the index shows every record from offset to the end of the log is after epoch"""
+        return offset < self.indexed_offset and self.earliest_from(offset) > epoch
+
+    def offset_for(self, epoch: int) -> int:
+        """Byte offset to start reading at to find every record at or after epoch"""
+        pos = bisect_left(self.times, epoch) - 1
+        if pos < 0:
+            return 0
+        return self.offsets[pos]
+
+
+def load_index(filepath: Path, every: int = INDEX_EVERY, save: bool = False) -> TimeIndex:
+    """The index for a log, from its sidecar if there is one or else by reading the whole log, only
+    written back if save is set"""
+    index = TimeIndex(filepath, every)
+    index.update(save)
+    return index
+
+
+def find_index(filepath: Path, cache: Optional[dict[Path, TimeIndex]] = None, save: bool = False,
+               every: int = INDEX_EVERY) -> Optional[TimeIndex]:
+    """The kept index for a log, from cache or its sidecar, brought up to date by reading only the
+    records added since. None if no index is kept for the log."""
+    size = log_size(filepath)
+    index = cache.get(filepath) if cache is not None else None
+    if index is None or not index.current(size):
+        index = TimeIndex(filepath, every)
+        if not index.load() or size < index.indexed_offset:
+            if cache is not None:
+                cache.pop(filepath, None)
+            return None
+    index.update(save)
+    if cache is not None:
+        cache[filepath] = index
+    return index
+
+
+def keep_index(index: TimeIndex, cache: Optional[dict[Path, TimeIndex]] = None, save: bool = False) -> None:
+    """Keep an index built while reading a log, in cache and as a sidecar if save is set"""
+    if cache is not None:
+        cache[index.filepath] = index
+    if save:
+        index.save()
@@ -0,0 +1,138 @@
+"""Optional per-stage timing of the log parsing pipeline.
+
+Enabling the profiler wraps the functions each stage runs in, disabling it puts the originals
+back, so nothing is measured or checked while it is off.
+
+Stages:
+    io         reading blocks from the log and splitting them into lines, or for the mmap engine
+               finding each record in the map
+    json       decoding records
+    timestamp  converting record timestamps
+    parse      building message objects, not counting timestamps
+    aggregate  CC2GameParser.add_message, adding a built message to the stats
+"""
+import threading
+import time
+from collections import Counter
+from functools import wraps
+from typing import Callable, Optional
+from . import messages, reader
+from .parser import CC2GameParser
+
+STAGES = ["io", "json", "timestamp", "parse", "aggregate"]
+
+
+class StageProfiler:
+    """Times are kept per thread, so parsing on several threads at once does not lose any updates,
+    and report() adds them up"""
+    def __init__(self):
+        self.enabled = False
+        self._originals: list[tuple[object, str, Callable]] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._counters_lock = threading.Lock()
+        # times, calls and record types of every thread that ran a stage
+        self._threads: list[tuple[dict[str, int], dict[str, int], Counter]] = []
+
+    def reset(self) -> None:
+        with self._counters_lock:
+            self._local = threading.local()
+            self._threads = []
+
+    def _counters(self) -> tuple[dict[str, int], dict[str, int], Counter]:
+        local = self._local
+        counters = getattr(local, "counters", None)
+        if counters is None:
+            counters = (dict.fromkeys(STAGES, 0), dict.fromkeys(STAGES, 0), Counter())
+            local.counters = counters
+            with self._counters_lock:
+                self._threads.append(counters)
+        return counters
+
+    def _timed(self, stage: str, func: Callable, exclude: Optional[str] = None) -> Callable:
+        """Wrap func to count its time in stage, less any time the exclude stage took inside it"""
+        counters = self._counters
+        clock = time.perf_counter_ns
+
+        @wraps(func)
+        def timed(*args, **kwargs):
+            times, calls, _ = counters()
+            nested = times[exclude] if exclude else 0
+            started = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = clock() - started
+                if exclude:
+                    elapsed -= times[exclude] - nested
+                times[stage] += elapsed
+                calls[stage] += 1
+        return timed
+
+    def _parse(self, func: Callable) -> Callable:
+        timed = self._timed("parse", func, exclude="timestamp")
+        counters = self._counters
+
+        @wraps(func)
+        def parse(factory, data):
+            counters()[2][data.get("type", "unknown")] += 1
+            return timed(factory, data)
+        return parse
+
+    def _patch(self, owner: object, name: str, wrapper: Callable) -> None:
+        original = owner.__dict__[name] if isinstance(owner, type) else getattr(owner, name)
+        self._originals.append((owner, name, original))
+        setattr(owner, name, wrapper)
+
+    def enable(self) -> None:
+        with self._lock:
+            if self.enabled:
+                return
+            self.reset()
+            self._patch(reader.BlockReader, "_fill", self._timed("io", reader.BlockReader._fill))
+            # the mmap engine splits and decodes each record in one call
+            self._patch(reader.MmapReader, "next_record",
+                        self._timed("io", reader.MmapReader.next_record, exclude="json"))
+            self._patch(reader, "_raw_decode", self._timed("json", reader._raw_decode))
+            self._patch(messages, "parse_epoch", self._timed("timestamp", messages.parse_epoch))
+            self._patch(messages.MessageFactory, "parse", self._parse(messages.MessageFactory.parse))
+            self._patch(CC2GameParser, "add_message", self._timed("aggregate", CC2GameParser.add_message))
+            self.enabled = True
+
+    def disable(self) -> None:
+        with self._lock:
+            for owner, name, original in reversed(self._originals):
+                setattr(owner, name, original)
+            self._originals.clear()
+            self.enabled = False
+
+    def report(self) -> dict:
+        """Seconds spent and calls made in each stage, with nested stages taken out, and records seen by type"""
+        times = dict.fromkeys(STAGES, 0)
+        calls = dict.fromkeys(STAGES, 0)
+        types = Counter()
+        with self._counters_lock:
+            threads = list(self._threads)
+        for thread_times, thread_calls, thread_types in threads:
+            for stage in STAGES:
+                times[stage] += thread_times[stage]
+                calls[stage] += thread_calls[stage]
+            types.update(dict(thread_types))
+        return {
+            "stages": {x: {"seconds": max(0.0, times[x] / 1e9), "calls": calls[x]} for x in STAGES},
+            "types": dict(types),
+        }
+
+    def format_report(self) -> str:
+        data = self.report()
+        total = sum(x["seconds"] for x in data["stages"].values()) or 1
+        lines = [f" {'stage':12} {'seconds':>10} {'calls':>10} {'share':>6}"]
+        for name, stage in data["stages"].items():
+            lines.append(f" {name:12} {stage['seconds']:10.3f} {stage['calls']:10} {stage['seconds'] * 100 / total:5.1f}%")
+        lines.append("Records by type  :")
+        for name, count in sorted(data["types"].items(), key=lambda x: -x[1]):
+            lines.append(f" {name:16}: {count:-8}")
+        return "\n".join(lines)
+
+
+profiler = StageProfiler()
@@ -1,28 +1,122 @@
 """CC2 basic game log parser"""
+import json
+import sys
 from argparse import ArgumentParser
+from datetime import datetime, timezone
 from pathlib import Path
 from .parser import CC2GameParser, generate_lua_stats_page
+from .parallel import parse_partials, merge_partial
+from .archive import find_logs, archive_folder, COMPRESSORS
+from .columns import epoch
+from .database import EventDatabase
+from .timing import profiler
+from .pipeline import iter_events
+from .query import Query, COUNT_KEYS, run_query, aggregate, vehicle_type, write_json, write_table
 
 
 parser = ArgumentParser(description=__doc__, prog="cc2logger")
 parser.add_argument("PATH", type=Path, help="CC2 game jsonl file or folder full of jsonl logs to load")
 parser.add_argument("--stats", action="store_true", help="Generate player/server stats for lua")
+parser.add_argument("--jobs", type=int, default=1, help="Number of processes to parse logs with")
+parser.add_argument("--archive", choices=[x.lstrip(".") for x in COMPRESSORS],
+                    help="Compress all but the newest log in PATH and exit")
+parser.add_argument("--profile", action="store_true", help="Report time spent in each parsing stage in this process")
+parser.add_argument("--db", type=Path, help="Add new events from PATH to a SQLite database and exit")
+
+query_parser = ArgumentParser(description="Select events from CC2 game logs", prog="cc2logger query")
+query_parser.add_argument("PATH", type=Path, nargs="+", help="CC2 game jsonl files or folders of logs")
+query_parser.add_argument("--type", action="append", default=[],
+                          help="Event type, eg chat or destroy_vehicle, may be repeated")
+query_parser.add_argument("--player", action="append", default=[], help="Player id or name, may be repeated")
+query_parser.add_argument("--team", action="append", type=int, default=[], help="Team number, may be repeated")
+query_parser.add_argument("--vehicle", action="append", type=vehicle_type, default=[],
+                          help="Vehicle type name or number, may be repeated")
+query_parser.add_argument("--start", help="Only events at or after this ISO time")
+query_parser.add_argument("--end", help="Only events at or before this ISO time")
+query_parser.add_argument("--count-by", choices=COUNT_KEYS, help="Print event counts instead of events")
+query_parser.add_argument("--format", choices=["json", "table"], default="json", help="Output format")
+query_parser.add_argument("--save-index", action="store_true",
+                          help="Keep the time indexes built for --start/--end as .tidx files next to the logs")
+
+
+def parse_time(value: str) -> int:
+    stamp = datetime.fromisoformat(value)
+    if stamp.tzinfo is None:
+        stamp = stamp.replace(tzinfo=timezone.utc)
+    return epoch(stamp)
+
+
+def query_main(args: list[str]) -> None:
+    opts = query_parser.parse_args(args)
+    query = Query()
+    query.types.update(opts.type)
+    for item in opts.player:
+        query.add_player(item)
+    query.teams.update(opts.team)
+    query.vehicle_types.update(opts.vehicle)
+    if opts.start:
+        query.start = parse_time(opts.start)
+    if opts.end:
+        query.end = parse_time(opts.end)
+
+    messages = run_query(opts.PATH, query, opts.save_index)
+    if opts.count_by:
+        counts = aggregate(messages, opts.count_by)
+        if opts.format == "json":
+            for key, count in counts.most_common():
+                print(json.dumps({opts.count_by: key, "count": count}))
+        else:
+            for key, count in counts.most_common():
+                print(f" {str(key):24}: {count:-6}")
+    elif opts.format == "json":
+        write_json(messages, sys.stdout)
+    else:
+        write_table(messages, sys.stdout)
 
 
 def main():
+    if sys.argv[1:2] == ["query"]:
+        query_main(sys.argv[2:])
+        return
+
     opts = parser.parse_args()
 
+    if opts.archive:
+        for item in archive_folder(opts.PATH, f".{opts.archive}"):
+            print(f"archived {item}")
+        return
+
+    if opts.db:
+        with EventDatabase(opts.db) as db:
+            if opts.PATH.is_file():
+                added = db.ingest_file(opts.PATH)
+            else:
+                added = db.ingest(opts.PATH)
+        print(f"added {added} events to {opts.db}")
+        return
+
     gp = CC2GameParser()
+    if opts.profile:
+        profiler.enable()
 
     files = []
     if opts.PATH.is_file():
         files.append(opts.PATH)
     elif opts.PATH.is_dir():
-        files = sorted(list(opts.PATH.glob("game_log_*.jsonl")))
+        files = find_logs(opts.PATH)
+
+    if opts.jobs > 1:
+        for partial in parse_partials(files, opts.jobs):
+            print(f"read {partial.filepath}")
+            merge_partial(gp, partial)
+    else:
+        for item in files:
+            print(f"read {item}")
+            gp.consume(iter_events(item))
 
-    for item in files:
-        print(f"read {item}")
-        gp.read(item)
+    if opts.profile:
+        profiler.disable()
+        print(profiler.format_report())
 
     if opts.stats:
         with open("test.lua", "w") as fd:
@@ -31,9 +125,9 @@ def main():
 
     # print some basic stuff
     if len(files) == 1:
-        print(f"Game started      : {gp.first_message.timestamp}")
+        print(f"Game started      : {gp.started}")
     else:
-        print(f"Logs started      : {gp.first_message.timestamp}")
+        print(f"Logs started      : {gp.started}")
 
     print(f"Duration          : {int(gp.duration.total_seconds() / 60):-5} mins")
     print("Players           :")
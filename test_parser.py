@@ -1,6 +1,7 @@
 import pytest
 from pathlib import Path
 from cc2logger import parser
+from cc2logger.inotify import inotify_available
 
 TOP = Path(__file__).parent.absolute()
 
@@ -40,3 +41,1472 @@ def test_follower():
     assert True
 
     assert len(p.players) == 2
+
+
+def test_block_reader_matches_line_reader():
+    logfile = TOP / "logs" / "real-game-2025-10-31.jsonl"
+    results = {}
+    for engine in ["line", "block"]:
+        p = parser.CC2GameParser()
+        p.engine = engine
+        p.open(logfile)
+        records = []
+        while True:
+            data = p.read_record()
+            if data is None:
+                break
+            records.append(data)
+        p.close()
+        results[engine] = records
+
+    assert results["block"] == results["line"]
+    assert len(results["block"]) == 146
+    assert p._reader.offset == logfile.stat().st_size
+
+
+@pytest.mark.parametrize("checkpoint_name", ["checkpoint.json", "checkpoint.snap"])
+def test_checkpointed_refresh(tmp_path, checkpoint_name):
+    from cc2logger.checkpoint import CheckpointedParser
+    logdir = tmp_path / "logs"
+    logdir.mkdir()
+    sources = sorted((TOP / "logs").glob("game_log_*.jsonl"))
+    for src in sources[:-1]:
+        (logdir / src.name).write_bytes(src.read_bytes())
+    # the newest log is half written
+    lines = sources[-1].read_bytes().splitlines(keepends=True)
+    newest = logdir / sources[-1].name
+    newest.write_bytes(b"".join(lines[:10]) + lines[10][:20])
+    checkpoint = tmp_path / checkpoint_name
+
+    def summary(p: parser.CC2GameParser):
+        return (p.started, p.duration, p.island_captures, p.player_names,
+                {k: v for k, v in p.destroyed_stats.items() if v},
+                {k: v.total_playtime for k, v in p.players.items()})
+
+    first = CheckpointedParser(checkpoint)
+    first.refresh(logdir)
+    assert checkpoint.exists()
+
+    newest.write_bytes(b"".join(lines))
+    second = CheckpointedParser(checkpoint)
+    second.refresh(logdir)
+    assert second.entries[-1].offset == newest.stat().st_size
+
+    full = parser.CC2GameParser()
+    full.read_path(logdir)
+    assert summary(second) == summary(full)
+
+    # a damaged checkpoint is ignored
+    checkpoint.write_bytes(checkpoint.read_bytes()[:-10])
+    damaged = CheckpointedParser(checkpoint)
+    damaged.refresh(logdir)
+    assert summary(damaged) == summary(full)
+
+    # a rewritten file invalidates the checkpoint
+    newest.write_bytes(b"".join(lines[:5]))
+    third = CheckpointedParser(checkpoint)
+    third.refresh(logdir)
+    full = parser.CC2GameParser()
+    full.read_path(logdir)
+    assert summary(third) == summary(full)
+
+
+def test_checkpoint_log_tails(tmp_path):
+    from cc2logger.archive import find_logs
+    from cc2logger.checkpoint import CheckpointedParser
+    record = '{{"timestamp": "2025-01-0{0}T00:00:0{1}Z", "type": "island_captured", "island_id": "{1}", "team": "1"}}\n'
+    first = tmp_path / "game_log_2025-01-01_00-00-00.jsonl"
+    first.write_text(record.format(1, 1))
+    checkpoint = tmp_path / "checkpoint.snap"
+
+    class LateWriter(CheckpointedParser):
+        # the game writes another record just after the end of the log is reached
+        def read_record(self):
+            data = super().read_record()
+            if data is None and first.read_text().count("\n") == 1:
+                with first.open("a") as fd:
+                    fd.write(record.format(1, 2))
+            return data
+
+    p = LateWriter(checkpoint)
+    p.refresh(tmp_path)
+    assert p.island_captures == 1
+    p = CheckpointedParser(checkpoint)
+    p.refresh(tmp_path)
+    assert p.island_captures == 2
+
+    # the game stops part way through a record and a new log is started
+    with first.open("a") as fd:
+        fd.write('{"timestamp": "2025-01-01T00:00:09Z", "ty')
+    CheckpointedParser(checkpoint).refresh(tmp_path)
+    (tmp_path / "game_log_2025-01-02_00-00-00.jsonl").write_text(record.format(2, 3))
+    CheckpointedParser(checkpoint).refresh(tmp_path)
+    # the finished log's cut short record does not discard the checkpoint from now on
+    p = CheckpointedParser(checkpoint)
+    assert p.load_checkpoint(find_logs(tmp_path))
+    p = CheckpointedParser(checkpoint)
+    p.refresh(tmp_path)
+    assert p.island_captures == 3
+
+
+def test_parallel_read_files():
+    from cc2logger.parallel import read_files
+    files = sorted((TOP / "logs").glob("game_log_*.jsonl"))
+    sequential = parser.CC2GameParser()
+    for item in files:
+        sequential.read(item)
+
+    merged = read_files(files, jobs=2)
+    assert merged.started == sequential.started
+    assert merged.duration == sequential.duration
+    assert merged.island_captures == sequential.island_captures
+    assert merged.destroyed_stats == sequential.destroyed_stats
+    assert merged.player_names == sequential.player_names
+    assert {k: v.teams for k, v in merged.players.items()} == {k: v.teams for k, v in sequential.players.items()}
+
+
+def test_parallel_merge_state(tmp_path):
+    import json
+    from datetime import datetime, timezone
+    from cc2logger.parallel import parse_partial, merge_partial
+    from cc2logger.synthetic import generate_folder
+
+    def write(name, events):
+        with (tmp_path / name).open("w") as fd:
+            for when, kind, player_id, team in events:
+                stamp = datetime.fromtimestamp(base + when, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+                print(json.dumps({"timestamp": stamp, "type": kind, "player_name": f"p{player_id}.{when}",
+                                  "player_id": str(player_id), "team": team}), file=fd)
+
+    # players still online at the end of a log, leaving in the next one, joining again on another team
+    base = int(datetime(2024, 12, 1, tzinfo=timezone.utc).timestamp())
+    write("game_log_a.jsonl", [(0, "player_joined", 1, 1), (10, "player_joined", 2, 2), (20, "player_left", 3, 1),
+                                (30, "player_joined", 3, 1)])
+    write("game_log_b.jsonl", [(100, "player_left", 1, 1), (110, "player_left", 2, 3), (120, "player_joined", 1, 2),
+                                (130, "player_left", 4, 1), (140, "player_joined", 2, 2), (150, "player_left", 1, 2)])
+    files = sorted(tmp_path.glob("game_log_*.jsonl"))
+    files.extend(generate_folder(tmp_path, 6000, files=3, players=12))
+
+    sequential = parser.CC2GameParser()
+    for item in files:
+        sequential.read(item)
+
+    class NoReplay(parser.CC2GameParser):
+        def on_message(self, data):
+            raise AssertionError("records are not replayed")
+
+    merged = NoReplay()
+    for item in files:
+        merge_partial(merged, parse_partial(item))
+
+    def players(gp):
+        return [[*x.get_state(), x.left] for x in gp.players.values()]
+
+    assert players(merged) == players(sequential)
+    assert list(merged.names.items()) == list(sequential.names.items())
+    assert merged.get_state()["teams"] == sequential.get_state()["teams"]
+    assert all(merged.teams[t][x] is merged.players[x] for t in merged.teams for x in merged.teams[t])
+    assert [(x.player_id, x.epoch) for x in merged.joined] == [(x.player_id, x.epoch) for x in sequential.joined]
+    assert (sorted(merged.timeline.get_state()["sessions"], key=repr)
+            == sorted(sequential.timeline.get_state()["sessions"], key=repr))
+    assert merged.duration == sequential.duration
+
+
+def test_event_store():
+    from datetime import datetime, timezone
+    from cc2logger.columns import EventStore
+    logfile = TOP / "logs" / "real-game-2025-10-31.jsonl"
+    p = parser.CC2GameParser()
+    p.store = EventStore()
+    p.read(logfile)
+
+    store = p.store
+    assert len(store) == 146
+    assert store.count(["island_captured"]) == p.island_captures
+    assert store.count(["destroy_vehicle"]) == sum(p.destroyed_stats.values())
+    assert len(store.names) == 3
+
+    chat = [store.get(x) for x in store.select(["chat"])]
+    assert chat[3]["message"] == "test with a  newline inside"
+    assert chat[3]["player_name"] == "Bredroll"
+
+    start = datetime(2025, 10, 31, 15, 13, 0, tzinfo=timezone.utc)
+    end = datetime(2025, 10, 31, 15, 14, 0, tzinfo=timezone.utc)
+    assert store.count(["chat"], start, end) == 3
+    assert store.count(start=start, end=end) == 3
+
+    # values too big for a column widen it instead of failing the read
+    from cc2logger.messages import MessageFactory
+    factory = MessageFactory()
+    rows = len(store)
+    store.add(factory.parse({"timestamp": "2025-11-01T00:00:00Z", "type": "island_captured",
+                             "island_id": str(2 ** 40), "team": "70000"}))
+    store.add(factory.parse({"timestamp": "2025-11-01T00:00:01Z", "type": "chat", "player_name": "big",
+                             "player_id": str(2 ** 64 + 1), "message": "hi"}))
+    store.add(factory.parse({"timestamp": "2025-11-01T00:00:02Z", "type": "chat", "player_name": "negative",
+                             "player_id": "-5", "message": "hi"}))
+    assert len(store) == rows + 3
+    assert all(len(getattr(store, x)) == len(store) for x in store.COLUMNS)
+    assert store.get(rows)["island_id"] == 2 ** 40
+    assert store.get(rows)["team"] == 70000
+    assert store.get(rows + 1)["player_id"] == 2 ** 64 + 1
+    assert store.get(rows + 2)["player_id"] == -5
+    assert [store.get(x) for x in store.select(["chat"])][3] == chat[3]
+
+
+@pytest.mark.skipif(not inotify_available(), reason="needs inotify")
+def test_follower_inotify(tmp_path):
+    first = tmp_path / "game_log_2025-01-01_00-00-00.jsonl"
+    first.write_text('{"timestamp": "2025-01-01T00:00:00Z", "type": "island_captured", "island_id": "1", "team": "1"}\n')
+    p = parser.CC2GameFollower()
+    p.open_latest(tmp_path)
+    assert p.watcher is not None
+    assert p.read_one()
+    assert p.read_one() is None
+
+    with first.open("a") as fd:
+        fd.write('{"timestamp": "2025-01-01T00:00:05Z", "type": "island_captured", "island_id": "2", "team": "1"}\n')
+    assert p.wait(5)
+    assert p.read_one().island_id == 2
+
+    second = tmp_path / "game_log_2025-01-02_00-00-00.jsonl"
+    second.write_text('{"timestamp": "2025-01-02T00:00:00Z", "type": "island_captured", "island_id": "3", "team": "1"}\n')
+    assert p.wait(5)
+    assert p.read_one().island_id == 3
+    assert p.latest_file == second
+    p.stop_watching()
+
+
+@pytest.mark.parametrize("broken", ["platform", "library"])
+def test_follower_without_inotify(tmp_path, monkeypatch, broken):
+    import ctypes
+    from cc2logger import inotify
+    monkeypatch.setattr(inotify, "_libc", None)
+    if broken == "platform":
+        monkeypatch.setattr(inotify.sys, "platform", "win32")
+    else:
+        # what ctypes does on Windows when find_library("c") returns None
+        def no_library(*args, **kwargs):
+            raise TypeError("expected str, bytes or os.PathLike object, not NoneType")
+        monkeypatch.setattr(ctypes, "CDLL", no_library)
+    assert not inotify.inotify_available()
+    logfile = tmp_path / "game_log_2025-01-01_00-00-00.jsonl"
+    logfile.write_text('{"timestamp": "2025-01-01T00:00:00Z", "type": "island_captured", "island_id": "1", "team": "1"}\n')
+    p = parser.CC2GameFollower()
+    p.open_latest(tmp_path)
+    # falls back to polling
+    assert p.watcher is None
+    assert p.read_one().island_id == 1
+    assert p.wait(0.01) is False
+    p.close()
+
+
+def test_follower_stream(tmp_path):
+    import asyncio
+    from cc2logger.aio import follow_many
+
+    record = '{{"timestamp": "2025-01-01T00:00:0{0}Z", "type": "island_captured", "island_id": "{0}", "team": "1"}}\n'
+    folders = []
+    for name in ["one", "two"]:
+        folder = tmp_path / name
+        folder.mkdir()
+        (folder / "game_log_2025-01-01_00-00-00.jsonl").write_text(record.format(1))
+        folders.append(folder)
+
+    async def consume():
+        followers = []
+        for folder in folders:
+            p = parser.CC2GameFollower()
+            p.open_latest(folder)
+            followers.append(p)
+
+        seen = []
+        async for follower, message in follow_many(followers, poll_interval=0.05):
+            seen.append((follower.folder.name, message.island_id))
+            if len(seen) == 2:
+                with (folders[1] / "game_log_2025-01-01_00-00-00.jsonl").open("a") as fd:
+                    fd.write(record.format(2))
+            if len(seen) == 3:
+                for p in followers:
+                    p.request_stop()
+        for p in followers:
+            p.stop_watching()
+
+        with pytest.raises(TimeoutError):
+            p = parser.CC2GameFollower()
+            p.open_latest(folders[0])
+            async for _ in p.stream(poll_interval=0.05, idle_timeout=0.2):
+                pass
+        p.stop_watching()
+        return seen
+
+    seen = asyncio.run(asyncio.wait_for(consume(), 10))
+    assert sorted(seen) == [("one", 1), ("two", 1), ("two", 2)]
+
+    # a long backlog in one log does not hold up the others
+    with (folders[0] / "game_log_2025-01-01_00-00-00.jsonl").open("a") as fd:
+        fd.write(record.format(3) * 5000)
+
+    async def backlog():
+        followers = []
+        for folder in folders:
+            p = parser.CC2GameFollower()
+            p.open_latest(folder)
+            followers.append(p)
+        seen = []
+        async for follower, message in follow_many(followers, poll_interval=0.05, queue_size=10000):
+            seen.append(follower.folder.name)
+            if len(seen) == 5003:
+                for p in followers:
+                    p.request_stop()
+        for p in followers:
+            p.stop_watching()
+        return seen
+
+    seen = asyncio.run(asyncio.wait_for(backlog(), 10))
+    assert seen.index("two") <= parser.STREAM_BATCH
+
+
+def test_fanout_overflow_policies():
+    import threading
+    from cc2logger.fanout import FanOut, OverflowPolicy, Subscriber, chain
+    from cc2logger.messages import MessageFactory
+
+    factory = MessageFactory()
+    captures = [factory.parse({"timestamp": "2025-01-01T00:00:00Z", "type": "island_captured",
+                               "island_id": str(x), "team": "1"}) for x in range(10)]
+    gate = threading.Event()
+    got = {"slow": [], "coalesce": [], "fast": []}
+
+    def slow(msg):
+        gate.wait(5)
+        got["slow"].append(msg.island_id)
+
+    def coalesce(msg):
+        gate.wait(5)
+        got["coalesce"].append(msg.island_id)
+
+    fanout = FanOut()
+    slow_sub = fanout.subscribe(slow, maxsize=3, policy=OverflowPolicy.drop_oldest, name="slow")
+    coalesce_sub = fanout.subscribe(coalesce, maxsize=3, policy=OverflowPolicy.coalesce, name="coalesce")
+    fanout.subscribe(chain([lambda msg: True, lambda msg: got["fast"].append(msg)]), name="fast")
+    for msg in captures:
+        fanout.publish(msg)
+    assert fanout.stats()["slow"]["queue_depth"] <= 3
+    gate.set()
+    fanout.close(timeout=5)
+
+    # publishing never waited on the slow subscribers
+    assert slow_sub.dropped > 0
+    assert got["slow"][-1] == 9
+    assert coalesce_sub.coalesced > 0
+    assert got["coalesce"][-1] == 9
+    # chain() stops at the first subscriber that handled the message
+    assert got["fast"] == []
+
+    # a publisher waiting for room gives up when the subscriber closes, and nothing is queued after
+    sub = Subscriber(lambda msg: True, maxsize=1)
+    sub.put(captures[0])
+    waiting = threading.Thread(target=sub.put, args=(captures[1],))
+    waiting.start()
+    sub.close()
+    waiting.join(5)
+    assert not waiting.is_alive()
+    sub.put(captures[2])
+    assert list(sub._queue) == [captures[0]]
+
+
+def test_admin_chat_commands(tmp_path):
+    import queue
+    import threading
+    from types import SimpleNamespace
+    from cc2control.controller import ServerController, ServerLoop
+    from cc2logger.messages import MessageFactory
+
+    main_thread = threading.current_thread()
+    stopped = []
+    controller = SimpleNamespace(follower=None, admin_users={"1"}, quit=False, game_folder=tmp_path,
+                                 requests=queue.Queue(),
+                                 stop=lambda: stopped.append(threading.current_thread()))
+    controller.request = lambda func: ServerController.request(controller, func)
+    loop = ServerLoop(controller)
+    chat = MessageFactory().parse({"timestamp": "2025-01-01T00:00:00Z", "type": "chat", "player_name": "admin",
+                                   "player_id": "1", "message": "/shutdown"})
+    handler = threading.Thread(target=loop.handle_chat_message, args=(chat,))
+    handler.start()
+    handler.join(5)
+    # the subscriber only queued the command
+    assert stopped == [] and not controller.quit
+    ServerController.run_requests(controller, 0)
+    assert stopped == [main_thread]
+    assert controller.quit
+
+
+@pytest.mark.parametrize("method", [".gz", ".xz", ".bz2"])
+def test_compressed_archive(tmp_path, method):
+    import shutil
+    from cc2logger.archive import archive_folder, find_logs, open_log
+    from cc2logger.checkpoint import CheckpointedParser
+    logdir = tmp_path / "logs"
+    logdir.mkdir()
+    for src in (TOP / "logs").glob("game_log_*.jsonl"):
+        shutil.copy(src, logdir / src.name)
+    plain = parser.CC2GameParser()
+    plain.read_path(logdir)
+    checkpoint = CheckpointedParser(tmp_path / "checkpoint.snap")
+    checkpoint.refresh(logdir)
+    original = sorted(logdir.glob("*.jsonl"))[0].read_bytes()
+
+    archived = archive_folder(logdir, method, chunk_size=1024)
+    assert len(archived) == 3
+    assert len(find_logs(logdir)) == 4
+
+    # random access through the block index
+    with open_log(archived[0], 3000) as fd:
+        assert fd.tell() == 3000
+        assert fd.read(100) == original[3000:3100]
+
+    compressed = parser.CC2GameParser()
+    compressed.read_path(logdir)
+    assert compressed.island_captures == plain.island_captures
+    assert compressed.destroyed_stats == plain.destroyed_stats
+    assert compressed.player_names == plain.player_names
+
+    # archiving finished logs does not invalidate the stats checkpoint
+    resumed = CheckpointedParser(tmp_path / "checkpoint.snap")
+    assert resumed.load_checkpoint(find_logs(logdir))
+    assert resumed.entries_updated
+
+    # and once the checkpoint is saved again the archives are not fingerprinted on every refresh
+    resumed = CheckpointedParser(tmp_path / "checkpoint.snap")
+    resumed.refresh(logdir)
+    assert resumed.island_captures == plain.island_captures
+    again = CheckpointedParser(tmp_path / "checkpoint.snap")
+    assert again.load_checkpoint(find_logs(logdir))
+    assert not again.entries_updated
+    assert all(entry.unchanged(filepath) for entry, filepath in zip(again.entries, find_logs(logdir)))
+
+
+def test_time_index_read_range(tmp_path):
+    import json
+    from datetime import datetime, timezone
+    from cc2logger.synthetic import generate_log
+    from cc2logger.timeindex import load_index, tidx_path
+    for day in [1, 2]:
+        with (tmp_path / f"game_log_2025010{day}.jsonl").open("w") as fd:
+            generate_log(fd, 5000, seed=day, started=datetime(2025, 1, day, tzinfo=timezone.utc))
+    logs = sorted(tmp_path.glob("*.jsonl"))
+    start = datetime(2025, 1, 1, 3, tzinfo=timezone.utc)
+    end = datetime(2025, 1, 2, 1, tzinfo=timezone.utc)
+
+    full = parser.CC2GameParser()
+    expected = []
+    for log in logs:
+        full.open(log)
+        while True:
+            msg = full.read_one()
+            if msg is None:
+                break
+            if start.timestamp() <= msg.epoch <= end.timestamp():
+                expected.append(msg.epoch)
+        full.close()
+
+    p = parser.CC2GameParser()
+    got = [msg.epoch for msg in p.read_range(tmp_path, start, end)]
+    assert got == expected
+    assert p.first_message.epoch >= start.timestamp()
+    # reading never writes into the logs folder unless asked to
+    assert not list(tmp_path.glob("*.tidx"))
+
+    # the seek skips most of the first log
+    index = load_index(logs[0], save=True)
+    assert index.offset_for(int(start.timestamp())) > logs[0].stat().st_size // 2
+    assert tidx_path(logs[0]).exists()
+
+    # growing a log only indexes the new records
+    entries = len(index.offsets)
+    with logs[1].open("a") as fd:
+        for i in range(1000):
+            print(json.dumps({"timestamp": "2025-01-03T00:00:00Z", "type": "chat", "player_name": "late",
+                              "player_id": "1", "message": str(i)}), file=fd)
+    grown = load_index(logs[1], save=True)
+    assert grown.indexed_offset == logs[1].stat().st_size
+    p = parser.CC2GameParser()
+    p.save_index = True
+    late = list(p.read_range(tmp_path, datetime(2025, 1, 3, tzinfo=timezone.utc), datetime(2025, 1, 4, tzinfo=timezone.utc)))
+    assert len(late) == 1000
+    assert len(load_index(logs[0]).offsets) == entries
+
+
+def test_time_index_out_of_order(tmp_path):
+    import json
+    from datetime import datetime, timezone
+    from cc2logger.query import iter_records
+    from cc2logger.timeindex import load_index
+
+    def write(path, stamps):
+        with path.open("w") as fd:
+            for i, stamp in enumerate(stamps):
+                when = datetime.fromtimestamp(base + stamp, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+                print(json.dumps({"timestamp": when, "type": "chat", "player_name": "p", "player_id": "1",
+                                  "message": str(stamp)}), file=fd)
+
+    base = int(datetime(2025, 1, 1, tzinfo=timezone.utc).timestamp())
+    # a record written late, after one already past the end of the range
+    stamps = [*range(1000), 1500, 900, *range(1001, 2000)]
+    write(tmp_path / "game_log_1.jsonl", stamps)
+    write(tmp_path / "game_log_2.jsonl", [*range(3000, 4000)])
+    start = base + 500
+    end = base + 1000
+    expected = [str(x) for x in stamps if 500 <= x <= 1000]
+    assert [x["message"] for x in iter_records([tmp_path], start, end)] == expected
+    p = parser.CC2GameParser()
+    assert [msg.message for msg in p.read_range(tmp_path, start, end)] == expected
+
+    # a saved index is rebuilt when the log is replaced by another one
+    log = tmp_path / "game_log_2.jsonl"
+    assert load_index(log, save=True).first_epoch == base + 3000
+    write(log, [*range(5000, 7000)])
+    index = load_index(log, save=True)
+    assert index.first_epoch == base + 5000
+    assert index.indexed_offset == log.stat().st_size
+    assert load_index(log).offsets == index.offsets
+
+
+def test_range_reads_once(tmp_path, monkeypatch):
+    from datetime import datetime, timezone
+    from cc2logger import reader
+    from cc2logger.messages import parse_epoch
+    from cc2logger.query import iter_records
+    from cc2logger.synthetic import generate_log
+    for day in [1, 2]:
+        with (tmp_path / f"game_log_2025010{day}.jsonl").open("w") as fd:
+            generate_log(fd, 3000, seed=day, started=datetime(2025, 1, day, tzinfo=timezone.utc))
+    start = int(datetime(2025, 1, 1, 1, tzinfo=timezone.utc).timestamp())
+    end = int(datetime(2025, 1, 2, 1, tzinfo=timezone.utc).timestamp())
+    everything = list(iter_records([tmp_path]))
+    expected = [x for x in everything if start <= parse_epoch(x["timestamp"]) <= end]
+
+    decoded = []
+    next_record = reader.BlockReader.next_record
+
+    def counted(self):
+        data = next_record(self)
+        if data is not None:
+            decoded.append(data)
+        return data
+
+    monkeypatch.setattr(reader.BlockReader, "next_record", counted)
+    # with no index kept, each log is decoded once
+    indexes = {}
+    assert list(iter_records([tmp_path], start, end, indexes=indexes)) == expected
+    assert len(decoded) == len(everything)
+    assert not list(tmp_path.glob("*.tidx"))
+    # the indexes kept in memory skip most of the logs next time
+    decoded.clear()
+    assert list(iter_records([tmp_path], start, end, indexes=indexes)) == expected
+    assert len(decoded) < len(everything) * 3 // 4
+
+    # the same for the parser, which keeps the indexes itself
+    decoded.clear()
+    p = parser.CC2GameParser()
+    got = [msg.epoch for msg in p.read_range(tmp_path, start, end)]
+    assert got and all(start <= x <= end for x in got)
+    assert len(decoded) == len(everything)
+    assert not list(tmp_path.glob("*.tidx"))
+    decoded.clear()
+    assert [msg.epoch for msg in p.read_range(tmp_path, start, end)] == got
+    assert len(decoded) < len(everything) * 3 // 4
+
+
+def test_query_pushdown(tmp_path):
+    import argparse
+    import shutil
+    from cc2logger.messages import MessageFactory, DestroyedVehicle
+    from cc2logger.query import Query, iter_records, select, build, run_query, aggregate, vehicle_type
+    for src in (TOP / "logs").glob("game_log_*.jsonl"):
+        shutil.copy(src, tmp_path / src.name)
+    everything = list(run_query([tmp_path], Query()))
+
+    query = Query()
+    query.types.add("destroy_vehicle")
+    query.vehicle_types.add(vehicle_type("Seal"))
+    with pytest.raises(argparse.ArgumentTypeError, match="Seal"):
+        vehicle_type("Submarine")
+    query.teams.add(0)
+    seals = [msg for msg in everything if isinstance(msg, DestroyedVehicle)
+             and msg.vehicle_type_name == "Seal" and msg.team == 0]
+
+    class CountingFactory(MessageFactory):
+        built = 0
+
+        def parse(self, data):
+            self.built += 1
+            return super().parse(data)
+
+    factory = CountingFactory()
+    got = list(build(select(iter_records([tmp_path]), query), factory))
+    assert [msg.epoch for msg in got] == [msg.epoch for msg in seals]
+    # records were rejected before any message was built for them
+    assert factory.built == len(seals)
+
+    query = Query()
+    query.add_player("Bredroll")
+    query.start = everything[10].epoch
+    query.end = everything[-10].epoch
+    counts = aggregate(run_query([tmp_path], query), "type")
+    assert not list(tmp_path.glob("*.tidx"))
+    assert list(run_query([tmp_path], query, save_index=True))
+    assert list(tmp_path.glob("*.tidx"))
+    expected = aggregate([msg for msg in everything if getattr(msg, "player_name", None) == "Bredroll"
+                          and query.start <= msg.epoch <= query.end], "type")
+    assert counts == expected
+    assert counts["chat"] > 0
+
+
+def test_database_ingest(tmp_path):
+    import shutil
+    from cc2logger.database import EventDatabase
+    logdir = tmp_path / "logs"
+    logdir.mkdir()
+    logs = sorted((TOP / "logs").glob("game_log_*.jsonl"))
+    for src in logs:
+        shutil.copy(src, logdir / src.name)
+    expected = parser.CC2GameParser()
+    expected.read_path(logdir)
+    kills = sum(expected.destroyed_stats.values())
+
+    with EventDatabase(tmp_path / "events.db", batch_size=50) as db:
+        added = db.ingest(logdir)
+        assert db.count("destroyed_vehicles") == kills
+        assert db.count("island_captures") == expected.island_captures
+        # a second run adds nothing
+        assert db.ingest(logdir) == 0
+        assert db.count("destroyed_vehicles") == kills
+
+    # new records are added from the stored offset, in a fresh connection
+    newest = logdir / logs[-1].name
+    with newest.open("a") as fd:
+        fd.write('{"timestamp": "2030-01-01T00:00:00Z", "type": "island_captured", "island_id": "3", "team": "2"}\n')
+        fd.write('{"timestamp": "2030-01-01T00:00:01Z", "type": "chat", "player_id": "1", "player_name": "x", ')
+    with EventDatabase(tmp_path / "events.db") as db:
+        assert db.ingest(logdir) == 1
+        with newest.open("a") as fd:
+            fd.write('"message": "hi"}\n')
+        assert db.ingest(logdir) == 1
+        assert db.count("island_captures") == expected.island_captures + 1
+        rows = db.db.execute("SELECT player_name, message FROM chat WHERE timestamp >= ?", (1893456000,)).fetchall()
+        assert rows == [("x", "hi")]
+
+        # a rewritten log has its events replaced rather than duplicated
+        first = logdir / logs[0].name
+        first.write_text(first.read_text().replace('"island_captured"', '"ignored"'))
+        db.ingest(logdir)
+        remaining = sum(x.read_text().count('"island_captured"') for x in logs[1:])
+        assert db.count("island_captures") == remaining + 1
+        assert db.count("destroyed_vehicles") == kills
+        assert added > 0
+
+
+def test_database_append_during_ingest(tmp_path, monkeypatch):
+    from cc2logger import database
+    from cc2logger.reader import BlockReader
+    record = '{{"timestamp": "2025-01-01T00:00:0{0}Z", "type": "island_captured", "island_id": "{0}", "team": "1"}}\n'
+    logfile = tmp_path / "game_log_2025-01-01_00-00-00.jsonl"
+    logfile.write_text(record.format(1))
+
+    class LateWriter(BlockReader):
+        # the game writes another record just after the reader reaches the end of the log
+        def next_record(self):
+            data = super().next_record()
+            if data is None and logfile.read_text().count("\n") == 1:
+                with logfile.open("a") as fd:
+                    fd.write(record.format(2))
+            return data
+
+    monkeypatch.setattr(database, "BlockReader", LateWriter)
+    with database.EventDatabase(tmp_path / "events.db", batch_size=1) as db:
+        assert db.ingest(tmp_path) == 1
+        assert db.ingest(tmp_path) == 1
+        assert db.count("island_captures") == 2
+        assert db.ingest(tmp_path) == 0
+
+        # a log ending in a partial record is not read again while it is unchanged
+        with logfile.open("a") as fd:
+            fd.write('{"timestamp": "2025-01-01T00:00:09Z", "ty')
+        assert db.ingest(tmp_path) == 0
+        assert db.ingest(tmp_path) == 0
+        assert db.count("island_captures") == 2
+
+
+def test_session_timeline(tmp_path):
+    import random
+    from cc2logger.synthetic import generate_log
+    from cc2logger.checkpoint import CheckpointedParser
+    logfile = tmp_path / "game_log_1.jsonl"
+    with logfile.open("w") as fd:
+        generate_log(fd, 20000, players=40)
+    p = parser.CC2GameParser()
+    p.read(logfile)
+    timeline = p.timeline
+    assert not timeline.open
+    sessions = timeline.sessions
+    assert sessions
+
+    # sessions still open at the end of the log close at its last record, like play time
+    assert max(x.end for x in sessions) == p.last_message.epoch
+
+    rnd = random.Random(1)
+    first = p.first_message.epoch
+    last = p.last_message.epoch
+    for point in [first, last] + [rnd.randint(first, last) for _ in range(200)]:
+        expected = [x for x in sessions if x.start <= point < x.end]
+        assert timeline.online_count(point) == len(expected)
+        assert sorted(id(x) for x in timeline.online_at(point)) == sorted(id(x) for x in expected)
+
+    step = 3600
+    peaks = timeline.peak_concurrency(first, last, step)
+    assert len(peaks) == -(-(last - first) // step)
+    for i, peak in enumerate(peaks):
+        bucket = range(first + i * step, min(first + (i + 1) * step, last + 1))
+        assert peak == max(timeline.online_count(t) for t in bucket)
+
+    # sessions survive a checkpoint
+    checkpointed = CheckpointedParser(tmp_path / "checkpoint.json")
+    checkpointed.refresh(tmp_path)
+    resumed = CheckpointedParser(tmp_path / "checkpoint.json")
+    resumed.refresh(tmp_path)
+    assert resumed.timeline.online_count(first + 7200) == timeline.online_count(first + 7200)
+
+    # checkpoints only keep the recent sessions
+    assert len(timeline.get_state()["sessions"]) == len(sessions)
+    timeline.state_keep = 3600
+    kept = timeline.get_state()
+    assert 0 < len(kept["sessions"]) < len(sessions)
+    assert all(end > last - 3600 for _, _, _, end in kept["sessions"])
+    timeline.set_state(kept)
+    assert timeline.horizon == last - 3600
+    assert timeline.online_count(last - 1) == resumed.timeline.online_count(last - 1)
+
+
+def test_session_horizon(tmp_path):
+    from datetime import datetime, timezone
+    from cc2logger.synthetic import generate_log
+    from cc2logger.checkpoint import CheckpointedParser
+    from cc2logger.sessions import HorizonError
+    # two logs ten days apart, the first one's sessions are dropped from the checkpoint
+    for day in [1, 11]:
+        with (tmp_path / f"game_log_202501{day:02}.jsonl").open("w") as fd:
+            generate_log(fd, 5000, seed=day, started=datetime(2025, 1, day, tzinfo=timezone.utc))
+    full = parser.CC2GameParser()
+    full.read_path(tmp_path)
+    early = int(datetime(2025, 1, 1, 1, tzinfo=timezone.utc).timestamp())
+    late = int(datetime(2025, 1, 11, 1, tzinfo=timezone.utc).timestamp())
+    assert full.timeline.online_count(early) > 0
+
+    checkpointed = CheckpointedParser(tmp_path / "checkpoint.json")
+    checkpointed.refresh(tmp_path)
+    resumed = CheckpointedParser(tmp_path / "checkpoint.json")
+    resumed.refresh(tmp_path)
+    timeline = resumed.timeline
+    assert early < timeline.horizon < late
+    # queries after the horizon are answered as before, earlier ones are refused
+    assert timeline.online_count(late) == full.timeline.online_count(late)
+    assert len(timeline.online_at(late)) == len(full.timeline.online_at(late))
+    assert timeline.peak_concurrency(late, late + 3600, 600) == full.timeline.peak_concurrency(late, late + 3600, 600)
+    with pytest.raises(HorizonError):
+        timeline.online_count(early)
+    with pytest.raises(HorizonError):
+        timeline.peak_concurrency(early, late, 3600)
+    # the horizon is kept when the restored timeline is saved again
+    assert resumed.timeline.get_state()["horizon"] == timeline.horizon
+
+
+def test_rolling_stats(tmp_path):
+    from cc2logger.messages import MessageFactory, DestroyedVehicle, CapturedIsland, PlayerChat
+    from cc2logger.synthetic import generate_log
+    from cc2control.serverstats import Stats
+    logfile = tmp_path / "game_log_1.jsonl"
+    with logfile.open("w") as fd:
+        generate_log(fd, 50000)
+    factory = MessageFactory()
+    stats = Stats()
+    messages = []
+    p = parser.CC2GameParser()
+    p.open(logfile)
+    while True:
+        data = p.read_record()
+        if data is None:
+            break
+        msg = factory.parse(data)
+        if msg:
+            stats.record_event(msg)
+            messages.append(msg)
+    p.close()
+
+    # memory is bounded by the window, not the number of events
+    assert len(stats.kills._buckets) <= 360
+    assert stats.units_destroyed == sum(isinstance(x, DestroyedVehicle) for x in messages)
+
+    now = messages[-1].epoch
+    rates = stats.rates(now)
+    for minutes in [1, 5, 60]:
+        # buckets are 10 seconds, so the window starts on a bucket boundary
+        since = (now // 10 - minutes * 6 + 1) * 10
+        kills = [x for x in messages if isinstance(x, DestroyedVehicle) and x.epoch >= since]
+        assert rates[f"kills_per_min_{minutes}m"] == len(kills) / minutes
+        team1 = [x for x in kills if x.team == 1]
+        assert rates.get(f"team1_kills_per_min_{minutes}m", 0) == len(team1) / minutes
+        seals = [x for x in kills if x.vehicle_type_name == "Seal"]
+        assert rates.get(f"Seal_kills_per_min_{minutes}m", 0) == len(seals) / minutes
+    chat = [x for x in messages if isinstance(x, PlayerChat) and x.epoch >= (now // 10 - 29) * 10]
+    assert rates["chat_per_min_5m"] == len(chat) / 5
+    captures = [x for x in messages if isinstance(x, CapturedIsland) and x.epoch >= (now // 60 - 59) * 60]
+    assert rates["captures_per_hour"] == len(captures)
+
+
+STREAMING_MEMORY = """
+import io, itertools, json, resource, sys
+from cc2logger import parser
+from cc2logger.synthetic import generate_log
+buf = io.StringIO()
+generate_log(buf, 20000, players=2000, newlines=0)
+records = [json.loads(x) for x in buf.getvalue().splitlines()]
+del buf
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+p = parser.CC2GameParser()
+p.streaming = sys.argv[1] == "streaming"
+for data in itertools.islice(itertools.cycle(records), int(sys.argv[2])):
+    p.on_message(data)
+p.finish()
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before, len(p.player_names))
+"""
+
+
+@pytest.mark.slow
+def test_streaming_memory():
+    import subprocess
+    import sys
+
+    def peak_growth(mode: str, events: int) -> int:
+        output = subprocess.check_output([sys.executable, "-c", STREAMING_MEMORY, mode, str(events)], cwd=TOP)
+        growth, names = output.split()
+        assert int(names) > 100
+        return int(growth)
+
+    # peak memory of a two million event history stays within a few MB of the parser's starting point
+    assert peak_growth("streaming", 2000000) < 8 * 1024
+
+
+def test_synthetic_folder(tmp_path):
+    from cc2logger.synthetic import generate_folder
+    logs = generate_folder(tmp_path, 5000, files=3, newlines=0.5)
+    assert sorted(tmp_path.glob("game_log_*.jsonl")) == logs
+    assert sum(x.read_text().count("\n") for x in logs) > 5000
+    for engine in ["line", "block"]:
+        records = 0
+        for log in logs:
+            p = parser.CC2GameParser()
+            p.engine = engine
+            p.open(log)
+            while True:
+                data = p.read_record()
+                if data is None:
+                    break
+                records += 1
+            p.close()
+        # chat with newlines spans two lines but is still one record
+        assert records == 5000
+
+
+def test_stage_profiler():
+    import threading
+    from cc2logger import messages, reader
+    from cc2logger.timing import profiler, STAGES
+    originals = (reader.BlockReader._fill, reader.MmapReader.next_record, reader._raw_decode, messages.parse_epoch,
+                 messages.MessageFactory.parse, parser.CC2GameParser.add_message)
+    logfile = TOP / "logs" / "real-game-2025-10-31.jsonl"
+    profiler.enable()
+    try:
+        p = parser.CC2GameParser()
+        p.read(logfile)
+        report = profiler.report()
+
+        # the mmap engine's reads count as io too
+        profiler.reset()
+        mapped = parser.CC2GameParser()
+        mapped.engine = "mmap"
+        mapped.read(logfile)
+        mmap_report = profiler.report()
+
+        # parsing on several threads at once loses no counts
+        profiler.reset()
+        threads = [threading.Thread(target=parser.CC2GameParser().read, args=(logfile,)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        threaded_report = profiler.report()
+
+        # timestamps read for records that are not built, and by range reads, are counted too
+        profiler.reset()
+        chat_only = parser.CC2GameParser()
+        chat_only.factory.only(["chat"])
+        chat_only.read(logfile)
+        skipped_report = profiler.report()
+        profiler.reset()
+        ranged = parser.CC2GameParser()
+        ranged.factory.only(["chat"])
+        assert list(ranged.read_range(logfile.parent, 0, 2 ** 40))
+        range_report = profiler.report()
+        summary = profiler.format_report()
+    finally:
+        profiler.disable()
+    # nothing is left wrapped once profiling stops
+    assert (reader.BlockReader._fill, reader.MmapReader.next_record, reader._raw_decode, messages.parse_epoch,
+            messages.MessageFactory.parse, parser.CC2GameParser.add_message) == originals
+
+    assert sum(report["types"].values()) == 146
+    assert report["types"]["chat"] > 0
+    assert report["stages"]["aggregate"]["calls"] == 146
+    assert report["stages"]["timestamp"]["calls"] == 146
+    assert report["stages"]["io"]["calls"] >= 1
+    assert all(report["stages"][x]["seconds"] >= 0 for x in STAGES)
+    assert p.island_captures == 4
+
+    assert mmap_report["stages"]["io"]["calls"] > 146
+    assert mmap_report["stages"]["io"]["seconds"] > 0
+    assert mmap_report["stages"]["aggregate"]["calls"] == 146
+
+    assert threaded_report["stages"]["aggregate"]["calls"] == 4 * 146
+    assert sum(threaded_report["types"].values()) == 4 * 146
+
+    assert skipped_report["stages"]["timestamp"]["calls"] == 146
+    assert skipped_report["stages"]["aggregate"]["calls"] < 146
+    assert range_report["stages"]["timestamp"]["calls"] > sum(range_report["types"].values())
+    assert summary.splitlines()[0].split() == ["stage", "seconds", "calls", "share"]
+
+
+def test_lua_stats_page(tmp_path):
+    import re
+    p = parser.CC2GameParser()
+    p.read(TOP / "logs" / "real-game-2025-10-31.jsonl")
+    player = next(iter(p.players.values()))
+    player.player_name = 'bad "name" \\ with\nnewline\x01 ]] --'
+
+    lua = parser.generate_lua_stats_page(p)
+    assert parser.lua_string('a"b\\c\nd\x01e') == '"a\\"b\\\\c\\nd\\001e"'
+    # every content row is one complete Lua string literal
+    literal = r'"(?:[^"\\\n]|\\[\\"nrt]|\\\d{3})*"'
+    content = lua.split("content = {\n", 1)[1].splitlines()[:-1]
+    for line in content:
+        assert re.fullmatch(rf' (?:{{ "h", {literal} }}|{literal}),', line), line
+    assert ' " bad \\"name\\" \\\\ with\\nnewline\\001 ]] --",' in content
+
+    page = tmp_path / "library_custom_9.lua"
+    assert parser.write_lua_stats_page(p, page)
+    assert page.read_text(encoding="utf-8") == lua
+    mtime = page.stat().st_mtime_ns
+    # an unchanged page is not written again
+    assert not parser.write_lua_stats_page(p, page)
+    assert page.stat().st_mtime_ns == mtime
+    p.island_captures += 1
+    assert parser.write_lua_stats_page(p, page)
+
+
+def test_mmap_reader(tmp_path):
+    from cc2logger.reader import MmapReader
+    from cc2logger.synthetic import generate_folder
+    logfile = generate_folder(tmp_path, 3000, files=1, newlines=0.3)[0]
+    # no trailing newline, a bad record and blank lines
+    logfile.write_bytes(logfile.read_bytes() + b"\n\nnot json\n" + b'{"timestamp": "2025-01-09T00:00:00Z", "type": "chat"}')
+    results = {}
+    for engine in ["block", "mmap"]:
+        p = parser.CC2GameParser()
+        p.engine = engine
+        p.open(logfile)
+        records = []
+        offsets = []
+        while True:
+            data = p.read_record()
+            if data is None:
+                break
+            records.append(data)
+            offsets.append(p.offset)
+        results[engine] = (records, offsets, p._reader.bad_records)
+        p.close()
+    assert results["mmap"] == results["block"]
+    assert len(results["mmap"][0]) == 3001
+
+    # resume part way through, like a checkpoint does
+    p = parser.CC2GameParser()
+    p.engine = "mmap"
+    p.open(logfile, results["block"][1][1499])
+    assert isinstance(p._reader, MmapReader)
+    assert p.read_record() == results["block"][0][1500]
+    p.close()
+
+    # growing logs are read with the block engine
+    p.engine = "mmap"
+    p.tailing = True
+    p.open(logfile)
+    assert not isinstance(p._reader, MmapReader)
+    p.close()
+
+
+def test_corrupt_records(tmp_path):
+    import time
+    from cc2logger.synthetic import generate_folder
+    clean = generate_folder(tmp_path, 20000, files=1, newlines=0.05)[0]
+    lines = clean.read_text(encoding="utf-8").splitlines(keepends=True)
+    garbage = [
+        "not json at all\n",
+        "{{{\n",
+        '{"timestamp": "2025-01-01T00:00:00Z", "type": "chat", "message": "never closed\n',
+        lines[100][:len(lines[100]) // 2] + "\n",
+        '{"type": "chat", "message": "' + "x" * 100000 + "\n",
+        '{"type": "chat", "message": "\n' + "more chat\n" * 5000,
+    ]
+    # put the garbage between records, away from the multi line chat records
+    positions = [i for i in range(1000, len(lines), 2500) if lines[i].startswith('{"')][:len(garbage)]
+    for position, text in sorted(zip(positions, garbage), reverse=True):
+        lines.insert(position, text)
+    corrupt = tmp_path / "corrupt.jsonl"
+    corrupt.write_text("".join(lines), encoding="utf-8")
+
+    def read(filepath, engine):
+        p = parser.CC2GameParser()
+        p.engine = engine
+        p.open(filepath)
+        records = []
+        started = time.perf_counter()
+        while True:
+            data = p.read_record()
+            if data is None:
+                break
+            records.append(data)
+        p.close()
+        return records, p.bad_records, time.perf_counter() - started
+
+    expected, bad, clean_time = read(clean, "block")
+    assert len(expected) == 20000
+    assert bad == 0
+    for engine in ["block", "mmap", "line"]:
+        records, bad, corrupt_time = read(corrupt, engine)
+        assert records == expected, engine
+        assert bad >= len(garbage), engine
+        # skipping the garbage costs about as much as reading it
+        assert corrupt_time < clean_time * 5 + 1, engine
+
+
+@pytest.mark.parametrize("engine", ["block", "line"])
+def test_follower_partial_writes(tmp_path, engine):
+    import io, json, random, threading, time
+    from cc2logger.synthetic import generate_log
+
+    logs = []
+    for n in range(2):
+        text = io.StringIO()
+        generate_log(text, 3000, seed=n, newlines=0.1)
+        lines = text.getvalue().splitlines(keepends=True)
+        # multi byte characters so some writes split one
+        for i in range(50, len(lines), 300):
+            if lines[i].startswith('{"') and lines[i].rstrip().endswith("}"):
+                record = {"timestamp": "2025-01-01T00:00:00Z", "type": "chat", "player_name": "jörg",
+                          "player_id": "76561198000000001", "message": "über ∆ 🚁"}
+                lines.insert(i, json.dumps(record, ensure_ascii=False) + "\n")
+        logs.append("".join(lines).encode("utf-8"))
+    expected = []
+    for data in logs:
+        p = parser.CC2GameParser()
+        logfile = tmp_path / "expected.jsonl"
+        logfile.write_bytes(data)
+        p.open(logfile)
+        while (record := p.read_record()) is not None:
+            expected.append(record)
+        p.close()
+    folder = tmp_path / "game"
+    folder.mkdir()
+    names = ["game_log_2025-01-01_00-00-00.jsonl", "game_log_2025-01-02_00-00-00.jsonl"]
+    (folder / names[0]).write_bytes(b"")
+    done = threading.Event()
+
+    def writer():
+        rnd = random.Random(1)
+        for name, data in zip(names, logs):
+            with (folder / name).open("ab", buffering=0) as fd:
+                pos = 0
+                while pos < len(data):
+                    size = rnd.randint(1, 300)
+                    fd.write(data[pos:pos + size])
+                    pos += size
+                    if rnd.random() < 0.01:
+                        time.sleep(0.001)
+        done.set()
+
+    p = parser.CC2GameFollower()
+    p.engine = engine
+    p.use_inotify = False
+    p.check_latest_interval = 0.01
+    p.open_latest(folder)
+    thread = threading.Thread(target=writer)
+    thread.start()
+    records = []
+    p.factory.keep_data = True
+    p.callbacks.append(lambda msg: records.append(msg.data))
+    deadline = time.monotonic() + 60
+    while len(records) < len(expected) and time.monotonic() < deadline:
+        if p.read_one() is None:
+            if done.is_set() and p.latest_file.name == names[1] and p.offset == len(logs[1]):
+                break
+            time.sleep(0.0005)
+    thread.join()
+    assert p.bad_records == 0
+    assert records == expected
+    assert p.latest_file.name == names[1]
+    assert p.offset == len(logs[1])
+    p.close()
+
+
+@pytest.mark.parametrize("use_inotify", [True, False])
+def test_multi_tailer(tmp_path, use_inotify):
+    import threading, time
+    from cc2logger.multitail import MultiTailer
+    if use_inotify and not inotify_available():
+        pytest.skip("needs inotify")
+
+    record = '{{"timestamp": "2025-01-01T00:00:00Z", "type": "island_captured", "island_id": "{0}", "team": "1"}}\n'
+    tailer = MultiTailer(poll_interval=0.05, use_inotify=use_inotify)
+    # without inotify poll_once() always waits out its timeout
+    wait = 1 if use_inotify else 0.05
+    assert (tailer.watcher is not None) == use_inotify
+    got = []
+    arrived = threading.Event()
+    logs = {}
+    for n in range(20):
+        folder = tmp_path / f"server{n}" / "logs"
+        folder.mkdir(parents=True)
+        logs[n] = folder / "game_log_2025-01-01_00-00-00.jsonl"
+        logs[n].write_text(record.format(n))
+        follower = tailer.add(folder, name=f"server{n}")
+        follower.callbacks.append(lambda msg, n=n: got.append((n, msg.island_id)) or arrived.set())
+    # the records already in each log
+    assert tailer.poll_once(0) == 20
+    assert sorted(got) == [(n, n) for n in range(20)]
+    assert tailer.poll_once(0) == 0
+
+    # each message goes to its own server's callbacks
+    got.clear()
+    with logs[7].open("a") as fd:
+        fd.write(record.format(100))
+    assert tailer.lag()["server7"]["behind_bytes"] > 0
+    assert tailer.poll_once(wait) == 1
+    assert got == [(7, 100)]
+    lag = tailer.lag()
+    assert lag["server7"] == {"behind_bytes": 0, "delay": lag["server7"]["delay"], "messages": 2}
+    assert lag["server3"]["messages"] == 1
+
+    # a new game log is found and followed
+    got.clear()
+    newer = logs[3].parent / "game_log_2025-01-02_00-00-00.jsonl"
+    newer.write_text(record.format(300))
+    if not use_inotify:
+        tailer.servers["server3"].follower.check_latest_interval = 0
+    tailer.poll_once(wait)
+    assert got == [(3, 300)]
+    assert tailer.servers["server3"].follower.latest_file == newer
+
+    # idle, the thread only wakes to poll when there is no inotify, and never once per server
+    got.clear()
+    arrived.clear()
+    tailer.remove("server19")
+    tailer.start()
+    wakeups = tailer.wakeups
+    time.sleep(0.5)
+    idle = tailer.wakeups - wakeups
+    if use_inotify:
+        assert idle <= 1
+    else:
+        assert idle <= 0.5 / 0.05 + 2
+    with logs[12].open("a") as fd:
+        fd.write(record.format(120))
+    assert arrived.wait(5)
+    assert got == [(12, 120)]
+    tailer.close()
+    assert not tailer.is_alive()
+
+
+def test_controller_game_dirs(tmp_path, monkeypatch):
+    import shutil
+    import sys
+    from cc2control import controller
+    dirs = []
+    for name in ["one", "two"]:
+        folder = tmp_path / name
+        (folder / "logs").mkdir(parents=True)
+        shutil.copy(TOP / "server_config.xml", folder)
+        (folder / "controller.yml").write_text("port: 0\ncert: certs/server.crt\n")
+        dirs.append(folder)
+    started = []
+
+    def run(self):
+        started.append(self)
+        self.quit = True
+
+    monkeypatch.setattr(controller.ServerController, "run", run)
+    monkeypatch.setattr(sys, "argv", ["cc2control", "--game-dir", str(dirs[0]), "--game-dir", str(dirs[1])])
+    controller.main()
+    # every server reads its logs on one shared tailer
+    assert [x.game_folder for x in started] == dirs
+    assert started[0].tailer is not None and started[0].tailer is started[1].tailer
+    assert started[1].controller_cfg.cert == dirs[1] / "certs" / "server.crt"
+    started[0].tailer.close()
+
+
+def test_controller_stats_refresh(tmp_path, monkeypatch):
+    from types import SimpleNamespace
+    from cc2control import controller
+    from cc2logger.synthetic import generate_folder
+    logs = tmp_path / "logs"
+    logs.mkdir()
+    generate_folder(logs, 2000, files=1)
+    data_dir = tmp_path / "controller_data"
+    controller.gather_player_stats(tmp_path, data_dir)
+    # the checkpoint is kept with the controller, not in the game's logs folder
+    assert (data_dir / "player_stats.snap").exists()
+    assert not list(logs.glob("*.snap"))
+
+    gathered = []
+    monkeypatch.setattr(controller, "gather_player_stats", lambda *args: gathered.append(args))
+    server = SimpleNamespace(follower=None, game_folder=tmp_path, data_dir=data_dir, tailer=object())
+    server.message_loop = controller.ServerLoop(server)
+    # with a shared tailer the main loop refreshes the page, not only new events
+    controller.ServerController.idle(server)
+    assert gathered == [(tmp_path, data_dir)]
+    controller.ServerController.idle(server)
+    assert len(gathered) == 1
+    server.message_loop.stats_interval = -1
+    controller.ServerController.idle(server)
+    assert len(gathered) == 2
+    # a refresh already running on another thread is not started again
+    with server.message_loop._refreshing:
+        controller.ServerController.idle(server)
+    assert len(gathered) == 2
+
+
+def test_topic_subscriptions(tmp_path):
+    from cc2logger.fanout import FanOut
+    from cc2logger.messages import PlayerChat, DestroyedVehicle, CapturedIsland
+    from cc2logger.synthetic import generate_folder
+    generate_folder(tmp_path, 5000, files=1, newlines=0)
+    full = parser.CC2GameParser()
+    full.factory.keep_data = True
+    full.open(sorted(tmp_path.glob("*.jsonl"))[0])
+    expected = []
+    while (msg := full.read_one()) is not None:
+        expected.append(msg)
+    full.close()
+
+    p = parser.CC2GameFollower()
+    p.use_inotify = False
+    p.open_latest(tmp_path)
+    destroyed = []
+    p.subscribe(lambda msg: destroyed.append(msg) or True, [DestroyedVehicle])
+    p.fanout = FanOut()
+    captured = []
+    p.fanout.subscribe(captured.append, types=["island_captured"])
+    messages = []
+    while (msg := p.read_one()) is not None:
+        messages.append(msg)
+    p.fanout.close(timeout=5)
+    # nothing wants chat so it is never built, the stats are the same as reading everything
+    assert p.factory.skipped == {"chat"}
+    assert not any(isinstance(x, PlayerChat) for x in messages)
+    assert len(messages) == len([x for x in expected if not isinstance(x, PlayerChat)])
+    assert [x.vehicle_id for x in destroyed] == [x.vehicle_id for x in expected if isinstance(x, DestroyedVehicle)]
+    assert [x.island_id for x in captured] == [x.island_id for x in expected if isinstance(x, CapturedIsland)]
+    assert p.duration == full.duration
+    assert p.destroyed_stats == full.destroyed_stats
+    assert {x: y.total_playtime for x, y in p.players.items()} == {x: y.total_playtime for x, y in full.players.items()}
+
+    # a callback for everything needs every message built again
+    p.close()
+    chats = []
+    p.callbacks.append(lambda msg: isinstance(msg, PlayerChat) and chats.append(msg))
+    p.open(p.latest_file)
+    while p.read_one() is not None:
+        pass
+    assert not p.factory.skipped
+    assert len(chats) == len([x for x in expected if isinstance(x, PlayerChat)])
+    p.close()
+
+
+def test_event_pipeline(tmp_path):
+    import itertools, threading
+    from datetime import datetime, timezone
+    from cc2logger.messages import MessageFactory, PlayerChat
+    from cc2logger.pipeline import iter_events, between, filter_type, window
+    from cc2logger.synthetic import generate_folder
+    logs = generate_folder(tmp_path, 6000, files=3, newlines=0)
+    everything = list(iter_events(tmp_path))
+    assert len(everything) == 6000
+
+    chat = list(iter_events(tmp_path).filter_type(PlayerChat))
+    assert [(x.epoch, x.message) for x in chat] == [(x.epoch, x.message) for x in everything if x.type == "chat"]
+    # the same types pushed down to the raw records
+    assert len(list(iter_events(tmp_path, types=["chat"]))) == len(chat)
+
+    player = chat[10].player_name
+    mine = iter_events(tmp_path).by_player(player).aggregate("type")
+    assert sum(mine.values()) == len([x for x in everything if getattr(x, "player_name", None) == player])
+    assert iter_events(tmp_path).aggregate("type") == iter_events(tmp_path).aggregate(lambda x: x.type)
+
+    start = datetime.fromtimestamp(everything[2500].epoch, tz=timezone.utc)
+    end = everything[3500].epoch
+    ranged = list(iter_events(tmp_path).between(start, end))
+    assert [x.epoch for x in ranged] == [x.epoch for x in everything if start.timestamp() <= x.epoch <= end]
+    assert len(list(iter_events(tmp_path, start=start, end=end))) == len(ranged)
+
+    windows = list(iter_events(tmp_path).window(600))
+    assert sum(len(batch) for _, batch in windows) == 6000
+    assert all(x.epoch - x.epoch % 600 == bucket for bucket, batch in windows for x in batch)
+
+    # stages stream, an endless source is only read as far as the events are taken
+    factory = MessageFactory()
+    endless = (factory.parse({"timestamp": datetime.fromtimestamp(1735689600 + x, tz=timezone.utc).isoformat(),
+                              "type": "island_captured", "island_id": "1", "team": "1"}) for x in itertools.count())
+    windows = window(filter_type(between(endless, end=1735689600 + 99), "island_captured"), 10)
+    assert [len(batch) for _, batch in itertools.islice(windows, 5)] == [10] * 5
+
+    # a message written out of order after one past the end is still in range
+    late = [factory.parse({"timestamp": datetime.fromtimestamp(1735689600 + x, tz=timezone.utc).isoformat(),
+                           "type": "island_captured", "island_id": str(x), "team": "1"}) for x in [1, 2, 9, 3, 4, 9]]
+    assert [x.island_id for x in between(late, 1735689600 + 2, 1735689600 + 5)] == [2, 3, 4]
+    out_of_order = tmp_path / "out_of_order"
+    out_of_order.mkdir()
+    with (out_of_order / "game_log_2025-01-01_00-00-00.jsonl").open("w") as fd:
+        for x in [1, 2, 9, 3, 4, 9]:
+            print(f'{{"timestamp": "2025-01-01T00:00:0{x}Z", "type": "island_captured", "island_id": "{x}", '
+                  f'"team": "1"}}', file=fd)
+    assert [x.island_id for x in iter_events(out_of_order).between(1735689602, 1735689605)] == [2, 3, 4]
+    assert [x.island_id for x in iter_events(out_of_order, start=1735689602, end=1735689605)] == [2, 3, 4]
+
+    # the summary is a consumer of the same events
+    for logfile in logs:
+        summary = iter_events(logfile).summary()
+        p = parser.CC2GameParser()
+        p.read(logfile)
+        assert summary.get_state() == p.get_state()
+
+    # and a live follower is a source like any other
+    live = tmp_path / "live"
+    live.mkdir()
+    record = '{{"timestamp": "2025-01-01T00:00:0{0}Z", "type": "{1}", "island_id": "{0}", "team": "1"}}\n'
+    logfile = live / "game_log_2025-01-01_00-00-00.jsonl"
+    logfile.write_text(record.format(1, "island_captured"))
+    follower = parser.CC2GameFollower()
+    follower.use_inotify = False
+    follower.open_latest(live)
+
+    def writer():
+        with logfile.open("a") as fd:
+            for n in range(2, 6):
+                fd.write(record.format(n, "island_captured" if n % 2 else "destroy_vehicle"))
+                fd.flush()
+
+    seen = []
+    thread = threading.Thread(target=writer)
+    for message in iter_events(follower, poll_interval=0.02).filter_type("island_captured"):
+        seen.append(message.island_id)
+        if len(seen) == 1:
+            thread.start()
+        if len(seen) == 3:
+            follower.request_stop()
+    thread.join()
+    assert seen == [1, 3, 5]
+    assert not any(follower.topics.values())
+    follower.close()
+
+    # a live log ends at the first message past end
+    follower = parser.CC2GameFollower()
+    follower.use_inotify = False
+    follower.open_latest(live)
+    assert [x.epoch - 1735689600 for x in iter_events(follower, end=1735689603, poll_interval=0.02)] == [1, 2, 3]
+    follower.close()
+
+
+def test_topic_resubscribe(tmp_path):
+    from cc2logger.messages import DestroyedVehicle
+    record = '{"timestamp": "2025-01-01T00:00:00Z", "type": "destroy_vehicle", "vehicle_id": "1", "vehicle_type": "2", "team": "1"}\n'
+    logfile = tmp_path / "game_log_2025-01-01_00-00-00.jsonl"
+    logfile.write_text(record)
+    p = parser.CC2GameFollower()
+    p.use_inotify = False
+    p.open_latest(tmp_path)
+    first = []
+    second = []
+    p.subscribe(first.append, [DestroyedVehicle])
+    p.subscribe(second.append, ["destroy_vehicle"])
+    assert p.read_one()
+    assert "chat" not in p.factory.dispatch
+    # the same number of subscriptions, now for a different type
+    p.unsubscribe(first.append)
+    got = []
+    p.subscribe(got.append, ["chat"])
+    with logfile.open("a") as fd:
+        fd.write('{"timestamp": "2025-01-01T00:00:01Z", "type": "chat", "player_name": "bob", '
+                 '"player_id": "1", "message": "hi"}\n')
+    assert p.read_one().message == "hi"
+    assert [x.message for x in got] == ["hi"]
+    p.close()
+
+
+def test_slotted_messages():
+    import threading
+    from datetime import datetime, timezone
+    from cc2logger.messages import MessageFactory, PlayerChat, DestroyedVehicle, parse_epoch
+
+    factory = MessageFactory(keep_data=True)
+    data = {"timestamp": "2025-01-01T00:00:05Z", "type": "chat", "player_name": "bob",
+            "player_id": "76561198000000001", "team_id": "2", "message": "hi"}
+    chat = factory.parse(data)
+    assert isinstance(chat, PlayerChat)
+    assert (chat.epoch, chat.player_id, chat.player_name, chat.message) == (1735689605, 76561198000000001, "bob", "hi")
+    assert chat.timestamp == datetime(2025, 1, 1, 0, 0, 5, tzinfo=timezone.utc)
+    assert chat.data is data
+    assert not hasattr(chat, "__dict__")
+    with pytest.raises(AttributeError):
+        chat.colour = "red"
+    chat.timestamp = datetime(2025, 1, 2, tzinfo=timezone.utc)
+    assert chat.epoch == 1735776000
+    kill = factory.parse({"timestamp": "2025-01-01T00:00:00", "type": "destroy_vehicle",
+                          "vehicle_id": "3", "vehicle_type": "2", "team": "1"})
+    assert isinstance(kill, DestroyedVehicle)
+    # naive timestamps are UTC
+    assert (kill.epoch, kill.vehicle_id, kill.vehicle_type, kill.team) == (1735689600, 3, 2, 1)
+    assert factory.parse({"timestamp": "2025-01-01T00:00:00Z", "type": "unknown"}) is None
+
+    # player ids are shared within a factory only, names that are not strings are kept as they are
+    again = factory.parse(dict(data, player_name=None))
+    assert again.player_id is chat.player_id
+    assert again.player_name is None
+    assert factory.parse(dict(data, player_name=12)).player_name == 12
+    other = MessageFactory().parse(data)
+    assert other.player_id == chat.player_id and other.player_id is not chat.player_id
+
+    # the cached last timestamp never pairs one thread's stamp with another's epoch
+    stamps = [f"2025-01-01T00:00:{x:02d}Z" for x in range(60)]
+    wrong = []
+
+    def convert(offset):
+        for i in range(5000):
+            second = (i + offset) % 60
+            if parse_epoch(stamps[second]) != 1735689600 + second:
+                wrong.append(second)
+
+    threads = [threading.Thread(target=convert, args=(x,)) for x in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert wrong == []